@@ -16,7 +16,9 @@ application = get_asgi_application()
 
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-from django_private_chat2 import urls
+from chat import urls
+from KindaEbay.metrics import start_exporter
+start_exporter()
 application = ProtocolTypeRouter({
     "http": application,
     "websocket": AuthMiddlewareStack(
@@ -0,0 +1,62 @@
+"""
+SQLite backend tuned for several concurrent workers.
+
+Django's sqlite3 backend opens connections with SQLite's defaults: a
+rollback journal (readers and the writer block each other), a full fsync on
+every commit, and deferred transactions.  A deferred transaction that reads
+first and writes later has to upgrade its lock, and if another connection
+wrote in the meantime SQLite fails it at once with "database is locked" --
+the busy timeout doesn't apply.  This backend
+
+* runs ``PRAGMAS`` (WAL, synchronous=NORMAL, busy_timeout, page cache and
+  mmap size) on every new connection; ``OPTIONS['pragmas']`` adds to or,
+  with a None value, drops from them, and
+* starts atomic blocks with ``BEGIN IMMEDIATE`` (``OPTIONS['transaction_mode']``),
+  so a transaction waits for the write lock up front, where busy_timeout
+  applies, instead of failing halfway.
+
+Its connections also pass every query through KindaEbay.perf.record_query,
+which charges it to the current request when that instrumentation is on.
+
+Use it with ENGINE 'KindaEbay.db'.  See KindaEbay.db.routers for sending
+reads to a read-only connection.
+"""
+from django.db.backends.sqlite3 import base
+
+from KindaEbay import perf
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    # Negative: KiB rather than pages.
+    'cache_size': -32000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.execute_wrappers.append(perf.record_query)
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        pragmas = dict(PRAGMAS, **kwargs.pop('pragmas', {}))
+        self.pragmas = {name: value for name, value in pragmas.items() if value is not None}
+        self.transaction_mode = kwargs.pop('transaction_mode', 'IMMEDIATE').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ValueError("transaction_mode must be one of %s." % ', '.join(TRANSACTION_MODES))
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute('PRAGMA %s = %s' % (name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN %s' % self.transaction_mode)
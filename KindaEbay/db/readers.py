@@ -0,0 +1,60 @@
+"""
+Run read-only database work from async code.
+
+Django 3.2 has no async ORM, so async views still run their queries in a
+thread.  sync_to_async's default (thread_sensitive) sends that work, every
+sync view and every database_sync_to_async call of the chat consumers to
+one shared thread per process, where a slow listing query holds up chat
+writes and other page views.  Reads that go to the read-only replica
+connection (KindaEbay.db.routers) can run side by side instead:
+read_to_async() runs them on a pool of ``settings.DATABASE_READER_THREADS``
+threads, each keeping its own connection for CONN_MAX_AGE like the request
+thread does.  Rendering is CPU-bound and holds the GIL, so more threads
+than that mostly add contention.
+
+Without a separate replica (e.g. under the test runner, where only the
+shared thread's connection sees the test transaction) it falls back to the
+shared thread.
+"""
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .routers import ReadReplicaRouter
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The process-wide pool of reader threads."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(getattr(settings, 'DATABASE_READER_THREADS', 4),
+                                           thread_name_prefix='db-reader')
+    return _executor
+
+
+def _with_connection_upkeep(func):
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        # What request_started/request_finished do for the request thread.
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return inner
+
+
+def read_to_async(func):
+    """Like sync_to_async(func), for functions that only read from the database."""
+    if ReadReplicaRouter().replica_available():
+        return sync_to_async(_with_connection_upkeep(func), thread_sensitive=False, executor=get_executor())
+    return sync_to_async(func)
@@ -0,0 +1,42 @@
+"""
+Send reads to a read-only connection on the same SQLite file.
+
+With WAL, readers don't wait for the writer, so giving reads their own
+connection (``REPLICA``, opened with ``mode=ro``) keeps page views moving
+while the default connection holds the write lock.  It is the same file,
+so there is no replication lag: anything committed is visible to the next
+read.  Reads inside an atomic block on ``default`` stay there, so a
+transaction sees its own uncommitted writes.
+
+Under the test runner the replica is a TEST MIRROR of default.  TestCase
+wraps each test in a transaction on default that another connection can't
+see, so while both aliases name the same database everything goes to
+default.
+"""
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = 'replica'
+
+
+class ReadReplicaRouter:
+
+    def replica_available(self):
+        if REPLICA not in connections.databases:
+            return False
+        return (connections[REPLICA].settings_dict['NAME'] !=
+                connections[DEFAULT_DB_ALIAS].settings_dict['NAME'])
+
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block or not self.replica_available():
+            return DEFAULT_DB_ALIAS
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same database.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
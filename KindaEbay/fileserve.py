@@ -0,0 +1,185 @@
+"""
+Serving of uploaded media and collected static files.
+
+Replaces django.views.static.serve (which reads whole files in Python and
+knows nothing about ranges or caching) with a view that
+
+* answers single-range ``Range`` requests with 206 (honouring ``If-Range``),
+* sends ETag/Last-Modified and answers conditional requests with 304,
+* marks content-hashed names (content-addressed media blobs and their
+  derivatives, ManifestStaticFilesStorage names) as cacheable forever,
+* serves a precompressed ``.gz`` sibling of text assets to clients that
+  accept gzip (see KindaEbay.staticstorage), and
+* streams 64 KiB chunks.  Full files and ranges that run to the end of the
+  file are handed over as a file object, so a WSGI server with
+  ``wsgi.file_wrapper`` (gunicorn, uWSGI) sends them with os.sendfile();
+  under ASGI the same view streams the chunks.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+DEFAULT_MAX_AGE = 60 * 60
+
+# A path component that is a content hash: media blobs are stored as
+# .../<aa>/<sha256>.<ext> (their derivatives as .../<sha256>.<ext>.jpg),
+# ManifestStaticFilesStorage names look like name.<12 hex digits>.ext.
+HASHED_NAME_RE = re.compile(r'(?:/[0-9a-f]{2}/[0-9a-f]{64}(?:\.\w+)?|\.[0-9a-f]{12})\.\w+$')
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+ARCHIVE_TYPES = {
+    'gzip': 'application/gzip',
+    'bzip2': 'application/x-bzip',
+    'xz': 'application/x-xz',
+}
+
+
+class _FileResponse(FileResponse):
+    block_size = CHUNK_SIZE
+
+    def set_headers(self, filelike):
+        # serve() sets Content-Type/Length itself; don't guess a type from a
+        # .gz name or add a Content-Disposition.
+        pass
+
+
+def is_immutable(path):
+    return HASHED_NAME_RE.search('/' + path) is not None
+
+
+def parse_range(header, size):
+    """
+    Return ``(start, end)`` (inclusive) for a single-range ``Range`` header,
+    None if the header should be ignored, or False if it is unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Malformed or multiple ranges: RFC 7233 allows ignoring them.
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        return False
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _etag(st, encoding=''):
+    return '"%x-%x%s"' % (st.st_mtime_ns, st.st_size, encoding)
+
+
+def serve(request, path, document_root=None):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponse(status=405)
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(document_root, path)
+        st = os.stat(fullpath)
+    except (SuspiciousFileOperation, ValueError, OSError):
+        raise Http404('"%s" does not exist' % path)
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404('"%s" does not exist' % path)
+
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    if encoding:
+        # An archive on disk is served as-is, not as a compressed transfer.
+        content_type = ARCHIVE_TYPES.get(encoding, 'application/octet-stream')
+    content_type = content_type or 'application/octet-stream'
+    compressible = fullpath.endswith(COMPRESSIBLE_EXTENSIONS)
+    range_header = request.META.get('HTTP_RANGE')
+
+    content_encoding = None
+    if (compressible and not range_header
+            and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        try:
+            gz_st = os.stat(fullpath + '.gz')
+        except OSError:
+            pass
+        else:
+            if gz_st.st_mtime_ns >= st.st_mtime_ns:
+                fullpath, st, content_encoding = fullpath + '.gz', gz_st, 'gzip'
+
+    etag = _etag(st, '-gz' if content_encoding else '')
+    last_modified = int(st.st_mtime)
+
+    def finish(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Accept-Ranges'] = 'bytes'
+        if is_immutable(path):
+            response['Cache-Control'] = 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+        else:
+            response['Cache-Control'] = 'public, max-age=%d' % DEFAULT_MAX_AGE
+        if compressible:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return finish(not_modified)
+
+    byte_range = None
+    if range_header:
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or if_range == etag or parse_http_date_safe(if_range) == last_modified:
+            byte_range = parse_range(range_header, st.st_size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % st.st_size
+        return finish(response)
+
+    if byte_range is None:
+        response = _FileResponse(open(fullpath, 'rb'), content_type=content_type)
+        response['Content-Length'] = st.st_size
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        if end == st.st_size - 1:
+            f = open(fullpath, 'rb')
+            f.seek(start)
+            response = _FileResponse(f, content_type=content_type, status=206)
+        else:
+            response = StreamingHttpResponse(_read_range(fullpath, start, length),
+                                             content_type=content_type, status=206)
+        response['Content-Length'] = length
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, st.st_size)
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+    return finish(response)
+
+
+def serve_media(request, path):
+    return serve(request, path, document_root=settings.MEDIA_ROOT)
+
+
+def serve_static(request, path):
+    return serve(request, path, document_root=settings.STATIC_ROOT)
@@ -0,0 +1,354 @@
+"""
+Prometheus text-format metrics at /metrics, summed over worker processes.
+
+Each process keeps its own numbers: the per-URL request histograms of
+KindaEbay.perf (kept per thread, so recording a request takes no lock),
+chat.presence's websocket connections and chat.writebehind's queue.  The
+process started through KindaEbay/asgi.py or wsgi.py runs an exporter
+thread that writes them to ``<DIR>/<pid>-<start>.json`` every ``INTERVAL``
+seconds (and at exit); ``<start>`` is when the process started, so a new
+process that reuses a pid doesn't overwrite an old one's file or pass for
+it.  Whichever worker answers /metrics writes its own file fresh, reads
+everyone's, and sums them:
+
+* counters and histograms over every file plus ``retired.json``, into
+  which the files of processes that have exited are folded (and then
+  removed), so a worker that restarted keeps what it counted before;
+* gauges over the processes still running only.
+
+The channel-layer queue depth is read from the layer at scrape time; with
+SQLiteChannelLayer it covers every process.  With a ``DIR`` configured,
+KindaEbay.perf records every request for the HTTP metrics.  Settings live
+in ``settings.METRICS``; /metrics answers only ``ALLOWED_IPS``.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from . import perf
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'DIR': None,
+    'INTERVAL': 10,
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+RETIRED = 'retired.json'
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, 'METRICS', {}))
+
+
+def process_start(pid):
+    """When ``pid`` started, in clock ticks since boot, or None where /proc can't tell."""
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # field 22; the command name before it may contain spaces and parentheses
+    return stat[stat.rindex(')') + 2:].split()[19]
+
+
+_identity = None
+
+
+def process_identity():
+    """(pid, start) of this process."""
+    global _identity
+    if _identity is None or _identity[0] != os.getpid():
+        pid = os.getpid()
+        _identity = (pid, process_start(pid) or 't%d' % time.time_ns())
+    return _identity
+
+
+def process_snapshot():
+    """This process's metrics, as written to its file."""
+    pid, started = process_identity()
+    from chat import presence, writebehind
+    buffer = writebehind.get_buffer().stats()
+    online = presence.get_registry().stats()
+    return {
+        'pid': pid,
+        'started': started,
+        'time': time.time(),
+        'http': {route: histogram.as_dict() for route, histogram in perf.get_registry().histograms().items()},
+        'counters': {
+            'chat_messages_written': buffer['messages_written'],
+            'chat_write_flushes': buffer['flushes'],
+            'chat_write_flush_errors': buffer['flush_errors'],
+            'presence_broadcasts': online['broadcasts'],
+            'presence_events_sent': online['events_sent'],
+        },
+        'gauges': {
+            'websocket_connections': online['local_connections'],
+            'chat_users_connected': online['local_users'],
+            'chat_write_queue_depth': buffer['queue_depth'],
+        },
+    }
+
+
+def snapshot_path(directory, pid, started):
+    return os.path.join(directory, '%d-%s.json' % (pid, started))
+
+
+def write_snapshot(snapshot=None):
+    directory = get_config()['DIR']
+    if directory is None:
+        return
+    snapshot = snapshot or process_snapshot()
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path(directory, snapshot['pid'], snapshot['started'])
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(path + '.tmp', path)
+
+
+def read_snapshots():
+    """The other processes' last snapshots."""
+    directory = get_config()['DIR']
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, '*-*.json')) if directory else []:
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if (snapshot['pid'], snapshot['started']) != process_identity():
+            snapshots.append(snapshot)
+    return snapshots
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def process_alive(snapshot):
+    """Whether the process that wrote ``snapshot`` is running, not just some process with its pid."""
+    if not pid_alive(snapshot['pid']):
+        return False
+    started = process_start(snapshot['pid'])
+    return started is None or started == snapshot['started']
+
+
+def retire(dead):
+    """
+    Fold the ``dead`` processes' snapshots into the retired totals, remove
+    their files and return the totals.
+
+    The totals remember which files they hold until the files are gone, so
+    a scrape that dies between the two steps doesn't count a file twice.
+    """
+    directory = get_config()['DIR']
+    if directory is None:
+        return {'http': {}, 'counters': {}}
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, RETIRED)
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path) as f:
+                retired = json.load(f)
+        except (OSError, ValueError):
+            retired = {'http': {}, 'counters': {}, 'files': []}
+        files = [filename for filename in retired['files'] if os.path.exists(os.path.join(directory, filename))]
+        changed = len(files) != len(retired['files'])
+        for snapshot in dead:
+            filename = os.path.basename(snapshot_path(directory, snapshot['pid'], snapshot['started']))
+            if filename in files or not os.path.exists(os.path.join(directory, filename)):
+                continue
+            http = perf.merge_histograms(*(
+                {route: perf.LatencyHistogram.from_dict(data) for route, data in group.items()}
+                for group in (retired['http'], snapshot['http'])))
+            retired['http'] = {route: histogram.as_dict() for route, histogram in http.items()}
+            for name, value in snapshot['counters'].items():
+                retired['counters'][name] = retired['counters'].get(name, 0) + value
+            files.append(filename)
+            changed = True
+        retired['files'] = files
+        if changed:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(retired, f)
+            os.replace(path + '.tmp', path)
+        for filename in files:
+            try:
+                os.remove(os.path.join(directory, filename))
+            except FileNotFoundError:
+                pass
+    return retired
+
+
+# Exporter thread
+
+_exporter_pid = None
+_exporter_lock = threading.Lock()
+
+
+def _export(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_snapshot()
+        except Exception:
+            logger.exception("Writing the metrics snapshot failed")
+
+
+def start_exporter():
+    """Write this process's snapshot periodically and at exit (once per process)."""
+    global _exporter_pid
+    config = get_config()
+    if config['DIR'] is None:
+        return
+    with _exporter_lock:
+        if _exporter_pid == os.getpid():
+            return
+        first = _exporter_pid is None
+        _exporter_pid = os.getpid()
+    threading.Thread(target=_export, args=(config['INTERVAL'],), name='metrics-exporter', daemon=True).start()
+    if first:
+        atexit.register(write_snapshot)
+        # A server that imports the app and then forks its workers.
+        os.register_at_fork(after_in_child=start_exporter)
+
+
+# Aggregation and exposition
+
+def channel_layer_depth():
+    layer = get_channel_layer()
+    if hasattr(layer, 'queue_depth'):
+        return layer.queue_depth()
+    # InMemoryChannelLayer: this process only
+    queues = list(getattr(layer, 'channels', {}).values())
+    return {
+        'messages': sum(queue.qsize() for queue in queues),
+        'channels': sum(1 for queue in queues if queue.qsize()),
+        'max_channel_depth': max([queue.qsize() for queue in queues] or [0]),
+        'local_buffered': 0,
+    }
+
+
+def aggregate(local, others, retired):
+    """Sum ``local`` and the ``others`` (still running) with the ``retired`` totals."""
+    live = [local] + others
+    every = live + [retired]
+    http = perf.merge_histograms(*(
+        {route: perf.LatencyHistogram.from_dict(data) for route, data in snapshot['http'].items()}
+        for snapshot in every))
+    counters, gauges = {}, {}
+    for snapshot in every:
+        for name, value in snapshot['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+    for snapshot in live:
+        for name, value in snapshot['gauges'].items():
+            gauges[name] = gauges.get(name, 0) + value
+    gauges['processes'] = len(live)
+    return http, counters, gauges
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in labels.items())
+
+
+def _value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Exposition:
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, description):
+        self.lines.append('# HELP kindaebay_%s %s' % (name, description))
+        self.lines.append('# TYPE kindaebay_%s %s' % (name, kind))
+
+    def sample(self, name, value, labels=''):
+        self.lines.append('kindaebay_%s%s %s' % (name, labels, _value(value)))
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def render_metrics(http, counters, gauges, layer):
+    out = Exposition()
+    routes = sorted(http.items())
+
+    def labels(route, histogram, **extra):
+        return _labels(view=histogram.view or '', route=route, **extra)
+
+    out.family('http_requests_total', 'counter', 'HTTP requests by view and status class.')
+    for route, histogram in routes:
+        for status, count in sorted(histogram.statuses.items()):
+            out.sample('http_requests_total', count, labels(route, histogram, status=status))
+    out.family('http_request_duration_seconds', 'histogram', 'HTTP request wall time by view.')
+    for route, histogram in routes:
+        cumulative = 0
+        for bound, count in zip(perf.BUCKETS_MS, histogram.buckets):
+            cumulative += count
+            out.sample('http_request_duration_seconds_bucket', cumulative,
+                       labels(route, histogram, le=_value(bound / 1000)))
+        out.sample('http_request_duration_seconds_bucket', histogram.count, labels(route, histogram, le='+Inf'))
+        out.sample('http_request_duration_seconds_sum', histogram.seconds, labels(route, histogram))
+        out.sample('http_request_duration_seconds_count', histogram.count, labels(route, histogram))
+    for name, attribute, description in (
+            ('db_queries_total', 'queries', 'SQL queries run by requests, by view.'),
+            ('db_query_seconds_total', 'sql_seconds', 'Time spent in SQL by requests, by view.'),
+            ('template_render_seconds_total', 'render_seconds', 'Time spent rendering templates, by view.')):
+        out.family(name, 'counter', description)
+        for route, histogram in routes:
+            out.sample(name, getattr(histogram, attribute), labels(route, histogram))
+
+    for name, description in (
+            ('chat_messages_written', 'Chat messages written by the write-behind buffer.'),
+            ('chat_write_flushes', 'Write-behind batches written.'),
+            ('chat_write_flush_errors', 'Write-behind batches that failed.'),
+            ('presence_broadcasts', 'Coalesced presence broadcasts.'),
+            ('presence_events_sent', 'Presence events sent to online partners.')):
+        out.family(name + '_total', 'counter', description)
+        out.sample(name + '_total', counters.get(name, 0))
+    for name, description in (
+            ('websocket_connections', 'Open authenticated chat websocket connections.'),
+            ('chat_users_connected', 'Users with a chat websocket open, summed per process.'),
+            ('chat_write_queue_depth', 'Chat messages waiting in write-behind buffers.'),
+            ('processes', 'Worker processes reporting metrics.')):
+        out.family(name, 'gauge', description)
+        out.sample(name, gauges.get(name, 0))
+    for name, key, description in (
+            ('channel_layer_messages', 'messages', 'Undelivered channel-layer messages.'),
+            ('channel_layer_channels', 'channels', 'Channels with undelivered messages.'),
+            ('channel_layer_max_channel_depth', 'max_channel_depth', 'Longest channel queue.')):
+        out.family(name, 'gauge', description)
+        out.sample(name, layer[key])
+    return out.render()
+
+
+def metrics_view(request):
+    if request.META.get('REMOTE_ADDR') not in get_config()['ALLOWED_IPS']:
+        return HttpResponseForbidden()
+    local = process_snapshot()
+    write_snapshot(local)
+    others = read_snapshots()
+    live = [snapshot for snapshot in others if process_alive(snapshot)]
+    retired = retire([snapshot for snapshot in others if snapshot not in live])
+    http, counters, gauges = aggregate(local, live, retired)
+    return HttpResponse(render_metrics(http, counters, gauges, channel_layer_depth()), content_type=CONTENT_TYPE)
@@ -0,0 +1,351 @@
+"""
+Per-request performance instrumentation.
+
+PerfMiddleware (first in MIDDLEWARE) times each request and records it
+per URL pattern in latency histograms kept in this process, shown to staff
+at /_perf/ (which can start them over) and exported by KindaEbay.metrics
+(which never does).  With ``SERVER_TIMING`` on it also adds a Server-Timing
+header, e.g.::
+
+    Server-Timing: total;dur=12.4, db;dur=3.1;desc="5 queries", tpl;dur=6.0
+
+so the browser's network panel shows where the time went.  That tells
+anyone how long queries take, so it is off by default.
+
+* SQL: connections of the KindaEbay.db backend have record_query() as an
+  execute wrapper (the mechanism behind connection.execute_wrapper()) from
+  the start.  It charges queries to the request in the ``_current``
+  context variable, which sync_to_async copies into its threads, so
+  queries that async views run on the reader pool (KindaEbay.db.readers)
+  count too.
+* Templates: the DjangoTemplates backend below times top-level renders;
+  includes and nested render_to_string() calls are part of their parent's.
+
+Settings live in ``settings.PERF``.  Requests are recorded when ``ENABLED``
+is on or KindaEbay.metrics has a ``DIR`` to export to; otherwise the
+middleware raises MiddlewareNotUsed and drops out of the chain, and what
+remains is a context variable lookup per query and per template render.
+"""
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import MiddlewareNotUsed
+from django.shortcuts import render
+from django.template.backends import django as django_backend
+from django.utils.deprecation import MiddlewareMixin
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SERVER_TIMING': False,
+}
+# Upper bounds of the histogram buckets, in milliseconds.
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+UNRESOLVED = '(unresolved)'
+
+_current = contextvars.ContextVar('perf_request', default=None)
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, 'PERF', {}))
+
+
+def recording():
+    """Whether requests are recorded, for /_perf/ or for /metrics."""
+    from . import metrics
+    return get_config()['ENABLED'] or metrics.get_config()['DIR'] is not None
+
+
+class RequestStats:
+    __slots__ = ('queries', 'sql_seconds', 'render_seconds', 'rendering')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.rendering = False
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.sql_seconds += time.perf_counter() - started
+
+
+class Template(django_backend.Template):
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None or stats.rendering:
+            return super().render(context, request)
+        stats.rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.rendering = False
+            stats.render_seconds += time.perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """DjangoTemplates whose renders are charged to the current request."""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
+
+
+class LatencyHistogram:
+
+    FIELDS = ('url_name', 'view', 'count', 'seconds', 'queries', 'sql_seconds', 'render_seconds',
+              'max_seconds', 'buckets', 'statuses')
+
+    def __init__(self, url_name, view=None):
+        self.url_name = url_name
+        self.view = view
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.max_seconds = 0.0
+        # the last one counts everything slower than BUCKETS_MS[-1]
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        # '2xx' -> count
+        self.statuses = {}
+
+    def record(self, seconds, stats, status=200):
+        self.count += 1
+        self.seconds += seconds
+        self.queries += stats.queries
+        self.sql_seconds += stats.sql_seconds
+        self.render_seconds += stats.render_seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.buckets[bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+        status = '%dxx' % (status // 100)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.seconds += other.seconds
+        self.queries += other.queries
+        self.sql_seconds += other.sql_seconds
+        self.render_seconds += other.render_seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        for status, count in list(other.statuses.items()):
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data['url_name'], data['view'])
+        for field in cls.FIELDS[2:]:
+            setattr(histogram, field, data[field])
+        return histogram
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the ``p`` quantile, in ms."""
+        rank, seen = p * self.count, 0
+        for bound, count in zip(BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max_seconds * 1000
+
+    def summary(self):
+        count = self.count or 1
+        return {
+            'url_name': self.url_name,
+            'view': self.view,
+            'count': self.count,
+            'mean_ms': self.seconds / count * 1000,
+            'p50_ms': self.percentile(0.5),
+            'p90_ms': self.percentile(0.9),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max_seconds * 1000,
+            'mean_queries': self.queries / count,
+            'mean_sql_ms': self.sql_seconds / count * 1000,
+            'mean_render_ms': self.render_seconds / count * 1000,
+            'buckets': list(zip(BUCKETS_MS + (None,), self.buckets)),
+        }
+
+
+def merge_histograms(*groups):
+    """Merge {route: LatencyHistogram} dicts into new histograms."""
+    merged = {}
+    for group in groups:
+        for route, histogram in list(group.items()):
+            if route not in merged:
+                merged[route] = LatencyHistogram(histogram.url_name, histogram.view)
+            merged[route].merge(histogram)
+    return merged
+
+
+class _Shard:
+    __slots__ = ('totals', 'recent', 'generation')
+
+    def __init__(self, generation):
+        self.totals = {}
+        self.recent = {}
+        self.generation = generation
+
+
+class PerfRegistry:
+    """
+    Latency histograms by URL pattern, for this process.
+
+    There are two sets: ``histograms()`` counts everything since the process
+    started (what /metrics exports as counters), ``snapshot()`` only what came
+    since the last ``reset()`` (what /_perf/ shows).  Each thread records into
+    its own histograms without taking a lock; reading merges them, and folds
+    in and drops those of threads that have exited.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = {}
+        self._retired = {}
+        self._retired_recent = {}
+        # bumped by reset(); a shard's recent histograms from before are stale
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(self._generation)
+            with self._lock:
+                self._shards[threading.current_thread()] = shard
+        return shard
+
+    def record(self, route, url_name, seconds, stats, status=200, view=None):
+        shard = self._shard()
+        if shard.generation != self._generation:
+            # Reset since this thread last recorded; only it replaces its dict.
+            shard.recent, shard.generation = {}, self._generation
+        for histograms in (shard.totals, shard.recent):
+            histogram = histograms.get(route)
+            if histogram is None:
+                histogram = histograms[route] = LatencyHistogram(url_name, view)
+            histogram.record(seconds, stats, status)
+
+    def _merged(self, recent):
+        with self._lock:
+            for thread, shard in list(self._shards.items()):
+                if not thread.is_alive():
+                    self._retired = merge_histograms(self._retired, shard.totals)
+                    if shard.generation == self._generation:
+                        self._retired_recent = merge_histograms(self._retired_recent, shard.recent)
+                    del self._shards[thread]
+            if not recent:
+                return merge_histograms(self._retired, *(shard.totals for shard in self._shards.values()))
+            return merge_histograms(self._retired_recent, *(
+                shard.recent for shard in self._shards.values() if shard.generation == self._generation))
+
+    def histograms(self):
+        """{route: LatencyHistogram} merged over all threads, since the process started."""
+        return self._merged(recent=False)
+
+    def snapshot(self):
+        """{route: summary} since the last reset()"""
+        return {route: histogram.summary() for route, histogram in self._merged(recent=True).items()}
+
+    def reset(self):
+        """Start snapshot() over; histograms() keeps counting."""
+        with self._lock:
+            self._generation += 1
+            self._retired_recent = {}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """The process-wide registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = PerfRegistry()
+    return _registry
+
+
+def view_path(func):
+    """'products.views.product_list_view', 'chat.views.UsersListView'"""
+    func = getattr(func, 'view_class', func)
+    return '%s.%s' % (func.__module__, getattr(func, '__qualname__', type(func).__qualname__))
+
+
+class PerfMiddleware(MiddlewareMixin):
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not recording():
+            raise MiddlewareNotUsed()
+        self.server_timing = config['SERVER_TIMING']
+        self.registry = get_registry()
+        super().__init__(get_response)
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        stats, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def _acall(self, request):
+        stats, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, started)
+
+    def start(self):
+        stats = RequestStats()
+        return stats, _current.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, started):
+        seconds = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            route, url_name, view = UNRESOLVED, None, None
+        else:
+            # url names repeat ('home'); patterns don't
+            route, url_name, view = match.route or match.view_name, match.url_name, view_path(match.func)
+        self.registry.record(route, url_name, seconds, stats, response.status_code, view)
+        if self.server_timing:
+            response['Server-Timing'] = 'total;dur=%.1f, db;dur=%.1f;desc="%d queries", tpl;dur=%.1f' % (
+                seconds * 1000, stats.sql_seconds * 1000, stats.queries, stats.render_seconds * 1000)
+        return response
+
+
+@staff_member_required
+def perf_view(request):
+    if request.method == 'POST' and 'reset' in request.POST:
+        get_registry().reset()
+    rows = sorted(get_registry().snapshot().items(), key=lambda item: -item[1]['count'] * item[1]['mean_ms'])
+    return render(request, 'perf.html', {
+        'enabled': recording(),
+        'rows': rows,
+        'buckets': BUCKETS_MS,
+    })
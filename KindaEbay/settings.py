@@ -15,6 +15,7 @@ from pathlib import Path
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 from os.path import join
+from urllib.request import pathname2url
 BASE_DIR = Path(__file__).resolve().parent.parent
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -27,6 +28,10 @@ SECRET_KEY = "42uykc*+-bjmn_ylqxiy-psw7ponktl_o3#&v8#47s!zd)p)%_"
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# ``manage.py test`` runs with a fast password hasher and throttling off
+# (KindaEbay/testrunner.py).
+TEST_RUNNER = 'KindaEbay.testrunner.DiscoverRunner'
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -48,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'KindaEbay.perf.PerfMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -61,7 +67,7 @@ ROOT_URLCONF = 'KindaEbay.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'KindaEbay.perf.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,11 +87,117 @@ WSGI_APPLICATION = 'KindaEbay.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.9/ref/settings/#databases
 
+# KindaEbay.db is the sqlite3 backend with WAL, synchronous=NORMAL and a busy
+# timeout set on every connection, and BEGIN IMMEDIATE for transactions (see
+# KindaEbay/db/base.py).  Connections are kept for CONN_MAX_AGE seconds
+# instead of being opened per request.  'replica' is the same file opened
+# read-only; ReadReplicaRouter sends reads there (see KindaEbay/db/routers.py).
+
+DATABASE_PATH = os.path.join(BASE_DIR, 'db.sqlite3')
+DATABASE_CONN_MAX_AGE = int(os.environ.get('KINDAEBAY_CONN_MAX_AGE', 600))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'ENGINE': 'KindaEbay.db',
+        'NAME': DATABASE_PATH,
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+    },
+    'replica': {
+        'ENGINE': 'KindaEbay.db',
+        'NAME': 'file:%s?mode=ro' % pathname2url(DATABASE_PATH),
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'OPTIONS': {
+            # journal_mode is a write; the default connection sets it.
+            'pragmas': {'journal_mode': None, 'query_only': 'ON'},
+        },
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['KindaEbay.db.routers.ReadReplicaRouter']
+
+# Threads async views run their replica reads and rendering on (see
+# KindaEbay/db/readers.py).
+DATABASE_READER_THREADS = int(os.environ.get('KINDAEBAY_READER_THREADS', 4))
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# KINDAEBAY_CACHE=locmem|file|db picks the backend.  locmem is per process,
+# so management commands can't invalidate what the web workers cached; use
+# file or db (after ``manage.py createcachetable``) with several workers.
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'kindaebay',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': join(BASE_DIR, 'cache'),
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+    },
+}
+
+CACHES = {
+    'default': dict(CACHE_BACKENDS[os.environ.get('KINDAEBAY_CACHE', 'locmem')],
+                    OPTIONS={'MAX_ENTRIES': 10000}),
+}
+
+# Request instrumentation (KindaEbay/perf.py)
+# Per-URL latency histograms, shown to staff at /_perf/, are kept whenever
+# /metrics exports them (METRICS['DIR'] below) or KINDAEBAY_PERF=1.
+# KINDAEBAY_SERVER_TIMING=1 also adds Server-Timing headers (total, SQL and
+# template time) to responses; they are public, so it is off by default.
+
+PERF = {
+    'ENABLED': os.environ.get('KINDAEBAY_PERF', '0') == '1',
+    'SERVER_TIMING': os.environ.get('KINDAEBAY_SERVER_TIMING', '0') == '1',
+}
+
+# Prometheus metrics at /metrics (KindaEbay/metrics.py), summed over the
+# worker processes through one file each in KINDAEBAY_METRICS_DIR (set it
+# empty to turn metrics off).
+
+METRICS = {
+    'DIR': os.environ.get('KINDAEBAY_METRICS_DIR', join(BASE_DIR, 'metrics')) or None,
+    'INTERVAL': 10,
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+}
+
+# Sessions
+# https://docs.djangoproject.com/en/3.2/topics/http/sessions/
+# KINDAEBAY_SESSIONS=cached_db|db|signed_cookies.  cached_db reads sessions
+# from the cache and only falls back to django_session on a miss, for page
+# views and websocket connects alike; writes go to both.  Logging out evicts
+# the session from the cache, which only the other workers see with a shared
+# cache, so cached_db is the default only with KINDAEBAY_CACHE=file or db
+# (and the signup.E001 check refuses it with locmem); otherwise it is db.
+# signed_cookies keeps no server-side state at all (and so can't revoke a
+# session before it expires).  Expired rows are removed by
+# ``manage.py purge_sessions``.
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.%s' % os.environ.get(
+    'KINDAEBAY_SESSIONS', 'db' if CACHES['default']['BACKEND'].endswith('.LocMemCache') else 'cached_db')
+
+# Throttling (KindaEbay/throttle.py)
+# Token buckets per client IP, per attempted username and per signed-in
+# user for the POSTs that cost a password hash or a write.  KINDAEBAY_THROTTLE_STORE
+# =sqlite|cache|locmem picks where the buckets live; sqlite shares them
+# exactly between all workers on the host.  The test runner turns it off,
+# since its requests all come from one address.
+
+THROTTLE = {
+    'ENABLED': True,
+    'STORE': os.environ.get('KINDAEBAY_THROTTLE_STORE', 'sqlite'),
+    'PATH': join(BASE_DIR, 'throttle.sqlite3'),
+    'RATES': {
+        'login': {'ip': '30/m', 'username': '5/m'},
+        'signup': {'ip': '5/h'},
+        'create': {'ip': '60/h', 'user': '10/15m'},
+    },
 }
 
 # Password validation
@@ -106,6 +218,22 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# https://docs.djangoproject.com/en/3.2/topics/auth/passwords/
+# PBKDF2 with the iteration count from KINDAEBAY_PASSWORD_ITERATIONS (default:
+# Django's).  Stored hashes at a different count are rehashed on the user's
+# next login.  The test runner puts MD5 first: tests create many users and
+# hashing cost is not what they test.
+
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('KINDAEBAY_PASSWORD_ITERATIONS', 260000))
+
+PASSWORD_HASHERS = [
+    'signup.hashers.TunedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 CRISPY_TEMPLATE_PACK="bootstrap4"
@@ -135,6 +263,10 @@ STATICFILES_DIRS = [
 ]
 
 STATIC_URL = '/static/'
+# collectstatic also writes .gz copies of CSS/JS for KindaEbay.fileserve.  Use
+# KindaEbay.staticstorage.CompressedManifestStaticFilesStorage in production
+# to get content-hashed names that are served with far-future caching.
+STATICFILES_STORAGE = 'KindaEbay.staticstorage.CompressedStaticFilesStorage'
 ADMIN_MEDIA_PREFIX = '/static/admin/'
 LOGIN_REDIRECT_URL = '/admin'
 LOGIN_URL = '/login/'
@@ -144,10 +276,39 @@ ASGI_APPLICATION = 'chat.chat.routing.application'
 
 
 
-CHANNEL_LAYERS = {
-    'default': {
+# KINDAEBAY_CHANNEL_LAYER=sqlite|memory.  The in-memory layer only delivers
+# within one process; the SQLite layer lets several ASGI workers on this
+# host exchange chat messages.
+
+CHANNEL_LAYER_BACKENDS = {
+    'sqlite': {
+        'BACKEND': 'chat.layers.SQLiteChannelLayer',
+        'CONFIG': {
+            'path': os.path.join(BASE_DIR, 'channels.sqlite3'),
+        },
+    },
+    'memory': {
         'BACKEND': 'channels.layers.InMemoryChannelLayer'
-    }
+    },
+}
+
+CHANNEL_LAYERS = {
+    'default': CHANNEL_LAYER_BACKENDS[os.environ.get('KINDAEBAY_CHANNEL_LAYER', 'sqlite')]
+}
+
+# Chat text messages are written in batches (see chat/writebehind.py).
+CHAT_WRITE_BEHIND = {
+    'MAX_BATCH': 200,
+    'MAX_DELAY': 0.05,
+    'FLUSH_ON_SHUTDOWN': True,
+}
+
+# Online status for chat (see chat/presence.py).  Shared across workers only
+# with a shared cache backend.
+CHAT_PRESENCE = {
+    'TTL': 60,
+    'HEARTBEAT': 20,
+    'BROADCAST_INTERVAL': 1.0,
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -0,0 +1,58 @@
+"""
+Static files storages that write a gzip-compressed ``.gz`` sibling of every
+text asset during ``collectstatic``, for KindaEbay.fileserve to serve to
+clients that accept gzip.
+"""
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage
+
+from .fileserve import COMPRESSIBLE_EXTENSIONS
+
+# Files smaller than this rarely get smaller once gzip headers are added.
+MIN_COMPRESS_SIZE = 256
+
+
+class GzipMixin:
+
+    def post_process(self, paths, dry_run=False, **options):
+        parent = getattr(super(), 'post_process', None)
+        if parent is not None:
+            for name, hashed_name, processed in parent(paths, dry_run, **options):
+                yield name, hashed_name, processed
+        if dry_run:
+            return
+        for name in list(self._gzip_candidates()):
+            if self._compress(name):
+                yield name, name + '.gz', True
+
+    def _gzip_candidates(self):
+        stack = ['']
+        while stack:
+            directory = stack.pop()
+            dirs, files = self.listdir(directory)
+            stack.extend('%s/%s' % (directory, d) if directory else d for d in dirs)
+            for filename in files:
+                if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+                    yield '%s/%s' % (directory, filename) if directory else filename
+
+    def _compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return False
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) >= len(data):
+            return False
+        with open(path + '.gz', 'wb') as f:
+            f.write(compressed)
+        return True
+
+
+class CompressedStaticFilesStorage(GzipMixin, StaticFilesStorage):
+    pass
+
+
+class CompressedManifestStaticFilesStorage(GzipMixin, ManifestStaticFilesStorage):
+    """Hashed file names (served with far-future caching) plus .gz siblings."""
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner as BaseDiscoverRunner
+
+
+class DiscoverRunner(BaseDiscoverRunner):
+    """
+    The default runner, with settings that production must not have: MD5
+    hashing first, since tests create many users, and throttling off,
+    since every test request comes from the same address.  Tests that
+    exercise either override the setting themselves.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._test_settings = override_settings(
+            PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'] + settings.PASSWORD_HASHERS,
+            THROTTLE=dict(settings.THROTTLE, ENABLED=False),
+        )
+        self._test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,460 @@
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
+from urllib.request import pathname2url
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.contrib.auth.models import AnonymousUser, User
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from . import fileserve, metrics, perf, throttle
+from .db.base import DatabaseWrapper
+from .db.readers import read_to_async
+from .db.routers import REPLICA, ReadReplicaRouter
+from .fileserve import parse_range
+
+BLOB = 'images/ab/' + 'ab' * 32 + '.png'
+
+
+class FileServeTest(SimpleTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.data = bytes(range(256)) * 1024
+        self.write('images/photo.png', self.data)
+        self.write(BLOB, self.data)
+        self.write('derivatives/card/' + BLOB + '.jpg', self.data)
+        self.write('css/site.css', b'body { color: red; }\n' * 100)
+        self.write('css/site.css.gz', gzip.compress(b'body { color: red; }\n' * 100))
+        self.write('js/app.js', b'console.log(1);\n' * 100)
+        patch = override_settings(MEDIA_ROOT=self.media_root)
+        patch.enable()
+        self.addCleanup(patch.disable)
+
+    def write(self, name, data):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def get(self, name, **headers):
+        request = RequestFactory().get('/media/' + name, **headers)
+        return fileserve.serve(request, name, document_root=self.media_root)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_file(self):
+        response = self.get('images/photo.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(int(response['Content-Length']), len(self.data))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.body(response), self.data)
+
+    def test_range(self):
+        response = self.get('images/photo.png', HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/%d' % len(self.data))
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(self.body(response), self.data[100:200])
+
+    def test_open_ended_and_suffix_ranges(self):
+        response = self.get('images/photo.png', HTTP_RANGE='bytes=1000-')
+        self.assertEqual(self.body(response), self.data[1000:])
+        self.assertTrue(response.file_to_stream)
+        response = self.get('images/photo.png', HTTP_RANGE='bytes=-10')
+        self.assertEqual(self.body(response), self.data[-10:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get('images/photo.png', HTTP_RANGE='bytes=%d-' % len(self.data))
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */%d' % len(self.data))
+
+    def test_stale_if_range_sends_whole_file(self):
+        response = self.get('images/photo.png', HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified(self):
+        etag = self.get('images/photo.png')['ETag']
+        self.assertEqual(self.get('images/photo.png', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_cache_control(self):
+        self.assertIn('immutable', self.get(BLOB)['Cache-Control'])
+        self.assertIn('immutable', self.get('derivatives/card/' + BLOB + '.jpg')['Cache-Control'])
+        self.assertNotIn('immutable', self.get('images/photo.png')['Cache-Control'])
+
+    def test_precompressed_variant(self):
+        response = self.get('css/site.css', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(self.body(response)), b'body { color: red; }\n' * 100)
+        plain = self.get('css/site.css')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertNotEqual(plain['ETag'], response['ETag'])
+
+    def test_missing_variant_falls_back(self):
+        response = self.get('js/app.js', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_outside_document_root(self):
+        with self.assertRaises(Http404):
+            self.get('../etc/passwd')
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-0', 10), (0, 0))
+        self.assertEqual(parse_range('bytes=5-100', 10), (5, 9))
+        self.assertEqual(parse_range('bytes=-100', 10), (0, 9))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 10))
+        self.assertIsNone(parse_range('items=0-1', 10))
+        self.assertFalse(parse_range('bytes=5-4', 10))
+
+    def test_served_through_urls(self):
+        response = self.client.get('/media/images/photo.png', HTTP_RANGE='bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[:4])
+
+
+class CompressedStaticFilesStorageTest(SimpleTestCase):
+    def test_collectstatic_writes_gzip_siblings(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        with override_settings(STATIC_ROOT=static_root):
+            call_command('collectstatic', interactive=False, verbosity=0, stdout=StringIO())
+        css = os.path.join(static_root, 'css', 'bootstrap.min.css')
+        with open(css, 'rb') as f, gzip.open(css + '.gz') as g:
+            self.assertEqual(f.read(), g.read())
+        self.assertFalse(os.path.exists(os.path.join(static_root, 'img', 'overlays', '01.png.gz')))
+
+
+class SQLiteBackendTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'test.sqlite3')
+
+    def wrapper(self, name, **options):
+        settings_dict = dict(connections[DEFAULT_DB_ALIAS].settings_dict, NAME=name, OPTIONS=options)
+        wrapper = DatabaseWrapper(settings_dict)
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA %s' % name)
+            return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        wrapper = self.wrapper(self.path, pragmas={'busy_timeout': 1234, 'mmap_size': None})
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 1234)
+        self.assertEqual(self.pragma(wrapper, 'cache_size'), -32000)
+        self.assertEqual(self.pragma(wrapper, 'mmap_size'), 0)
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        wrapper = self.wrapper(self.path)
+        wrapper.ensure_connection()
+        other = sqlite3.connect(self.path, timeout=0, isolation_level=None)
+        self.addCleanup(other.close)
+        wrapper._start_transaction_under_autocommit()
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'locked'):
+            other.execute('BEGIN IMMEDIATE')
+        wrapper.connection.rollback()
+        other.execute('BEGIN IMMEDIATE')
+        other.execute('ROLLBACK')
+
+    def test_invalid_transaction_mode(self):
+        with self.assertRaises(ValueError):
+            self.wrapper(self.path, transaction_mode='sometimes').ensure_connection()
+
+    def test_read_only_connection(self):
+        with self.wrapper(self.path).cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+            cursor.execute('INSERT INTO item DEFAULT VALUES')
+        reader = self.wrapper('file:%s?mode=ro' % pathname2url(self.path),
+                              pragmas={'journal_mode': None, 'query_only': 'ON'})
+        with reader.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM item')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            with self.assertRaisesMessage(OperationalError, 'readonly'):
+                cursor.execute('INSERT INTO item DEFAULT VALUES')
+
+
+class ReadReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.router = ReadReplicaRouter()
+
+    def test_mirror_reads_from_default(self):
+        self.assertEqual(self.router.db_for_read(None), DEFAULT_DB_ALIAS)
+
+    def test_reads_go_to_replica_outside_transactions(self):
+        replica = connections[REPLICA].settings_dict
+        name = replica['NAME']
+        replica['NAME'] = 'file:elsewhere?mode=ro'
+        self.addCleanup(replica.__setitem__, 'NAME', name)
+        # TestCase runs each test in a transaction; step outside it.
+        connections[DEFAULT_DB_ALIAS].in_atomic_block = False
+        self.addCleanup(setattr, connections[DEFAULT_DB_ALIAS], 'in_atomic_block', True)
+        self.assertEqual(self.router.db_for_read(None), REPLICA)
+        connections[DEFAULT_DB_ALIAS].in_atomic_block = True
+        self.assertEqual(self.router.db_for_read(None), DEFAULT_DB_ALIAS)
+
+    def test_read_to_async(self):
+        def thread_name():
+            return threading.current_thread().name
+        # Mirror: on the calling thread, which sees the test transaction.
+        self.assertEqual(async_to_sync(read_to_async(thread_name))(), thread_name())
+        replica = connections[REPLICA].settings_dict
+        name = replica['NAME']
+        replica['NAME'] = 'file:elsewhere?mode=ro'
+        self.addCleanup(replica.__setitem__, 'NAME', name)
+        self.assertTrue(async_to_sync(read_to_async(thread_name))().startswith('db-reader'))
+
+    def test_writes_and_migrations_use_default(self):
+        self.assertEqual(self.router.db_for_write(None), DEFAULT_DB_ALIAS)
+        self.assertTrue(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'products'))
+        self.assertFalse(self.router.allow_migrate(REPLICA, 'products'))
+
+
+class ThrottleTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'throttle.sqlite3')
+        self.addCleanup(throttle._stores.clear)
+        self.factory = RequestFactory()
+
+    def test_parse_rate(self):
+        self.assertEqual(throttle.parse_rate('5/m'), (5, 5 / 60))
+        self.assertEqual(throttle.parse_rate('100/15m'), (100, 100 / 900))
+        with self.assertRaises(ValueError):
+            throttle.parse_rate('5 per minute')
+
+    def test_stores_agree(self):
+        for store in (throttle.LocMemStore(), throttle.SQLiteStore(self.path)):
+            with self.subTest(store=type(store).__name__):
+                taken = [store.take('k', 1 / 60, 3, 100.0) >= 0 for _ in range(4)]
+                self.assertEqual(taken, [True, True, True, False])
+                # one token back a minute later
+                self.assertGreaterEqual(store.take('k', 1 / 60, 3, 160.0), 0)
+                self.assertLess(store.take('k', 1 / 60, 3, 160.0), 0)
+                self.assertGreaterEqual(store.take('other', 1 / 60, 3, 160.0), 0)
+
+    def test_refund(self):
+        for store in (throttle.LocMemStore(), throttle.SQLiteStore(self.path)):
+            with self.subTest(store=type(store).__name__):
+                self.assertGreaterEqual(store.take('k', 1 / 60, 1, 100.0), 0)
+                store.refund('k', 1 / 60, 1, 100.0)
+                self.assertGreaterEqual(store.take('k', 1 / 60, 1, 100.0), 0)
+                self.assertLess(store.take('k', 1 / 60, 1, 100.0), 0)
+
+    def test_denied_requests_cost_no_tokens(self):
+        rates = {'test': {'ip': '3/m', 'username': '1/m'}}
+        with override_settings(THROTTLE={'ENABLED': True, 'STORE': 'sqlite', 'PATH': self.path, 'RATES': rates}):
+            def attempt(username):
+                return throttle.check(self.factory.post('/', {'username': username}), 'test')
+            self.assertIsNone(attempt('a'))
+            # denied by the username bucket; the IP bucket gets its token back
+            self.assertIsNotNone(attempt('a'))
+            self.assertIsNotNone(attempt('a'))
+            self.assertIsNone(attempt('b'))
+            self.assertIsNone(attempt('c'))
+            self.assertIsNotNone(attempt('d'))
+
+    def test_sqlite_buckets_are_shared(self):
+        first, second = throttle.SQLiteStore(self.path), throttle.SQLiteStore(self.path)
+        self.assertGreaterEqual(first.take('k', 1, 2, 100.0), 0)
+        self.assertGreaterEqual(second.take('k', 1, 2, 100.0), 0)
+        self.assertLess(first.take('k', 1, 2, 100.0), 0)
+
+    def test_decorator(self):
+        @throttle.throttle('test')
+        def view(request):
+            return HttpResponse('ok')
+
+        rates = {'test': {'ip': '2/m', 'user': '100/m'}}
+        with override_settings(THROTTLE={'ENABLED': True, 'STORE': 'sqlite', 'PATH': self.path, 'RATES': rates}):
+            request = self.factory.post('/')
+            request.user = AnonymousUser()
+            self.assertEqual(view(request).status_code, 200)
+            self.assertEqual(view(request).status_code, 200)
+            response = view(request)
+            self.assertEqual(response.status_code, 429)
+            self.assertIn(response['Retry-After'], ('30', '31'))
+            # GETs aren't throttled, other addresses have their own bucket
+            get = self.factory.get('/')
+            get.user = AnonymousUser()
+            self.assertEqual(view(get).status_code, 200)
+            other = self.factory.post('/', REMOTE_ADDR='10.0.0.2')
+            other.user = AnonymousUser()
+            self.assertEqual(view(other).status_code, 200)
+        with override_settings(THROTTLE={'ENABLED': False, 'STORE': 'sqlite', 'PATH': self.path, 'RATES': rates}):
+            self.assertEqual(view(request).status_code, 200)
+
+
+class TestRunnerTest(TestCase):
+
+    def test_test_settings(self):
+        self.assertTrue(User.objects.create_user('runner', password='x').password.startswith('md5$'))
+        self.assertFalse(throttle.get_config()['ENABLED'])
+
+
+@override_settings(PERF={'ENABLED': True, 'SERVER_TIMING': True})
+class PerfMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        perf.get_registry().reset()
+        self.addCleanup(perf.get_registry().reset)
+        self.user = User.objects.create_user('perfuser', password='perfpassword', is_staff=True)
+
+    def timings(self, response):
+        return {part.split(';')[0]: part for part in response['Server-Timing'].split(', ')}
+
+    def test_server_timing(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/my-listings/')
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'total', 'db', 'tpl'})
+        self.assertNotIn('desc="0 queries"', timings['db'])
+        self.assertNotEqual(timings['tpl'], 'tpl;dur=0.0')
+        summary = perf.get_registry().snapshot()['my-listings/']
+        self.assertEqual(summary['url_name'], 'my_listings')
+        self.assertEqual(summary['count'], 1)
+        self.assertGreater(summary['mean_queries'], 0)
+
+    async def test_async_view_queries_are_counted(self):
+        response = await self.async_client.get('/home/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('desc="0 queries"', self.timings(response)['db'])
+
+    @override_settings(PERF={'ENABLED': False}, METRICS={'DIR': None})
+    def test_disabled(self):
+        response = self.client.get('/home/')
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(perf.get_registry().snapshot(), {})
+
+    def test_histogram_percentiles(self):
+        histogram = perf.LatencyHistogram('x')
+        for ms in [0.5] * 90 + [30] * 9 + [20000]:
+            histogram.record(ms / 1000, perf.RequestStats())
+        self.assertEqual(histogram.percentile(0.5), 1)
+        self.assertEqual(histogram.percentile(0.99), 50)
+        self.assertEqual(histogram.percentile(1.0), 20000)
+
+    def test_perf_page_is_for_staff(self):
+        self.assertEqual(self.client.get('/_perf/').status_code, 302)
+        self.client.force_login(self.user)
+        self.client.get('/home/')
+        response = self.client.get('/_perf/')
+        self.assertContains(response, '<td>home/</td>')
+
+    def test_threads_record_without_sharing(self):
+        registry = perf.PerfRegistry()
+        registry.record('a/', 'a', 0.001, perf.RequestStats())
+        thread = threading.Thread(target=registry.record, args=('a/', 'a', 0.003, perf.RequestStats(), 404))
+        thread.start()
+        thread.join()
+        histogram = registry.histograms()['a/']
+        self.assertEqual(histogram.count, 2)
+        self.assertEqual(histogram.statuses, {'2xx': 1, '4xx': 1})
+        # the exited thread's numbers were folded in and its shard dropped
+        self.assertEqual(len(registry._shards), 1)
+        self.assertEqual(registry.histograms()['a/'].count, 2)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        # histograms() is never reset; start from a registry of its own
+        registry = mock.patch.object(perf, '_registry', perf.PerfRegistry())
+        registry.start()
+        self.addCleanup(registry.stop)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        override = override_settings(
+            PERF={'ENABLED': True},
+            METRICS={'DIR': self.directory, 'ALLOWED_IPS': ['127.0.0.1']},
+            CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def write(self, pid, started, requests=0, counters=None, gauges=None):
+        histogram = perf.LatencyHistogram('home', 'products.views.product_list_view')
+        for _ in range(requests):
+            histogram.record(0.004, perf.RequestStats())
+        with open(metrics.snapshot_path(self.directory, pid, started), 'w') as f:
+            json.dump({'pid': pid, 'started': started, 'time': 0, 'http': {'home/': histogram.as_dict()},
+                       'counters': counters or {}, 'gauges': gauges or {}}, f)
+
+    def test_metrics(self):
+        self.client.get('/home/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        labels = 'view="products.views.product_list_view",route="home/"'
+        lines = response.content.decode().splitlines()
+        self.assertIn('kindaebay_http_requests_total{%s,status="2xx"} 1' % labels, lines)
+        self.assertIn('kindaebay_http_request_duration_seconds_bucket{%s,le="+Inf"} 1' % labels, lines)
+        self.assertIn('kindaebay_http_request_duration_seconds_count{%s} 1' % labels, lines)
+        self.assertIn('kindaebay_processes 1', lines)
+        self.assertIn('kindaebay_channel_layer_messages 0', lines)
+        self.assertTrue(os.path.exists(metrics.snapshot_path(self.directory, *metrics.process_identity())))
+
+    def test_sums_worker_processes(self):
+        parent = os.getppid()
+        # an exited worker (pids never go this high), a running one, and an
+        # exited one whose pid was reused since
+        self.write(2 ** 22 + 1, 'x', requests=2, counters={'chat_messages_written': 5},
+                   gauges={'websocket_connections': 7})
+        self.write(parent, metrics.process_start(parent) or 'x', requests=1,
+                   counters={'chat_messages_written': 1}, gauges={'websocket_connections': 2})
+        requests, written = 2, 5
+        if metrics.process_start(parent) is not None:
+            self.write(parent, 'reused', requests=4, counters={'chat_messages_written': 10},
+                       gauges={'websocket_connections': 3})
+            requests, written = 6, 15
+        labels = 'view="products.views.product_list_view",route="home/"'
+        for _ in range(2):
+            # the second time the exited workers come from retired.json
+            lines = self.client.get('/metrics').content.decode().splitlines()
+            self.assertIn('kindaebay_http_requests_total{%s,status="2xx"} %d' % (labels, requests + 1), lines)
+            self.assertIn('kindaebay_http_request_duration_seconds_bucket{%s,le="0.005"} %d'
+                          % (labels, requests + 1), lines)
+            self.assertIn('kindaebay_chat_messages_written_total %d' % (written + 1), lines)
+            # gauges only from processes that are still running
+            self.assertIn('kindaebay_websocket_connections 2', lines)
+            self.assertIn('kindaebay_processes 2', lines)
+        running = [metrics.snapshot_path(self.directory, *metrics.process_identity()),
+                   metrics.snapshot_path(self.directory, parent, metrics.process_start(parent) or 'x')]
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(['.lock', metrics.RETIRED] + [os.path.basename(path) for path in running]))
+
+    def test_perf_reset_leaves_counters_alone(self):
+        self.client.get('/home/')
+        perf.get_registry().reset()
+        self.assertEqual(perf.get_registry().snapshot(), {})
+        labels = 'view="products.views.product_list_view",route="home/"'
+        lines = self.client.get('/metrics').content.decode().splitlines()
+        self.assertIn('kindaebay_http_requests_total{%s,status="2xx"} 1' % labels, lines)
+
+    @override_settings(PERF={})
+    def test_recorded_for_metrics_without_server_timing(self):
+        response = self.client.get('/home/')
+        self.assertFalse(response.has_header('Server-Timing'))
+        labels = 'view="products.views.product_list_view",route="home/"'
+        lines = self.client.get('/metrics').content.decode().splitlines()
+        self.assertIn('kindaebay_http_requests_total{%s,status="2xx"} 1' % labels, lines)
+
+    def test_allowed_ips(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
@@ -0,0 +1,266 @@
+"""
+Token-bucket throttling for expensive POSTs (login, signup, new listings).
+
+``@throttle('login')`` applies the rules in ``settings.THROTTLE['RATES']['login']``,
+e.g. ``{'ip': '20/m', 'username': '5/m'}``: one bucket per client IP and one
+per submitted username, each holding up to N tokens and refilling at N per
+period.  A request takes a token from each of its buckets; if one is empty
+it gets a 429 with Retry-After, the view doesn't run and the tokens it took
+from the buckets before are given back.  Only POSTs are throttled, and the
+check runs before the view reads the body.  ``keys`` limits a decorator to
+some of the rules, so a view that checks CSRF itself can throttle by IP
+before the check and per user only after it: otherwise a forged
+cross-site POST would spend the victim's tokens.
+
+Bucket state lives in a store picked by ``THROTTLE['STORE']``:
+
+* ``sqlite``: a small SQLite file (``THROTTLE['PATH']``) updated with one
+  upsert per bucket, so every worker on the host shares the buckets
+  exactly; this is the stand-in for a local Redis.
+* ``cache``: Django's default cache.  Shared across workers with the file
+  or db cache backends, but read-modify-write, so concurrent requests can
+  both take the last token.
+* ``locmem``: a dict in this process.
+
+Each check is O(1): one statement or dict update per bucket.
+"""
+import math
+import re
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+RATE_RE = re.compile(r'^(\d+)/(\d*)([smhd])$')
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+PRUNE_INTERVAL = 60
+DEFAULTS = {
+    'ENABLED': True,
+    'STORE': 'locmem',
+    'PATH': None,
+    'RATES': {},
+}
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, 'THROTTLE', {}))
+
+
+def parse_rate(rate):
+    """'5/m' -> (burst, tokens per second); '100/15m' means 100 per 15 minutes."""
+    match = RATE_RE.match(rate)
+    if match is None:
+        raise ValueError("Invalid rate %r; expected e.g. '5/m' or '100/15m'." % rate)
+    count, multiplier, unit = match.groups()
+    period = int(multiplier or 1) * PERIODS[unit]
+    return int(count), int(count) / period
+
+
+def refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+
+class LocMemStore:
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._pruned = time.time()
+
+    def take(self, key, rate, burst, now):
+        """Take a token from ``key``'s bucket; return the tokens left, negative if none was taken."""
+        with self._lock:
+            tokens, updated, expires = self._buckets.get(key, (burst, now, now))
+            tokens = refill(tokens, updated, now, rate, burst)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # Once full again the bucket is the same as no bucket.
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if now - self._pruned > PRUNE_INTERVAL:
+                self._pruned = now
+                self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+        return tokens if allowed else tokens - burst
+
+    def refund(self, key, rate, burst, now):
+        """Give back a token taken by take()."""
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated, expires = self._buckets[key]
+                self._buckets[key] = (min(burst, tokens + 1), updated, expires)
+
+
+class CacheStore:
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    def take(self, key, rate, burst, now):
+        cache = caches[self.alias]
+        key = 'throttle:' + key
+        tokens, updated = cache.get(key, (burst, now))
+        tokens = refill(tokens, updated, now, rate, burst)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        cache.set(key, (tokens, now), math.ceil((burst - tokens) / rate) + 1)
+        return tokens if allowed else tokens - burst
+
+    def refund(self, key, rate, burst, now):
+        cache = caches[self.alias]
+        key = 'throttle:' + key
+        bucket = cache.get(key)
+        if bucket is not None:
+            cache.set(key, (min(burst, bucket[0] + 1), bucket[1]), math.ceil((burst - bucket[0]) / rate) + 1)
+
+
+class SQLiteStore:
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS throttle_bucket (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL,
+            allowed INTEGER NOT NULL,
+            expires REAL NOT NULL
+        ) WITHOUT ROWID
+    """
+    # Refill, take a token if there is one, and report which, in one
+    # statement; SQLite runs it atomically, so workers never race.
+    TAKE = """
+        INSERT INTO throttle_bucket (key, tokens, updated, allowed, expires)
+        VALUES (:key, :burst - 1, :now, 1, :now + 1 / :rate)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = min(:burst, tokens + max(0, :now - updated) * :rate)
+                     - (min(:burst, tokens + max(0, :now - updated) * :rate) >= 1),
+            allowed = min(:burst, tokens + max(0, :now - updated) * :rate) >= 1,
+            updated = :now,
+            expires = :now + (:burst - min(:burst, tokens + max(0, :now - updated) * :rate)
+                              + (min(:burst, tokens + max(0, :now - updated) * :rate) >= 1)) / :rate
+        RETURNING tokens, allowed
+    """
+    REFUND = "UPDATE throttle_bucket SET tokens = min(:burst, tokens + 1) WHERE key = :key"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._pruned = time.time()
+        self._db().execute(self.SCHEMA)
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = NORMAL')
+            self._local.db = db
+        return db
+
+    def take(self, key, rate, burst, now):
+        db = self._db()
+        tokens, allowed = db.execute(self.TAKE, {'key': key, 'rate': rate, 'burst': burst, 'now': now}).fetchone()
+        if now - self._pruned > PRUNE_INTERVAL:
+            self._pruned = now
+            db.execute('DELETE FROM throttle_bucket WHERE expires < ?', [now])
+        return tokens if allowed else tokens - burst
+
+    def refund(self, key, rate, burst, now):
+        self._db().execute(self.REFUND, {'key': key, 'burst': burst})
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(config=None):
+    """The process-wide store for the configured STORE (and PATH)."""
+    config = config or get_config()
+    name = config['STORE']
+    key = (name, config['PATH'])
+    with _stores_lock:
+        if key not in _stores:
+            if name == 'sqlite':
+                _stores[key] = SQLiteStore(config['PATH'])
+            elif name == 'cache':
+                _stores[key] = CacheStore()
+            elif name == 'locmem':
+                _stores[key] = LocMemStore()
+            else:
+                raise ValueError("Unknown THROTTLE store %r." % name)
+        return _stores[key]
+
+
+def _client_ip(request):
+    return request.META.get('REMOTE_ADDR') or 'unknown'
+
+
+def _user(request):
+    return str(request.user.pk) if request.user.is_authenticated else None
+
+
+def _username(request):
+    username = request.POST.get('username', '').strip().lower()
+    return username or None
+
+
+# rule name -> function giving the bucket key for a request (None: no bucket)
+KEYS = {
+    'ip': _client_ip,
+    'user': _user,
+    'username': _username,
+}
+
+
+def check(request, scope, keys=None):
+    """
+    Take a token from each of ``request``'s buckets for ``scope`` (only the
+    rules named in ``keys``, if given).  Return None if allowed, else the
+    seconds until a retry can succeed.
+    """
+    config = get_config()
+    rules = config['RATES'].get(scope, {})
+    if not config['ENABLED'] or not rules:
+        return None
+    store = get_store(config)
+    now = time.time()
+    taken = []
+    for name, rate in rules.items():
+        value = None if keys is not None and name not in keys else KEYS[name](request)
+        if value is None:
+            continue
+        burst, per_second = parse_rate(rate)
+        key = '%s:%s:%s' % (scope, name, value)
+        left = store.take(key, per_second, burst, now)
+        if left < 0:
+            # Denied: the request mustn't cost the buckets that let it through.
+            for key, per_second_taken, burst_taken in taken:
+                store.refund(key, per_second_taken, burst_taken, now)
+            # ``left + burst`` tokens are in the bucket; one is needed.
+            return (1 - (left + burst)) / per_second
+        taken.append((key, per_second, burst))
+    return None
+
+
+def too_many_requests(retry_after):
+    response = HttpResponse("Too many requests. Try again in %d seconds." % math.ceil(retry_after),
+                            content_type='text/plain', status=429)
+    response['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+
+def throttle(scope, methods=('POST',), keys=None):
+    """View decorator applying the ``scope`` rules (those in ``keys``, if given) to ``methods`` requests."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method in methods:
+                retry_after = check(request, scope, keys)
+                if retry_after is not None:
+                    return too_many_requests(retry_after)
+            return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
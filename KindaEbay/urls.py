@@ -20,53 +20,42 @@ from signup import views as v
 from django.conf.urls import url, include
 from django.urls import path
 from django.contrib import admin
-from django.views.generic import TemplateView, ListView
+from django.views.generic import TemplateView
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.contrib.auth import get_user_model
 from django.conf import settings
-from django.conf.urls.static import static
-from django.http import JsonResponse
-from django.contrib.auth.models import AbstractBaseUser
+from django.urls import re_path
+from KindaEbay import fileserve, metrics, perf
 #123
 from pages.views import home_view
-from products.views import product_detail_view, product_create_view, product_list_view
-
-from typing import List
-
-UserModel = get_user_model()
-
-
-class UsersListView(LoginRequiredMixin, ListView):
-    http_method_names = ['get', ]
-
-    def get_queryset(self):
-        return UserModel.objects.all().exclude(id=self.request.user.id)
-
-    def render_to_response(self, context, **response_kwargs):
-        users: List[AbstractBaseUser] = context['object_list']
-
-        data = [{
-            "username": user.get_username(),
-            "pk": str(user.pk)
-        } for user in users]
-        return JsonResponse(data, safe=False, **response_kwargs)
+from chat.views import OnlineUsersView, UsersListView
+from products.api import product_detail_api, product_list_api
+from products.views import product_detail_view, product_create_view, product_list_view, product_search_view, product_export_view, \
+    seller_view, my_listings_view
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('_perf/', perf.perf_view, name='perf'),
+    path('metrics', metrics.metrics_view, name='metrics'),
     path("signup/", v.register_request, name="signup_page"),
     path("login/", v.login_request, name="login"),
     path("logout/", v.logout_request, name='logout'),
     url(r'', include('django_private_chat2.urls', namespace='django_private_chat2')),
     path('users/', UsersListView.as_view(), name='users_list'),
+    path('users/online/', OnlineUsersView.as_view(), name='users_online'),
     path('chat/', login_required(TemplateView.as_view(template_name='chat.html')), name='home'),
     #123
     path('', product_list_view, name = 'home'),
     path('create/', product_create_view),
     path('home/', product_list_view),
+    path('search/', product_search_view, name='product_search'),
     path('product/<int:productid>/', product_detail_view),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-
-if settings.DEBUG:
-        urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    path('seller/<int:sellerid>/', seller_view, name='seller'),
+    path('my-listings/', my_listings_view, name='my_listings'),
+    path('api/products/', product_list_api, name='product_list_api'),
+    path('api/products/<int:productid>/', product_detail_api, name='product_detail_api'),
+    path('export/products/', product_export_view, name='product_export'),
+    re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), fileserve.serve_media),
+    # under DEBUG, runserver serves /static/ from the app directories first
+    re_path(r'^%s(?P<path>.*)$' % settings.STATIC_URL.lstrip('/'), fileserve.serve_static),
+]
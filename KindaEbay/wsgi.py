@@ -14,3 +14,6 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'KindaEbay.settings')
 
 application = get_wsgi_application()
+
+from KindaEbay.metrics import start_exporter
+start_exporter()
@@ -1,6 +1,6 @@
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-from django_private_chat2 import urls
+from chat import urls
 
 application = ProtocolTypeRouter({
     "websocket": AuthMiddlewareStack(
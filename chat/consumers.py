@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from django_private_chat2.consumers import ChatConsumer as BaseChatConsumer
+from django_private_chat2.consumers.chat_consumer import TEXT_MAX_LENGTH, UNAUTH_REJECT_CODE
+from django_private_chat2.consumers.db_operations import get_user_by_pk
+from django_private_chat2.consumers.errors import ErrorDescription, ErrorTypes
+from django_private_chat2.consumers.message_types import (
+    MessageTypes, MessageTypeTextMessage, OutgoingEventNewTextMessage, OutgoingEventWentOffline,
+    OutgoingEventWentOnline)
+
+from . import presence, writebehind
+
+logger = logging.getLogger(__name__)
+
+
+class ChatConsumer(BaseChatConsumer):
+    """
+    django_private_chat2's consumer, with
+
+    * text messages persisted through chat.writebehind instead of one INSERT
+      per message.  The message is relayed to the recipient immediately;
+      MessageIdCreated and the unread count follow once its batch has been
+      written.
+    * online/offline notifications going through chat.presence, batched per
+      recipient, instead of a dialog query and one group_send per dialog on
+      every connect and disconnect.
+    """
+
+    async def connect(self):
+        self._pending_saves = set()
+        if not self.scope["user"].is_authenticated:
+            logger.info(f"Rejecting unauthenticated user with code {UNAUTH_REJECT_CODE}")
+            await self.close(code=UNAUTH_REJECT_CODE)
+            return
+        self.user = self.scope['user']
+        self.group_name = str(self.user.pk)
+        self.sender_username = self.user.get_username()
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        await presence.get_registry().connect(self.user.pk, self.channel_name)
+
+    async def disconnect(self, close_code):
+        if self._pending_saves:
+            await asyncio.wait(self._pending_saves)
+        if close_code != UNAUTH_REJECT_CODE and getattr(self, 'user', None) is not None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            await presence.get_registry().disconnect(self.user.pk, self.channel_name)
+
+    async def presence_batch(self, event: dict):
+        for user_pk, online in event['changes']:
+            if online:
+                await self.send(text_data=OutgoingEventWentOnline(user_pk=user_pk).to_json())
+            else:
+                await self.send(text_data=OutgoingEventWentOffline(user_pk=user_pk).to_json())
+
+    def _validate_text_message(self, data: MessageTypeTextMessage) -> Optional[ErrorDescription]:
+        # Same checks, in the same order, as the base consumer.
+        if 'text' not in data:
+            return ErrorTypes.MessageParsingError, "'text' not present in data"
+        elif 'user_pk' not in data:
+            return ErrorTypes.MessageParsingError, "'user_pk' not present in data"
+        elif 'random_id' not in data:
+            return ErrorTypes.MessageParsingError, "'random_id' not present in data"
+        elif data['text'] == '':
+            return ErrorTypes.TextMessageInvalid, "'text' should not be blank"
+        elif len(data['text']) > TEXT_MAX_LENGTH:
+            return ErrorTypes.TextMessageInvalid, "'text' is too long"
+        elif not isinstance(data['text'], str):
+            return ErrorTypes.TextMessageInvalid, "'text' should be a string"
+        elif not isinstance(data['user_pk'], str):
+            return ErrorTypes.InvalidUserPk, "'user_pk' should be a string"
+        elif not isinstance(data['random_id'], int):
+            return ErrorTypes.InvalidRandomId, "'random_id' should be an int"
+        elif data['random_id'] > 0:
+            return ErrorTypes.InvalidRandomId, "'random_id' should be negative"
+        return None
+
+    async def handle_received_message(self, msg_type: MessageTypes, data: Dict[str, str]) -> Optional[ErrorDescription]:
+        if msg_type != MessageTypes.TextMessage:
+            return await super().handle_received_message(msg_type, data)
+        error = self._validate_text_message(data)
+        if error is not None:
+            return error
+        text = data['text']
+        user_pk = data['user_pk']
+        rid = data['random_id']
+        await self.channel_layer.group_send(user_pk, OutgoingEventNewTextMessage(random_id=rid,
+                                                                                 text=text,
+                                                                                 sender=self.group_name,
+                                                                                 receiver=user_pk,
+                                                                                 sender_username=self.sender_username)._asdict())
+        recipient = await get_user_by_pk(user_pk)
+        if not recipient:
+            return ErrorTypes.InvalidUserPk, f"User with pk {user_pk} does not exist"
+        saved = writebehind.get_buffer().add(self.user.pk, recipient.pk, text)
+        task = asyncio.ensure_future(self._after_buffered_save(saved, rid, user_pk))
+        self._pending_saves.add(task)
+        task.add_done_callback(self._pending_saves.discard)
+        return None
+
+    async def _after_buffered_save(self, saved, rid: int, user_pk: str):
+        try:
+            msg = await saved
+        except Exception:
+            logger.exception(f"Text message from {self.group_name} to {user_pk} was not saved")
+            return
+        await self._after_message_save(msg, rid=rid, user_pk=user_pk)
@@ -0,0 +1,88 @@
+"""
+The user directory the chat frontend picks new conversation partners from.
+
+Users are listed in username order, a page at a time, with keyset cursors
+on the unique username index (see products.pagination).  The bundled
+frontend (chat/frontend) fetches /users/ once and neither follows the
+``Link`` header nor searches, so a request without ``limit`` or ``after``
+still gets the whole directory in one response; clients that page opt in
+with ``limit``.  ``?q=`` is a
+prefix search written as a range on that index, ``username >= q AND
+username < q'`` where q' is q with its last character incremented: SQLite
+can't use an index for LIKE 'q%' (LIKE is case-insensitive there), but it
+can for the range.  The match is therefore case-sensitive, like usernames.
+
+Pages are cached per requesting user (the list leaves out the user
+themselves) under a directory-wide version that chat.signals bumps when a
+user is created, saved (other than a login) or deleted.
+"""
+import hashlib
+import sys
+import time
+from urllib.parse import urlencode
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+from products.pagination import paginate
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+PAGE_TIMEOUT = 60 * 10
+CACHE_ALIAS = 'default'
+VERSION_KEY = 'user-directory:version'
+ORDERING = ('username',)
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def directory_version():
+    return _cache().get_or_set(VERSION_KEY, time.time_ns, None)
+
+
+def invalidate_directory():
+    _cache().set(VERSION_KEY, time.time_ns(), None)
+
+
+def prefix_range(prefix):
+    """
+    Return ``(low, high)`` such that ``low <= s < high`` iff s starts with
+    ``prefix``; ``high`` is None when only ``low <= s`` is needed (the
+    prefix is all U+10FFFF, which nothing sorts after).
+    """
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return prefix, None
+    following = ord(stem[-1]) + 1
+    if following == 0xD800:
+        # surrogates can't be stored; U+E000 is the next code point after them
+        following = 0xE000
+    return prefix, stem[:-1] + chr(following)
+
+
+def page_key(user_pk, prefix, after, page_size):
+    params = urlencode([('q', prefix), ('after', after or ''), ('limit', page_size)])
+    digest = hashlib.md5(params.encode()).hexdigest()
+    return 'user-directory:%s:%s:%s' % (directory_version(), user_pk, digest)
+
+
+def directory_users(exclude_pk, prefix=''):
+    """``{'pk', 'username'}`` dicts of every user but ``exclude_pk`` starting with ``prefix``, unordered."""
+    queryset = get_user_model().objects.exclude(pk=exclude_pk)
+    if prefix:
+        low, high = prefix_range(prefix)
+        queryset = queryset.filter(username__gte=low)
+        if high is not None:
+            queryset = queryset.filter(username__lt=high)
+    return queryset.values('pk', 'username')
+
+
+def directory_page(exclude_pk, prefix='', after=None, page_size=PAGE_SIZE, params=None):
+    """
+    Return one products.pagination.KeysetPage of ``{'pk', 'username'}``
+    dicts.  Raises products.pagination.InvalidCursor for a bad cursor.
+    """
+    return paginate(directory_users(exclude_pk, prefix), ordering=ORDERING,
+                    after=after, page_size=page_size, params=params)
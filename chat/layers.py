@@ -0,0 +1,347 @@
+"""
+A channel layer shared by every process on one host, backed by a SQLite
+file in WAL mode.
+
+InMemoryChannelLayer only delivers within a process, so a chat message sent
+by a user connected to one ASGI worker never reaches a user connected to
+another.  SQLiteChannelLayer keeps channel messages and group memberships in
+a small database that all workers open:
+
+* ``send`` inserts a row; a channel holding ``capacity`` unexpired messages
+  raises ChannelFull.  ``group_send`` inserts one row per member channel in a
+  single transaction and skips full channels, as channels_redis does.
+* Messages expire after ``expiry`` seconds and group memberships after
+  ``group_expiry``; a channel whose message expired undelivered is removed
+  from its groups (its consumer is gone).
+* Process-specific channels (``new_channel()``, one per websocket consumer)
+  share a per-layer prefix.  One poller task per process fetches up to
+  ``batch_size`` messages for all of them per query and hands them to the
+  waiting receivers, backing off to ``poll_interval`` while idle.
+
+Database calls run on a single worker thread so they never block the event
+loop.  Messages are pickled: the file must be as private as db.sqlite3.
+"""
+import asyncio
+import collections
+import os
+import pickle
+import random
+import sqlite3
+import string
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channel_message (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    expires REAL NOT NULL,
+    body BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channel_message_channel ON channel_message (channel, id);
+CREATE INDEX IF NOT EXISTS channel_message_expires ON channel_message (expires);
+CREATE TABLE IF NOT EXISTS channel_group (
+    name TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (name, channel)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS channel_group_channel ON channel_group (channel);
+"""
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'kindaebay-channels.sqlite3')
+CLEANUP_INTERVAL = 5.0
+MIN_POLL_INTERVAL = 0.001
+
+
+def _random_name(length=12):
+    return ''.join(random.choice(string.ascii_letters) for _ in range(length))
+
+
+def _prefix_upper(prefix):
+    # Every name starting with "...!" sorts below the same prefix ending in '"'.
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path=DEFAULT_PATH, expiry=60, group_expiry=86400, capacity=100,
+                 channel_capacity=None, batch_size=100, poll_interval=0.05, timeout=5.0, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = path
+        self.group_expiry = group_expiry
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.client_prefix = _random_name()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='channel-layer')
+        self._db = None
+        self._db_pid = None
+        self._next_cleanup = 0
+        # Process-specific channels: undelivered messages and waiting receivers.
+        self._buffers = collections.defaultdict(collections.deque)
+        self._waiters = collections.defaultdict(collections.deque)
+        self._poller = None
+
+    # Database access, always on the executor thread.
+
+    def _connection(self):
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                       check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(SCHEMA)
+            self._db_pid = os.getpid()
+        return self._db
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _transaction(self, function, *args):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = function(connection, *args)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return result
+
+    def _cleanup(self, connection, now):
+        if now < self._next_cleanup:
+            return
+        self._next_cleanup = now + CLEANUP_INTERVAL
+        connection.execute(
+            'DELETE FROM channel_group WHERE channel IN '
+            '(SELECT channel FROM channel_message WHERE expires < ?)', (now,))
+        connection.execute('DELETE FROM channel_message WHERE expires < ?', (now,))
+        connection.execute('DELETE FROM channel_group WHERE expires < ?', (now,))
+
+    def _insert(self, connection, channels, body):
+        """Queue ``body`` on every channel that has room; return the full ones."""
+        now = time.time()
+        self._cleanup(connection, now)
+        rows = []
+        full = []
+        for channel in channels:
+            queued = connection.execute(
+                'SELECT COUNT(*) FROM channel_message WHERE channel = ? AND expires >= ?',
+                (channel, now)).fetchone()[0]
+            if queued >= self.get_capacity(channel):
+                full.append(channel)
+            else:
+                rows.append((channel, now + self.expiry, body))
+        connection.executemany(
+            'INSERT INTO channel_message (channel, expires, body) VALUES (?, ?, ?)', rows)
+        return full
+
+    def _fetch(self, low, high, limit):
+        """
+        Take up to ``limit`` messages on channels in [low, high).  Looking
+        is a read, which doesn't wait for or block writers; the write lock
+        is only taken to delete messages that were found, and the DELETE
+        returns the ones this process got (another may have taken some
+        in between).
+        """
+        connection = self._connection()
+        ids = [row[0] for row in connection.execute(
+            'SELECT id FROM channel_message '
+            'WHERE channel >= ? AND channel < ? AND expires >= ? ORDER BY id LIMIT ?',
+            (low, high, time.time(), limit))]
+        if not ids:
+            return []
+        rows = connection.execute(
+            'DELETE FROM channel_message WHERE id IN (%s) RETURNING id, channel, expires, body'
+            % ', '.join('?' * len(ids)), ids).fetchall()
+        return [(channel, expires, body) for _, channel, expires, body in sorted(rows)]
+
+    def _fetch_local(self, prefixes):
+        rows = []
+        for prefix in prefixes:
+            rows += self._fetch(prefix, _prefix_upper(prefix), self.batch_size)
+        return rows
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        """Send a message onto a (general or specific) channel."""
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+        body = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        if await self._run(self._transaction, self._insert, [channel], body):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        """
+        Receive the first message that arrives on the channel.  Specific
+        channels are served by this process's poller; other channels are
+        polled directly, one message at a time, so several processes can
+        share them.
+        """
+        assert self.valid_channel_name(channel)
+        if '!' not in channel:
+            return await self._receive_general(channel)
+
+        buffer = self._buffers.get(channel)
+        now = time.time()
+        while buffer:
+            expires, body = buffer.popleft()
+            if expires >= now:
+                return pickle.loads(body)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[channel].append(future)
+        self._ensure_poller()
+        try:
+            return await future
+        finally:
+            waiters = self._waiters.get(channel)
+            if waiters is not None:
+                if future in waiters:
+                    waiters.remove(future)
+                if not waiters:
+                    del self._waiters[channel]
+
+    async def _receive_general(self, channel):
+        delay = MIN_POLL_INTERVAL
+        while True:
+            rows = await self._run(self._fetch, channel, channel + '\0', 1)
+            if rows:
+                return pickle.loads(rows[0][2])
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.poll_interval)
+
+    def _ensure_poller(self):
+        loop = asyncio.get_running_loop()
+        if self._poller is not None and not self._poller.done():
+            if self._poller.get_loop() is loop:
+                return
+            # The previous loop is gone (async_to_sync); so are its receivers.
+            self._poller.cancel()
+            for channel, waiters in list(self._waiters.items()):
+                live = [f for f in waiters if f.get_loop() is loop]
+                self._waiters[channel] = collections.deque(live)
+        self._poller = loop.create_task(self._poll())
+
+    async def _poll(self):
+        delay = MIN_POLL_INTERVAL
+        while self._waiters:
+            prefixes = sorted({self.non_local_name(channel) for channel in self._waiters})
+            rows = await self._run(self._fetch_local, prefixes)
+            for channel, expires, body in rows:
+                self._deliver(channel, expires, body)
+            if len(rows) >= self.batch_size:
+                delay = MIN_POLL_INTERVAL
+                continue
+            self._drop_expired_buffers()
+            await asyncio.sleep(delay)
+            delay = MIN_POLL_INTERVAL if rows else min(delay * 2, self.poll_interval)
+
+    def _deliver(self, channel, expires, body):
+        waiters = self._waiters.get(channel)
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(pickle.loads(body))
+                return
+        self._buffers[channel].append((expires, body))
+
+    def _drop_expired_buffers(self):
+        now = time.time()
+        for channel, buffer in list(self._buffers.items()):
+            while buffer and buffer[0][0] < now:
+                buffer.popleft()
+            if not buffer:
+                del self._buffers[channel]
+
+    def queue_depth(self):
+        """
+        Unexpired messages waiting in the database (all processes), the
+        channels they are on and the longest queue, plus messages this
+        process has fetched but not yet handed to a receiver.  Blocks on the
+        database thread: call it from sync code, not the event loop.
+        """
+        def count():
+            now = time.time()
+            messages, channels = self._connection().execute(
+                'SELECT COUNT(*), COUNT(DISTINCT channel) FROM channel_message WHERE expires >= ?',
+                (now,)).fetchone()
+            longest = self._connection().execute(
+                'SELECT MAX(depth) FROM (SELECT COUNT(*) AS depth FROM channel_message '
+                'WHERE expires >= ? GROUP BY channel)', (now,)).fetchone()[0]
+            return messages, channels, longest or 0
+        messages, channels, longest = self._executor.submit(count).result()
+        return {
+            'messages': messages,
+            'channels': channels,
+            'max_channel_depth': longest,
+            'local_buffered': sum(len(buffer) for buffer in list(self._buffers.values())),
+        }
+
+    async def new_channel(self, prefix='specific.'):
+        """Return a new channel name for something in this process to receive on."""
+        return '%s.%s!%s' % (prefix, self.client_prefix, _random_name())
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+
+        def add(connection):
+            connection.execute(
+                'INSERT INTO channel_group (name, channel, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT (name, channel) DO UPDATE SET expires = excluded.expires',
+                (group, channel, time.time() + self.group_expiry))
+        await self._run(self._transaction, add)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), "Invalid channel name"
+        assert self.valid_group_name(group), "Invalid group name"
+
+        def discard(connection):
+            connection.execute('DELETE FROM channel_group WHERE name = ? AND channel = ?',
+                               (group, channel))
+        await self._run(self._transaction, discard)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        body = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+
+        def send(connection):
+            channels = [row[0] for row in connection.execute(
+                'SELECT channel FROM channel_group WHERE name = ? AND expires >= ?',
+                (group, time.time()))]
+            self._insert(connection, channels, body)
+        await self._run(self._transaction, send)
+
+    # Flush extension
+
+    async def flush(self):
+        def flush(connection):
+            connection.execute('DELETE FROM channel_message')
+            connection.execute('DELETE FROM channel_group')
+        await self._run(self._transaction, flush)
+        self._buffers.clear()
+
+    async def close(self):
+        # Stop the poller; receivers still waiting get cancelled.
+        for waiters in self._waiters.values():
+            for future in waiters:
+                future.cancel()
+        self._waiters.clear()
+        if self._poller is not None and not self._poller.done():
+            if self._poller.get_loop() is asyncio.get_running_loop():
+                await self._poller
+            else:
+                self._poller.cancel()
+        self._poller = None
@@ -0,0 +1,97 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.layers import SQLiteChannelLayer
+
+GROUP = 'bench'
+
+
+def _worker(path, index, workers, count, batch_size, names, channels, barrier, results):
+    asyncio.run(_run_worker(path, index, workers, count, batch_size, names, channels, barrier, results))
+
+
+async def _run_worker(path, index, workers, count, batch_size, names, channels, barrier, results):
+    # Capacity above the message count: the bench measures delivery, not
+    # producers backing off.
+    layer = SQLiteChannelLayer(path=path, capacity=count + 1, batch_size=batch_size)
+    channel = await layer.new_channel()
+    await layer.group_add(GROUP, channel)
+    names.put((index, channel))
+    target = channels.get()[(index + 1) % workers]
+
+    async def receive_all():
+        for _ in range(count):
+            await layer.receive(channel)
+
+    async def send_all():
+        for i in range(count):
+            await layer.send(target, {'type': 'bench.message', 'n': i})
+
+    async def group_send_all():
+        for i in range(count):
+            await layer.group_send(GROUP, {'type': 'bench.message', 'n': i})
+
+    barrier.wait()
+    started = time.perf_counter()
+    await asyncio.gather(send_all(), receive_all())
+    ring = time.perf_counter() - started
+
+    barrier.wait()
+    started = time.perf_counter()
+    if index == 0:
+        await asyncio.gather(group_send_all(), receive_all())
+    else:
+        await receive_all()
+    group = time.perf_counter() - started
+    await layer.close()
+    results.put((index, ring, group))
+
+
+class Command(BaseCommand):
+    help = ("Measure chat.layers.SQLiteChannelLayer throughput across worker processes: "
+            "point-to-point sends around a ring, then fan-out with group_send.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--messages', type=int, default=2000,
+                            help="Messages each worker sends (and receives) per phase.")
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        workers, count = options['workers'], options['messages']
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'channels.sqlite3')
+            names, results = multiprocessing.Queue(), multiprocessing.Queue()
+            channels = [multiprocessing.Queue() for _ in range(workers)]
+            barrier = multiprocessing.Barrier(workers)
+            processes = [
+                multiprocessing.Process(target=_worker, args=(
+                    path, i, workers, count, options['batch_size'], names, channels[i], barrier, results))
+                for i in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            ordered = [name for _, name in sorted(names.get() for _ in range(workers))]
+            for queue in channels:
+                queue.put(ordered)
+            timings = [results.get() for _ in range(workers)]
+            for process in processes:
+                process.join()
+        finally:
+            shutil.rmtree(directory)
+
+        ring = max(t[1] for t in timings)
+        group = max(t[2] for t in timings)
+        self.stdout.write("%d workers, %d messages each, batch size %d"
+                          % (workers, count, options['batch_size']))
+        self.stdout.write("%-12s %10s %10s %12s" % ("phase", "messages", "seconds", "messages/s"))
+        for name, delivered, elapsed in (("send ring", workers * count, ring),
+                                         ("group_send", workers * count, group)):
+            self.stdout.write("%-12s %10d %10.2f %12.0f" % (name, delivered, elapsed, delivered / elapsed))
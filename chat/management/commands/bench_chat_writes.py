@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django_private_chat2.consumers.db_operations import save_text_message
+from django_private_chat2.models import MessageModel
+
+from chat.writebehind import MessageWriteBuffer
+
+
+class Command(BaseCommand):
+    help = ("Persist a burst of chat messages from concurrent senders, one INSERT per message "
+            "(django_private_chat2) and through the write-behind buffer, and compare.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--senders', type=int, default=50)
+        parser.add_argument('--max-batch', type=int, default=200)
+        parser.add_argument('--max-delay', type=float, default=0.05)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        users = [User.objects.create_user('bench-chat-%d' % i) for i in range(2)]
+        try:
+            asyncio.run(self.run(users, options))
+        finally:
+            # cascades to the messages and dialogs
+            User.objects.filter(pk__in=[u.pk for u in users]).delete()
+
+    async def run(self, users, options):
+        sender, recipient = users
+        count, senders = options['messages'], options['senders']
+        per_sender = count // senders
+
+        async def direct():
+            for i in range(per_sender):
+                await save_text_message('direct %d' % i, from_=sender, to=recipient)
+
+        buffer = MessageWriteBuffer(max_batch=options['max_batch'], max_delay=options['max_delay'])
+
+        async def buffered():
+            for i in range(per_sender):
+                # a consumer doesn't wait for the write before the next message
+                last = buffer.add(sender.pk, recipient.pk, 'buffered %d' % i)
+            await last
+
+        self.stdout.write("%d messages from %d concurrent senders" % (per_sender * senders, senders))
+        self.stdout.write("%-14s %10s %12s" % ("mode", "seconds", "messages/s"))
+        for name, job in (("per-message", direct), ("write-behind", buffered)):
+            started = time.perf_counter()
+            await asyncio.gather(*(job() for _ in range(senders)))
+            elapsed = time.perf_counter() - started
+            self.stdout.write("%-14s %10.2f %12.0f" % (name, elapsed, per_sender * senders / elapsed))
+        written = await database_sync_to_async(
+            MessageModel.objects.filter(sender=sender, text__startswith='buffered').count)()
+        stats = buffer.stats()
+        self.stdout.write("write-behind: %d rows, %d flushes, mean batch %.1f, max queue depth %d, "
+                          "flush p50 %.2f ms, p99 %.2f ms" % (
+                              written, stats['flushes'], stats['mean_batch_size'], stats['max_queue_depth'],
+                              stats['flush_ms_p50'], stats['flush_ms_p99']))
@@ -0,0 +1,208 @@
+"""
+Who is online in chat.
+
+Each process keeps the websocket connections it serves in memory (a user
+with several tabs has several), so "is this user online here" is a dict
+lookup.  So that other processes can answer too, every online user has a
+cache key ``presence:<pk>`` that this process refreshes every ``HEARTBEAT``
+seconds and that expires after ``TTL``: if a worker dies without running
+its consumers' disconnect(), its users drop off within TTL.  Other
+processes see them only with a shared cache backend (KINDAEBAY_CACHE=file
+or db).
+
+The key holds ``(worker, time)`` of its last write.  A worker whose last
+connection of a user closes deletes the key only if it was the last to
+write it; if another worker wrote since, the user is still connected
+there.  (If the other worker's write came first, the user looks offline
+to other processes until that worker's next heartbeat.)  Those cache
+calls block, and the file and db backends can't be used on the event
+loop, so the coroutines run them in a thread.
+
+Online/offline transitions are not sent out as they happen.  They are
+coalesced for ``BROADCAST_INTERVAL`` seconds (a reconnecting tab cancels
+out), the dialog partners of all changed users are looked up with one
+query, and each partner that is online gets a single ``presence_batch``
+channel-layer event listing the changes that concern them.  Settings live
+in ``settings.CHAT_PRESENCE``.
+"""
+import asyncio
+import collections
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+from django_private_chat2.models import DialogsModel
+
+CACHE_ALIAS = 'default'
+DEFAULTS = {
+    'TTL': 60,
+    'HEARTBEAT': 20,
+    'BROADCAST_INTERVAL': 1.0,
+}
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, 'CHAT_PRESENCE', {}))
+
+
+def presence_key(user_pk):
+    return 'presence:%s' % user_pk
+
+
+def dialog_partners(user_pks):
+    """Map each of ``user_pks`` to the set of users they have a dialog with."""
+    partners = collections.defaultdict(set)
+    pks = set(user_pks)
+    rows = (DialogsModel.objects.filter(Q(user1_id__in=pks) | Q(user2_id__in=pks))
+            .values_list('user1_id', 'user2_id'))
+    for user1, user2 in rows:
+        if user1 in pks:
+            partners[user1].add(user2)
+        if user2 in pks:
+            partners[user2].add(user1)
+    return partners
+
+
+class PresenceRegistry:
+
+    def __init__(self, ttl=None, heartbeat=None, broadcast_interval=None, channel_layer=None):
+        config = get_config()
+        self.ttl = ttl or config['TTL']
+        self.heartbeat = heartbeat or config['HEARTBEAT']
+        self.broadcast_interval = (config['BROADCAST_INTERVAL'] if broadcast_interval is None
+                                   else broadcast_interval)
+        self.channel_layer = channel_layer
+        # tells this registry's presence keys from other processes'
+        self.worker = uuid.uuid4().hex
+        # user pk -> channel names of this process's connections
+        self._connections = {}
+        # user pk -> latest state not broadcast yet; the state before it
+        self._changes = {}
+        self._broadcast_state = {}
+        self._flush_handle = None
+        self._heartbeat_task = None
+        self.broadcasts = 0
+        self.events_sent = 0
+
+    def _cache(self):
+        return caches[CACHE_ALIAS]
+
+    # Lookups
+
+    def is_online(self, user_pk):
+        return user_pk in self._connections or self._cache().get(presence_key(user_pk)) is not None
+
+    def online_many(self, user_pks):
+        """Return the subset of ``user_pks`` that is online, with one cache round trip."""
+        local = {pk for pk in user_pks if pk in self._connections}
+        remote = self._cache().get_many([presence_key(pk) for pk in user_pks if pk not in local])
+        return local | {pk for pk in user_pks if presence_key(pk) in remote}
+
+    @property
+    def local_users(self):
+        return len(self._connections)
+
+    # Connection tracking, called by the consumer on the event loop
+
+    async def connect(self, user_pk, channel_name):
+        channels = self._connections.setdefault(user_pk, set())
+        channels.add(channel_name)
+        self._ensure_heartbeat()
+        if len(channels) == 1:
+            self._changed(user_pk, True)
+        await database_sync_to_async(self._refresh)([user_pk])
+
+    async def disconnect(self, user_pk, channel_name):
+        channels = self._connections.get(user_pk)
+        if channels is None:
+            return
+        channels.discard(channel_name)
+        if not channels:
+            del self._connections[user_pk]
+            self._changed(user_pk, False)
+            await database_sync_to_async(self._forget)(user_pk)
+
+    def _refresh(self, user_pks):
+        stamp = (self.worker, time.time())
+        self._cache().set_many({presence_key(pk): stamp for pk in user_pks}, self.ttl)
+
+    def _forget(self, user_pk):
+        if user_pk in self._connections:
+            # reconnected while this waited for the thread
+            return
+        cache = self._cache()
+        stamp = cache.get(presence_key(user_pk))
+        if isinstance(stamp, tuple) and stamp[0] == self.worker:
+            cache.delete(presence_key(user_pk))
+
+    def _changed(self, user_pk, online):
+        if user_pk not in self._changes:
+            self._broadcast_state[user_pk] = not online
+        self._changes[user_pk] = online
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(
+                self.broadcast_interval, lambda: loop.create_task(self.broadcast()))
+
+    # Broadcasting
+
+    async def broadcast(self):
+        """Send the coalesced changes to the online dialog partners of the changed users."""
+        self._flush_handle = None
+        changes, self._changes = self._changes, {}
+        before, self._broadcast_state = self._broadcast_state, {}
+        # Went offline and back (or the reverse) within the interval: nothing to say.
+        changes = {pk: online for pk, online in changes.items() if before.get(pk) != online}
+        if not changes:
+            return
+        partners = await database_sync_to_async(dialog_partners)(changes)
+        per_recipient = collections.defaultdict(list)
+        for user_pk, online in changes.items():
+            for partner in partners.get(user_pk, ()):
+                per_recipient[partner].append((str(user_pk), online))
+        online = await database_sync_to_async(self.online_many)(list(per_recipient))
+        layer = self.channel_layer or get_channel_layer()
+        for recipient, events in per_recipient.items():
+            if recipient in online:
+                await layer.group_send(str(recipient), {'type': 'presence_batch', 'changes': events})
+                self.events_sent += 1
+        self.broadcasts += 1
+
+    # Heartbeat
+
+    def _ensure_heartbeat(self):
+        loop = asyncio.get_running_loop()
+        task = self._heartbeat_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._heartbeat_task = loop.create_task(self._beat())
+
+    async def _beat(self):
+        while self._connections:
+            await asyncio.sleep(self.heartbeat)
+            await database_sync_to_async(self._refresh)(list(self._connections))
+
+    def stats(self):
+        # Called from the metrics threads while the event loop connects and
+        # disconnects: copy the values in one step rather than iterating.
+        return {
+            'local_users': self.local_users,
+            'local_connections': sum(map(len, list(self._connections.values()))),
+            'pending_changes': len(self._changes),
+            'broadcasts': self.broadcasts,
+            'events_sent': self.events_sent,
+        }
+
+
+_registry = None
+
+
+def get_registry():
+    """The process-wide registry."""
+    global _registry
+    if _registry is None:
+        _registry = PresenceRegistry()
+    return _registry
@@ -144,7 +144,10 @@ ASGI_APPLICATION = 'chat.chat.routing.application'
 
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        'BACKEND': 'chat.layers.SQLiteChannelLayer',
+        'CONFIG': {
+            'path': os.path.join(BASE_DIR, 'channels.sqlite3'),
+        },
     }
 }
 LOGGING = {
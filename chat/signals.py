@@ -0,0 +1,18 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import directory
+
+
+@receiver(post_save, sender=get_user_model())
+def user_saved(sender, instance, created=False, update_fields=None, raw=False, **kwargs):
+    # Logging in saves last_login only; that can't change the directory.
+    if raw or (update_fields and 'username' not in update_fields):
+        return
+    directory.invalidate_directory()
+
+
+@receiver(post_delete, sender=get_user_model())
+def user_deleted(sender, instance, **kwargs):
+    directory.invalidate_directory()
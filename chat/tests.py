@@ -1,3 +1,345 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django_private_chat2.consumers.message_types import MessageTypes
+from django_private_chat2.models import DialogsModel, MessageModel
+
+from . import directory, presence, writebehind
+from .consumers import ChatConsumer
+from .layers import SQLiteChannelLayer
+
+
+class UsersListTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.me = User.objects.create_user('me', password='x')
+        for name in ('alice', 'alan', 'albert', 'bob', 'Alex'):
+            User.objects.create_user(name, password='x')
+        self.client.force_login(self.me)
+
+    def usernames(self, response):
+        return [user['username'] for user in response.json()]
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/users/').status_code, 302)
+
+    def test_array_body_excludes_self(self):
+        response = self.client.get('/users/')
+        self.assertEqual(self.usernames(response), ['Alex', 'alan', 'albert', 'alice', 'bob'])
+        self.assertIsInstance(response.json()[0]['pk'], str)
+        self.assertNotIn('Link', response)
+
+    def test_unpaged_request_gets_every_user(self):
+        # what the bundled frontend sends
+        for i in range(directory.PAGE_SIZE):
+            User.objects.create_user('zed%02d' % i, password='x')
+        response = self.client.get('/users/')
+        self.assertEqual(len(response.json()), directory.PAGE_SIZE + 5)
+        self.assertNotIn('Link', response)
+        self.assertEqual(len(self.client.get('/users/', {'limit': 10}).json()), 10)
+
+    def test_cursor_pagination(self):
+        response = self.client.get('/users/', {'limit': 2})
+        self.assertEqual(self.usernames(response), ['Alex', 'alan'])
+        next_url = response['Link'].split('>')[0].lstrip('<')
+        response = self.client.get(next_url)
+        self.assertEqual(self.usernames(response), ['albert', 'alice'])
+        self.assertEqual(self.client.get('/users/', {'after': '!!'}).status_code, 400)
+
+    def test_prefix_search_uses_index(self):
+        response = self.client.get('/users/', {'q': 'al'})
+        self.assertEqual(self.usernames(response), ['alan', 'albert', 'alice'])
+        self.assertEqual(directory.prefix_range('al'), ('al', 'am'))
+        queryset = directory.directory_page(self.me.pk, 'al')
+        sql, params = (User.objects.filter(username__gte='al', username__lt='am')
+                       .order_by('username').values('pk', 'username').query.sql_with_params())
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('INDEX', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertEqual(len(queryset), 3)
+
+    def test_prefix_range_at_the_end_of_unicode(self):
+        top = chr(sys.maxunicode)
+        self.assertEqual(directory.prefix_range('a' + top), ('a' + top, 'b'))
+        self.assertEqual(directory.prefix_range(top * 2), (top * 2, None))
+        self.assertEqual(directory.prefix_range('\ud7ff'), ('\ud7ff', '\ue000'))
+        User.objects.create_user(top + 'x', password='x')
+        response = self.client.get('/users/', {'q': top})
+        self.assertEqual(self.usernames(response), [top + 'x'])
+
+    def test_cached_until_user_created(self):
+        self.client.get('/users/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/users/')
+        self.assertFalse([q for q in queries if 'ORDER BY "auth_user"."username"' in q['sql']])
+        User.objects.create_user('albatross', password='x')
+        self.assertIn('albatross', self.usernames(self.client.get('/users/')))
+
+    def test_login_does_not_invalidate(self):
+        version = directory.directory_version()
+        self.client.login(username='alice', password='x')
+        self.assertEqual(directory.directory_version(), version)
+
+
+class SQLiteChannelLayerTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'channels.sqlite3')
+
+    def layer(self, **config):
+        return SQLiteChannelLayer(path=self.path, poll_interval=0.01, **config)
+
+    def test_idle_polls_dont_take_the_write_lock(self):
+        layer = self.layer(timeout=0.05)
+        layer._connection()
+        writer = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(writer.close)
+        writer.execute('BEGIN IMMEDIATE')
+        # another worker is writing; an empty poll neither waits nor fails
+        self.assertEqual(layer._fetch_local([layer.client_prefix + '!']), [])
+        writer.execute('ROLLBACK')
+
+    async def test_send_receive_across_instances(self):
+        sender, receiver = self.layer(), self.layer()
+        channel = await receiver.new_channel()
+        await sender.send(channel, {'type': 'test.message', 'text': 'hi'})
+        self.assertEqual(await receiver.receive(channel), {'type': 'test.message', 'text': 'hi'})
+        await sender.send('worker', {'type': 'test.general'})
+        self.assertEqual((await receiver.receive('worker'))['type'], 'test.general')
+        await receiver.close()
+
+    async def test_batched_delivery_keeps_order(self):
+        sender, receiver = self.layer(batch_size=3), self.layer()
+        first, second = await receiver.new_channel(), await receiver.new_channel()
+        for i in range(5):
+            await sender.send(first, {'n': i})
+            await sender.send(second, {'n': i})
+        received = [(await receiver.receive(first))['n'] for _ in range(5)]
+        received += [(await receiver.receive(second))['n'] for _ in range(5)]
+        self.assertEqual(received, [0, 1, 2, 3, 4] * 2)
+        await receiver.close()
+
+    async def test_groups(self):
+        sender, receiver = self.layer(), self.layer()
+        one, two = await receiver.new_channel(), await receiver.new_channel()
+        await receiver.group_add('dialog', one)
+        await receiver.group_add('dialog', two)
+        await sender.group_send('dialog', {'type': 'hello'})
+        self.assertEqual(await receiver.receive(one), {'type': 'hello'})
+        self.assertEqual(await receiver.receive(two), {'type': 'hello'})
+        await receiver.group_discard('dialog', two)
+        await sender.group_send('dialog', {'type': 'again'})
+        self.assertEqual(await receiver.receive(one), {'type': 'again'})
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(receiver.receive(two), 0.1)
+        await receiver.close()
+
+    async def test_capacity(self):
+        layer = self.layer(capacity=2, channel_capacity={'big*': 3})
+        await layer.send('small', {})
+        await layer.send('small', {})
+        with self.assertRaises(ChannelFull):
+            await layer.send('small', {})
+        for _ in range(3):
+            await layer.send('big', {})
+        with self.assertRaises(ChannelFull):
+            await layer.send('big', {})
+
+    async def test_queue_depth(self):
+        layer = self.layer()
+        for channel in ('a', 'a', 'a', 'b'):
+            await layer.send(channel, {})
+        depth = await sync_to_async(layer.queue_depth)()
+        self.assertEqual(depth, {'messages': 4, 'channels': 2, 'max_channel_depth': 3, 'local_buffered': 0})
+
+    async def test_expiry(self):
+        layer = self.layer(expiry=0.05)
+        channel = await layer.new_channel()
+        await layer.group_add('dialog', channel)
+        await layer.send(channel, {'type': 'stale'})
+        await asyncio.sleep(0.1)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), 0.1)
+        layer._next_cleanup = 0
+        await layer.send('other', {})
+        # the undelivered message marks the channel as gone
+        await layer.group_send('dialog', {'type': 'fresh'})
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), 0.1)
+        await layer.flush()
+        await layer.close()
+
+
+class WriteMessagesTest(TestCase):
+    def test_ids_and_dialogs(self):
+        alice = User.objects.create_user('alice')
+        bob = User.objects.create_user('bob')
+        DialogsModel.objects.create(user1=bob, user2=alice)
+        carol = User.objects.create_user('carol')
+        messages = [MessageModel(sender=alice, recipient=bob, text='one'),
+                    MessageModel(sender=bob, recipient=alice, text='two'),
+                    MessageModel(sender=alice, recipient=carol, text='three')]
+        writebehind.write_messages(messages)
+        for message in messages:
+            self.assertEqual(MessageModel.objects.get(pk=message.pk).text, message.text)
+        self.assertEqual(DialogsModel.objects.count(), 2)
+        self.assertIsNotNone(DialogsModel.dialog_exists(alice, carol))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class WriteBehindConsumerTest(TransactionTestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    async def test_buffer_batches(self):
+        buffer = writebehind.MessageWriteBuffer(max_batch=3, max_delay=0.01)
+        futures = [buffer.add(self.alice.pk, self.bob.pk, 'msg %d' % i) for i in range(5)]
+        self.assertEqual(buffer.depth, 5)
+        saved = await asyncio.gather(*futures)
+        self.assertEqual([m.text for m in saved], ['msg %d' % i for i in range(5)])
+        self.assertEqual(len({m.pk for m in saved}), 5)
+        stats = buffer.stats()
+        self.assertEqual(stats['messages_written'], 5)
+        self.assertEqual(stats['flushes'], 2)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['max_queue_depth'], 5)
+
+    def test_flush_sync(self):
+        buffer = writebehind.MessageWriteBuffer(max_delay=60)
+
+        async def enqueue():
+            buffer.add(self.alice.pk, self.bob.pk, 'pending')
+        async_to_sync(enqueue)()
+        buffer.flush_sync()
+        self.assertTrue(MessageModel.objects.filter(text='pending').exists())
+
+    async def test_consumer_acknowledges_after_flush(self):
+        # channels.testing needs daphne; drive the ASGI websocket protocol directly.
+        communicator = ApplicationCommunicator(ChatConsumer.as_asgi(), {
+            'type': 'websocket', 'path': '/chat_ws', 'headers': [], 'subprotocols': [],
+            'user': self.alice,
+        })
+
+        async def send(data):
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+        async def receive():
+            return json.loads((await communicator.receive_output(2))['text'])
+
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output(2))['type'], 'websocket.accept')
+        await send({'msg_type': MessageTypes.TextMessage, 'text': 'hello',
+                    'user_pk': str(self.bob.pk), 'random_id': -1})
+        event = await receive()
+        self.assertEqual(event['msg_type'], MessageTypes.MessageIdCreated)
+        self.assertEqual(event['random_id'], -1)
+        message = await database_sync_to_async(MessageModel.objects.get)(pk=event['db_id'])
+        self.assertEqual(message.text, 'hello')
+        await send({'msg_type': MessageTypes.TextMessage, 'text': '',
+                    'user_pk': str(self.bob.pk), 'random_id': -2})
+        self.assertEqual((await receive())['msg_type'], MessageTypes.ErrorOccurred)
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(2)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class PresenceTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+        DialogsModel.objects.create(user1=self.alice, user2=self.bob)
+        self.layer = InMemoryChannelLayer()
+        self.registry = presence.PresenceRegistry(broadcast_interval=0.01, channel_layer=self.layer)
+
+    async def test_connect_disconnect(self):
+        await self.registry.connect(self.alice.pk, 'a1')
+        await self.registry.connect(self.alice.pk, 'a2')
+        self.assertTrue(self.registry.is_online(self.alice.pk))
+        await self.registry.disconnect(self.alice.pk, 'a1')
+        self.assertTrue(self.registry.is_online(self.alice.pk))
+        await self.registry.disconnect(self.alice.pk, 'a2')
+        self.assertFalse(self.registry.is_online(self.alice.pk))
+        self.assertEqual(self.registry.online_many([self.alice.pk, self.bob.pk]), set())
+
+    async def test_remote_presence_expires(self):
+        other = presence.PresenceRegistry(ttl=1)
+        await other.connect(self.carol.pk, 'c1')
+        self.assertTrue(self.registry.is_online(self.carol.pk))
+        self.assertEqual(self.registry.online_many([self.carol.pk, self.bob.pk]), {self.carol.pk})
+        cache.delete(presence.presence_key(self.carol.pk))  # TTL ran out
+        self.assertFalse(self.registry.is_online(self.carol.pk))
+        other._heartbeat_task.cancel()
+
+    async def test_disconnect_keeps_users_connected_to_other_workers(self):
+        other = presence.PresenceRegistry()
+        await self.registry.connect(self.alice.pk, 'a1')
+        await other.connect(self.alice.pk, 'a2')
+        await self.registry.disconnect(self.alice.pk, 'a1')
+        # the key is the other worker's now
+        self.assertTrue(presence.PresenceRegistry().is_online(self.alice.pk))
+        await other.disconnect(self.alice.pk, 'a2')
+        self.assertFalse(presence.PresenceRegistry().is_online(self.alice.pk))
+        self.registry._heartbeat_task.cancel()
+        other._heartbeat_task.cancel()
+
+    async def test_db_cache(self):
+        # The db cache can't be used on the event loop.
+        db_cache = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                'LOCATION': 'test_presence_cache'}}
+        with override_settings(CACHES=db_cache):
+            await database_sync_to_async(call_command)('createcachetable', verbosity=0)
+            await self.registry.connect(self.bob.pk, 'bob-channel')
+            await self.registry.connect(self.alice.pk, 'a1')
+            await self.registry.broadcast()
+            self.assertEqual(self.registry.events_sent, 2)
+            await self.registry.disconnect(self.alice.pk, 'a1')
+            self.assertEqual(await database_sync_to_async(presence.PresenceRegistry().online_many)(
+                [self.alice.pk, self.bob.pk]), {self.bob.pk})
+            self.registry._heartbeat_task.cancel()
+
+    async def test_batched_broadcast_to_online_partners(self):
+        await self.layer.group_add(str(self.bob.pk), 'bob-channel')
+        await self.registry.connect(self.bob.pk, 'bob-channel')
+        await self.registry.connect(self.carol.pk, 'carol-channel')
+        await self.registry.connect(self.alice.pk, 'a1')
+        await self.registry.broadcast()
+        # bob has a dialog with alice; carol has none, so nobody is told about her
+        event = await self.layer.receive('bob-channel')
+        self.assertEqual(event, {'type': 'presence_batch', 'changes': [(str(self.alice.pk), True)]})
+        # ...and alice about bob
+        self.assertEqual(self.registry.events_sent, 2)
+        # a reconnect within one interval is not broadcast
+        await self.registry.disconnect(self.alice.pk, 'a1')
+        await self.registry.connect(self.alice.pk, 'a1')
+        await self.registry.broadcast()
+        self.assertEqual(self.registry.events_sent, 2)
+        self.registry._heartbeat_task.cancel()
+
+    def test_online_view(self):
+        self.client.force_login(self.alice)
+        cache.set(presence.presence_key(self.bob.pk), 1)
+        response = self.client.get('/users/online/', {'pk': [self.bob.pk, self.carol.pk]})
+        self.assertEqual(response.json(), {str(self.bob.pk): True, str(self.carol.pk): False})
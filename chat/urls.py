@@ -0,0 +1,7 @@
+from django.urls import re_path
+
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r'^chat_ws$', consumers.ChatConsumer.as_asgi()),
+]
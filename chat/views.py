@@ -1,3 +1,74 @@
-from django.shortcuts import render
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.views import View
 
-# Create your views here.
+from products.pagination import InvalidCursor
+
+from . import directory, presence
+
+
+class UsersListView(LoginRequiredMixin, View):
+    """
+    The user directory as a JSON array of ``{username, pk}``: all of it, or
+    with ``?limit=`` one page, the next page (if any) linked from the
+    ``Link`` header (``rel="next"``) so the body keeps the shape the
+    frontend decodes.
+    """
+    http_method_names = ['get', ]
+
+    def get(self, request, *args, **kwargs):
+        prefix = request.GET.get('q', '').strip()
+        after = request.GET.get('after') or None
+        # The bundled frontend doesn't page; it gets everything.
+        paged = 'limit' in request.GET or after is not None
+        try:
+            page_size = int(request.GET.get('limit', directory.PAGE_SIZE))
+        except ValueError:
+            return HttpResponseBadRequest("Invalid limit.")
+        if page_size < 1:
+            return HttpResponseBadRequest("Invalid limit.")
+        page_size = min(page_size, directory.MAX_PAGE_SIZE) if paged else None
+
+        cache = caches[directory.CACHE_ALIAS]
+        key = directory.page_key(request.user.pk, prefix, after, page_size)
+        cached = cache.get(key)
+        if cached is None:
+            if paged:
+                try:
+                    page = directory.directory_page(request.user.pk, prefix, after, page_size,
+                                                     params=request.GET)
+                except InvalidCursor:
+                    return HttpResponseBadRequest("Invalid page cursor.")
+            else:
+                page = directory.directory_users(request.user.pk, prefix).order_by(*directory.ORDERING)
+            data = [{
+                "username": user['username'],
+                "pk": str(user['pk'])
+            } for user in page]
+            link = None
+            if paged and page.next_cursor:
+                link = '<%s>; rel="next"' % request.build_absolute_uri(
+                    '%s?%s' % (request.path, page.next_query))
+            body = JsonResponse(data, safe=False).content
+            cached = (body, link)
+            cache.set(key, cached, directory.PAGE_TIMEOUT)
+        body, link = cached
+        response = HttpResponse(body, content_type='application/json')
+        if link:
+            response['Link'] = link
+        return response
+
+
+class OnlineUsersView(LoginRequiredMixin, View):
+    """``?pk=1&pk=2`` -> ``{"1": true, "2": false}``, for up to MAX_PKS users."""
+    http_method_names = ['get', ]
+    MAX_PKS = 200
+
+    def get(self, request, *args, **kwargs):
+        try:
+            pks = [int(pk) for pk in request.GET.getlist('pk')[:self.MAX_PKS]]
+        except ValueError:
+            return HttpResponseBadRequest("Invalid user pk.")
+        online = presence.get_registry().online_many(pks)
+        return JsonResponse({str(pk): pk in online for pk in pks})
@@ -0,0 +1,211 @@
+"""
+Write-behind persistence for chat text messages.
+
+django_private_chat2 saves every text message with its own INSERT (plus a
+dialog lookup), so a burst of messages queues up on SQLite's single writer
+lock.  The recipient already gets the message from the channel layer before
+it is saved; only the database id (MessageIdCreated) has to wait for the
+write.  MessageWriteBuffer collects messages and writes them with one
+bulk_create per batch, when ``MAX_BATCH`` messages are pending or
+``MAX_DELAY`` seconds after the first one, whichever comes first.
+
+Durability: messages waiting in the buffer are lost if the process is
+killed outright.  With ``FLUSH_ON_SHUTDOWN`` (the default) whatever is
+pending is written when the interpreter exits normally, e.g. after the ASGI
+server handled SIGTERM.  ``MAX_BATCH = 1`` turns the buffer into
+write-through.  Settings live in ``settings.CHAT_WRITE_BEHIND``.
+"""
+import asyncio
+import atexit
+import collections
+import logging
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django_private_chat2.models import DialogsModel, MessageModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_BATCH': 200,
+    'MAX_DELAY': 0.05,
+    'FLUSH_ON_SHUTDOWN': True,
+}
+LATENCY_WINDOW = 1000
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, 'CHAT_WRITE_BEHIND', {}))
+
+
+def write_messages(messages):
+    """
+    Insert ``messages`` (unsaved MessageModel instances) with one
+    bulk_create, set their ids, and create the dialogs MessageModel.save()
+    would have created.
+    """
+    with transaction.atomic():
+        MessageModel.objects.bulk_create(messages)
+        if messages and messages[-1].pk is None:
+            # SQLite can't return the ids from a bulk insert.  The INSERT
+            # holds the write lock until commit and the ids come from an
+            # AUTOINCREMENT counter, so this batch got the last len(messages).
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT last_insert_rowid()')
+                last = cursor.fetchone()[0]
+            for offset, message in enumerate(messages):
+                message.pk = last - len(messages) + 1 + offset
+        pairs = {tuple(sorted((m.sender_id, m.recipient_id))) for m in messages}
+        if pairs:
+            condition = Q()
+            for a, b in pairs:
+                condition |= Q(user1_id=a, user2_id=b) | Q(user1_id=b, user2_id=a)
+            existing = {tuple(sorted(pair)) for pair in
+                        DialogsModel.objects.filter(condition).values_list('user1_id', 'user2_id')}
+            DialogsModel.objects.bulk_create(
+                [DialogsModel(user1_id=a, user2_id=b) for a, b in sorted(pairs - existing)])
+    return messages
+
+
+def _resolve(future, result=None, exception=None):
+    if future.done() or future.get_loop().is_closed():
+        # The waiting consumer went away (or its loop did).
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+class MessageWriteBuffer:
+
+    def __init__(self, max_batch=None, max_delay=None):
+        config = get_config()
+        self.max_batch = max_batch or config['MAX_BATCH']
+        self.max_delay = config['MAX_DELAY'] if max_delay is None else max_delay
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = None
+        self._timer = None
+        self._loop = None
+        # metrics
+        self.flushes = 0
+        self.flush_errors = 0
+        self.written = 0
+        self.max_depth = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.batch_sizes = collections.deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def add(self, sender_id, recipient_id, text):
+        """
+        Queue a text message and return a future that resolves to the
+        saved MessageModel.  Must be called from the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._flush_lock = asyncio.Lock()
+            self._timer = None
+        message = MessageModel(sender_id=sender_id, recipient_id=recipient_id, text=text,
+                               created=timezone.now())
+        future = loop.create_future()
+        with self._lock:
+            self._pending.append((message, future))
+            depth = len(self._pending)
+        self.max_depth = max(self.max_depth, depth)
+        if depth >= self.max_batch:
+            loop.create_task(self.flush())
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, lambda: loop.create_task(self.flush()))
+        return future
+
+    def _take(self):
+        with self._lock:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        return batch
+
+    async def flush(self):
+        """Write everything pending, one batch at a time."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._flush_lock:
+            while True:
+                batch = self._take()
+                if not batch:
+                    return
+                started = time.perf_counter()
+                try:
+                    await database_sync_to_async(write_messages)([m for m, _ in batch])
+                except Exception as e:
+                    self.flush_errors += 1
+                    logger.exception("Writing %d chat messages failed", len(batch))
+                    for _, future in batch:
+                        _resolve(future, exception=e)
+                    continue
+                self._record(len(batch), time.perf_counter() - started)
+                for message, future in batch:
+                    _resolve(future, message)
+
+    def flush_sync(self):
+        """Write everything pending from outside the event loop (at exit)."""
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            started = time.perf_counter()
+            write_messages([m for m, _ in batch])
+            self._record(len(batch), time.perf_counter() - started)
+
+    def _record(self, size, seconds):
+        self.flushes += 1
+        self.written += size
+        self.latencies.append(seconds)
+        self.batch_sizes.append(size)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+        return {
+            'queue_depth': self.depth,
+            'max_queue_depth': self.max_depth,
+            'flushes': self.flushes,
+            'flush_errors': self.flush_errors,
+            'messages_written': self.written,
+            'mean_batch_size': sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else 0.0,
+            'flush_ms_p50': percentile(0.5),
+            'flush_ms_p99': percentile(0.99),
+            'flush_ms_max': latencies[-1] * 1000 if latencies else 0.0,
+        }
+
+
+_buffer = None
+
+
+def get_buffer():
+    """The process-wide buffer."""
+    global _buffer
+    if _buffer is None:
+        _buffer = MessageWriteBuffer()
+    return _buffer
+
+
+@atexit.register
+def _flush_at_exit():
+    if _buffer is None or not _buffer.depth or not get_config()['FLUSH_ON_SHUTDOWN']:
+        return
+    try:
+        _buffer.flush_sync()
+    except Exception:
+        logger.exception("Flushing %d chat messages at exit failed", _buffer.depth)
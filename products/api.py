@@ -0,0 +1,147 @@
+"""
+Read-only JSON API for products.
+
+``/api/products/`` pages through the catalog with the same filters, sort
+orders and keyset cursors as the HTML listing; ``/api/products/<id>/``
+returns one product.  ``?fields=title,price`` selects the returned fields
+and only those columns are read (a ``.values()`` projection, so e.g. the
+description TextField is never loaded unless asked for).  Rows are
+serialized straight from those dictionaries, with orjson when it is
+installed and the standard json module otherwise.
+"""
+import datetime
+import decimal
+import json
+
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+
+from .catalog import SORT_ORDERINGS, clean_filters, filter_products
+from .models import Product
+from .pagination import PAGE_SIZE, InvalidCursor, paginate
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# API name -> model field
+FIELDS = {
+    'id': 'id',
+    'title': 'title',
+    'description': 'description',
+    'price': 'price',
+    'summary': 'summary',
+    'category': 'category',
+    'label': 'label',
+    'image': 'Product_Main_Img',
+    'publisher': 'publisher',
+    'seller': 'seller',
+    'publish_time': 'publish_time',
+    'last_modified': 'last_modified',
+}
+DEFAULT_FIELDS = ('id', 'title', 'price', 'summary', 'category', 'label', 'image', 'publish_time')
+MAX_PAGE_SIZE = 100
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError("%r is not JSON serializable" % type(value).__name__)
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, default=_default, separators=(',', ':')).encode()
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), content_type='application/json', status=status)
+
+
+def error_response(message, status=400):
+    return json_response({'detail': message}, status=status)
+
+
+def parse_fields(value):
+    """Return the requested API field names, in request order, or the defaults."""
+    if not value:
+        return list(DEFAULT_FIELDS)
+    names = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in names if name not in FIELDS]
+    if unknown or not names:
+        raise InvalidFields("Unknown field(s): %s. Available: %s."
+                            % (', '.join(unknown) or '(none)', ', '.join(FIELDS)))
+    return names
+
+
+def _serializer(names):
+    """Build a function turning a .values() row into the API representation."""
+    storage = Product._meta.get_field('Product_Main_Img').storage
+
+    def serialize(row):
+        item = {}
+        for name in names:
+            value = row[FIELDS[name]]
+            if name == 'image':
+                value = storage.url(value) if value else None
+            item[name] = value
+        return item
+    return serialize
+
+
+def _page_url(request, query):
+    return request.build_absolute_uri('%s?%s' % (request.path, query))
+
+
+@require_GET
+def product_list_api(request, *args, **kwargs):
+    try:
+        names = parse_fields(request.GET.get('fields'))
+    except InvalidFields as e:
+        return error_response(str(e))
+    try:
+        page_size = min(int(request.GET.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE)
+    except ValueError:
+        return error_response("Invalid limit.")
+    if page_size < 1:
+        return error_response("Invalid limit.")
+
+    filters = clean_filters(request.GET)
+    ordering = SORT_ORDERINGS[filters['sort']]
+    # The paginator reads the sort key from each row to build the cursors.
+    columns = list(dict.fromkeys([FIELDS[name] for name in names] +
+                                 [name.lstrip('-') for name in ordering]))
+    queryset = filter_products(None, filters['category'], filters['label']).values(*columns)
+    try:
+        page = paginate(queryset, ordering=ordering, after=request.GET.get('after'),
+                        before=request.GET.get('before'), page_size=page_size, params=request.GET)
+    except InvalidCursor:
+        return error_response("Invalid page cursor.")
+
+    serialize = _serializer(names)
+    return json_response({
+        'results': [serialize(row) for row in page.object_list],
+        'next': _page_url(request, page.next_query) if page.next_cursor else None,
+        'previous': _page_url(request, page.previous_query) if page.previous_cursor else None,
+    })
+
+
+@require_GET
+def product_detail_api(request, productid, *args, **kwargs):
+    try:
+        names = parse_fields(request.GET.get('fields'))
+    except InvalidFields as e:
+        return error_response(str(e))
+    row = (Product.objects.filter(id=productid)
+           .values(*dict.fromkeys(FIELDS[name] for name in names)).first())
+    if row is None:
+        return error_response("Not found.", status=404)
+    return json_response(_serializer(names)(row))
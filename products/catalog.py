@@ -0,0 +1,107 @@
+"""
+Filtering and sorting for the product listing.
+
+Every combination offered here (optional category, optional label, one of
+SORT_ORDERINGS) matches one of the composite indexes declared on
+Product.Meta, so a page is an index range scan in sort order rather than a
+table scan followed by a sort.  ``manage.py bench_catalog`` checks this.
+"""
+from urllib.parse import urlencode
+
+from .models import CATEGORY_CHOICES, LABLE_CHOICES, CategoryCount, Product
+from .pagination import paginate
+
+SORT_ORDERINGS = {
+    'newest': ('-publish_time', '-id'),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+}
+DEFAULT_SORT = 'newest'
+SORT_NAMES = (
+    ('newest', 'Newest'),
+    ('price', 'Price: low to high'),
+    ('-price', 'Price: high to low'),
+)
+
+CATEGORIES = dict(CATEGORY_CHOICES)
+LABELS = dict(LABLE_CHOICES)
+
+
+def clean_filters(params):
+    """Pick the supported listing filters out of a GET QueryDict, dropping unknown values."""
+    category = params.get('category')
+    label = params.get('label')
+    sort = params.get('sort')
+    return {
+        'category': category if category in CATEGORIES else None,
+        'label': label if label in LABELS else None,
+        'sort': sort if sort in SORT_ORDERINGS else DEFAULT_SORT,
+    }
+
+
+def filter_products(queryset=None, category=None, label=None):
+    if queryset is None:
+        queryset = Product.objects.all()
+    if category:
+        queryset = queryset.filter(category=category)
+    if label:
+        queryset = queryset.filter(label=label)
+    return queryset
+
+
+def listing_page(params, queryset=None, **kwargs):
+    """
+    Return ``(page, filters)`` for a listing request.  Raises
+    pagination.InvalidCursor for a bad ?after=/?before= cursor.
+    """
+    filters = clean_filters(params)
+    queryset = filter_products(queryset, filters['category'], filters['label'])
+    page = paginate(
+        queryset,
+        ordering=SORT_ORDERINGS[filters['sort']],
+        after=params.get('after'),
+        before=params.get('before'),
+        params=params,
+        **kwargs
+    )
+    return page, filters
+
+
+def _query(filters, **changes):
+    merged = dict(filters, **changes)
+    if merged.get('sort') == DEFAULT_SORT:
+        merged['sort'] = None
+    return urlencode([(key, value) for key, value in merged.items() if value])
+
+
+def navigation(filters):
+    """
+    Links for the category navbar and the sort/label switches, keeping the
+    other filters.  Category links carry the number of products they lead
+    to (within the current label), label links likewise within the current
+    category; the counts come from CategoryCount.
+    """
+    counts = CategoryCount.facets()
+
+    def count(category=None, label=None):
+        return sum(n for (c, l), n in counts.items()
+                   if (category is None or c == category) and (label is None or l == label))
+
+    return {
+        'all_query': _query(filters, category=None),
+        'all_count': count(label=filters['label']),
+        'category_links': [
+            (code, name, _query(filters, category=code), code == filters['category'],
+             count(code, filters['label']))
+            for code, name in CATEGORY_CHOICES
+        ],
+        'label_links': [
+            (code, name, _query(filters, label=None if code == filters['label'] else code),
+             code == filters['label'], count(filters['category'], code))
+            for code, name in LABLE_CHOICES
+        ],
+        'sort_links': [
+            (code, name, _query(filters, sort=code), code == filters['sort'])
+            for code, name in SORT_NAMES
+        ],
+    }
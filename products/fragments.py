@@ -0,0 +1,73 @@
+"""
+Cached product-card fragments for the listing pages.
+
+Each card's rendered HTML is cached under the product id and its
+``last_modified`` plus a cache-wide "generation" number.  A listing page
+fetches all of its cards with one get_many(), renders only the missing ones
+and stores them with one set_many().  Saving a product moves it to a new key,
+so a listing that read the old row before the save committed can only cache
+its render under the old key.  The old card is dropped once the save or
+delete commits (products.signals); bumping the generation invalidates every
+card at once, e.g. after derivatives were regenerated or the card template
+changed.
+"""
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+CARD_TEMPLATE = 'product-card.html'
+CARD_TIMEOUT = 60 * 60 * 24
+CACHE_ALIAS = 'default'
+GENERATION_KEY = 'product-card:generation'
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def card_generation():
+    # A fresh timestamp (rather than 1) keeps keys from an evicted
+    # generation from ever being reused.
+    return _cache().get_or_set(GENERATION_KEY, time.time_ns, None)
+
+
+def card_key(product_id, last_modified, generation):
+    return 'product-card:%s:%s:%s' % (generation, product_id, last_modified.timestamp())
+
+
+def render_card(product):
+    return render_to_string(CARD_TEMPLATE, {'product': product})
+
+
+def render_cards(products):
+    """Return the card HTML for ``products``, in order, rendering only cache misses."""
+    products = list(products)
+    if not products:
+        return []
+    cache = _cache()
+    generation = card_generation()
+    keys = [card_key(product.pk, product.last_modified, generation) for product in products]
+    cached = cache.get_many(keys)
+    missing = {}
+    cards = []
+    for key, product in zip(keys, products):
+        html = cached.get(key)
+        if html is None:
+            html = missing[key] = render_card(product)
+        cards.append(mark_safe(html))
+    if missing:
+        cache.set_many(missing, CARD_TIMEOUT)
+    return cards
+
+
+def invalidate_card(product_id, last_modified):
+    """Drop the card of the product as of ``last_modified`` once the current transaction commits."""
+    key = card_key(product_id, last_modified, card_generation())
+    transaction.on_commit(lambda: _cache().delete(key))
+
+
+def invalidate_all_cards():
+    _cache().set(GENERATION_KEY, time.time_ns(), None)
@@ -0,0 +1,120 @@
+"""
+Resized derivatives of product images.
+
+Every uploaded Product_Main_Img gets a small "card" rendition for the
+listing and a larger "detail" rendition for the product page, each as a
+progressive JPEG and a WebP.  Derivatives live under MEDIA_ROOT/derivatives/
+with names computed from the original's full name (``x.png`` ->
+``card/x.png.webp``, so ``x.jpg`` gets its own), so no extra columns are
+needed and templates fall back to the original until they exist.
+"""
+import io
+from collections import namedtuple
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+DERIVATIVE_ROOT = 'derivatives'
+
+# name -> bounding box; images are scaled down to fit, never up or cropped
+SIZES = {
+    'card': (540, 540),
+    'detail': (1200, 1200),
+}
+
+FORMATS = {
+    'jpeg': ('jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', {'quality': 80, 'method': 4}),
+}
+
+ImageVariant = namedtuple('ImageVariant', ['jpeg', 'webp'])
+
+
+def source_storage():
+    from .models import Product
+    return Product._meta.get_field('Product_Main_Img').storage
+
+
+def derivative_name(name, size, fmt):
+    return '%s/%s/%s.%s' % (DERIVATIVE_ROOT, size, name, FORMATS[fmt][0])
+
+
+def derivative_names(name):
+    return [derivative_name(name, size, fmt) for size in SIZES for fmt in FORMATS]
+
+
+def has_derivatives(name, storage=None):
+    storage = storage or default_storage
+    return all(storage.exists(derivative) for derivative in derivative_names(name))
+
+
+def _flatten(image):
+    # JPEG has no alpha channel; composite transparent images onto white.
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'jpeg':
+        image = _flatten(image)
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    image.save(buffer, format=fmt.upper(), **FORMATS[fmt][1])
+    return buffer.getvalue()
+
+
+def generate_derivatives(name, force=False):
+    """
+    Write every size/format rendition of the stored image ``name``.
+    Returns the list of derivative names written (empty when they all
+    existed already and ``force`` is false).  Safe to call from a worker
+    process: it only touches storage, never the database.
+    """
+    storage = default_storage
+    if not force and has_derivatives(name, storage):
+        return []
+    written = []
+    with source_storage().open(name, 'rb') as source:
+        original = Image.open(source)
+        largest = max(SIZES.values())
+        # Let the JPEG decoder downscale by a power of two while decoding.
+        original.draft('RGB', largest)
+        original = ImageOps.exif_transpose(original)
+        original.load()
+    for size, box in SIZES.items():
+        image = original.copy()
+        image.thumbnail(box, Image.LANCZOS)
+        for fmt in FORMATS:
+            target = derivative_name(name, size, fmt)
+            if storage.exists(target):
+                storage.delete(target)
+            written.append(storage.save(target, ContentFile(_encode(image, fmt))))
+    return written
+
+
+def delete_derivatives(name):
+    for derivative in derivative_names(name):
+        if default_storage.exists(derivative):
+            default_storage.delete(derivative)
+
+
+def variant(image_field, size):
+    """
+    URLs of the ``size`` rendition of an ImageField value, falling back to
+    the original image (and no WebP, whatever the original's format is)
+    when the derivatives have not been generated yet.
+    """
+    if not image_field:
+        return ImageVariant('', '')
+    name = image_field.name
+    jpeg = derivative_name(name, size, 'jpeg')
+    if not default_storage.exists(jpeg):
+        return ImageVariant(image_field.url, '')
+    return ImageVariant(default_storage.url(jpeg),
+                        default_storage.url(derivative_name(name, size, 'webp')))
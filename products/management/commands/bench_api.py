@@ -0,0 +1,52 @@
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+
+from products import api
+from .bench_catalog import Command as CatalogBench
+from .bench_product_detail import QueryCounter
+
+
+class Command(BaseCommand):
+    help = ("Compare the JSON product API with the HTML listing it replaces for clients: "
+            "queries, response size and latency per page.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=0,
+                            help="Insert this many synthetic products first (rolled back afterwards).")
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        client = Client()
+        rows = [
+            ("HTML /home/", '/home/', {}),
+            ("JSON default fields", '/api/products/', {}),
+            ("JSON ?fields=id,title,price", '/api/products/', {'fields': 'id,title,price'}),
+            ("JSON all fields", '/api/products/', {'fields': ','.join(api.FIELDS)}),
+        ]
+        self.stdout.write("JSON encoder: %s" % ('orjson' if api.orjson else 'json'))
+        with transaction.atomic():
+            if options['rows']:
+                CatalogBench(stdout=self.stdout, stderr=self.stderr)._seed(options['rows'])
+            self.stdout.write("%-30s %8s %9s %8s %8s" % ("request", "queries", "bytes", "p50 ms", "p99 ms"))
+            for name, url, params in rows:
+                cache.clear()
+                counter = QueryCounter()
+                with connection.execute_wrapper(counter):
+                    response = client.get(url, params)
+                timings = []
+                for _ in range(options['repeat']):
+                    # render every card, as a cold listing does
+                    cache.clear()
+                    started = time.perf_counter()
+                    client.get(url, params)
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                self.stdout.write("%-30s %8d %9d %8.3f %8.3f" % (
+                    name, counter.count, len(response.content), statistics.median(timings),
+                    timings[min(len(timings) - 1, int(len(timings) * 0.99))]))
+            transaction.set_rollback(True)
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.urls import path
+from django_private_chat2.consumers.message_types import MessageTypes
+
+from KindaEbay import urls as project_urls
+from chat.consumers import ChatConsumer
+from products import views
+from products.catalog import SORT_ORDERINGS
+from products.models import Product
+from .bench_catalog import FILTER_SHAPES, Command as CatalogBench
+
+# The bench serves the sync versions of the views next to the site's own
+# URLs, with this module as ROOT_URLCONF.
+urlpatterns = [
+    path('sync/home/', views._product_list),
+    path('sync/product/<int:productid>/', views._product_detail),
+] + project_urls.urlpatterns
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+class Command(BaseCommand):
+    help = ("Serve product listing and detail requests through the ASGI handler while chat "
+            "websocket clients exchange messages, once with the sync views and once with the "
+            "async ones, and compare p50/p99 latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000,
+                            help="Synthetic products to insert first (deleted afterwards).")
+        parser.add_argument('--http-clients', type=int, default=8)
+        parser.add_argument('--chat-pairs', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        CatalogBench(stdout=self.stdout, stderr=self.stderr)._seed(options['rows'])
+        User = get_user_model()
+        users = [User.objects.create_user('bench-async-%d' % i) for i in range(2 * options['chat_pairs'])]
+        try:
+            ids = list(Product.objects.filter(publisher='bench').values_list('id', flat=True))
+            if not ids:
+                raise CommandError("No products to request.")
+            self.stdout.write("%-6s %-8s %8s %8s %8s" % ("views", "request", "count", "p50 ms", "p99 ms"))
+            with override_settings(ROOT_URLCONF=__name__):
+                for variant, prefix in (('sync', '/sync'), ('async', '')):
+                    cache.clear()
+                    timings = asyncio.run(self.run(prefix, ids, users, options))
+                    for kind in ('listing', 'detail', 'chat'):
+                        values = sorted(timings[kind])
+                        self.stdout.write("%-6s %-8s %8d %8.2f %8.2f" % (
+                            variant, kind, len(values), statistics.median(values) if values else 0.0,
+                            percentile(values, 0.99)))
+        finally:
+            # cascades to their chat messages and dialogs
+            User.objects.filter(pk__in=[u.pk for u in users]).delete()
+            Product.objects.filter(publisher='bench', title__startswith='synthetic').delete()
+
+    async def run(self, prefix, ids, users, options):
+        app = ASGIHandler()
+        timings = {'listing': [], 'detail': [], 'chat': []}
+        deadline = time.perf_counter() + options['seconds']
+        rng = random.Random(393)
+        hot = ids[:20]
+
+        async def http_client():
+            while time.perf_counter() < deadline:
+                if rng.random() < 0.5:
+                    kind, url = 'listing', prefix + '/home/'
+                    params = dict(rng.choice(FILTER_SHAPES), sort=rng.choice(list(SORT_ORDERINGS)))
+                    query = '&'.join('%s=%s' % item for item in params.items())
+                else:
+                    # Most product page views go to a few popular products.
+                    product = rng.choice(hot if rng.random() < 0.8 else ids)
+                    kind, url, query = 'detail', '%s/product/%d/' % (prefix, product), ''
+                started = time.perf_counter()
+                status = await self.get(app, url, query)
+                if status != 200:
+                    raise CommandError("GET %s?%s returned %d" % (url, query, status))
+                timings[kind].append((time.perf_counter() - started) * 1000)
+
+        async def chat_client(user, partner):
+            communicator = ApplicationCommunicator(ChatConsumer.as_asgi(), {
+                'type': 'websocket', 'path': '/chat_ws', 'headers': [], 'subprotocols': [], 'user': user,
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(5)
+            random_id = 0
+            while time.perf_counter() < deadline:
+                random_id -= 1
+                started = time.perf_counter()
+                await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({
+                    'msg_type': MessageTypes.TextMessage, 'text': 'bench', 'user_pk': str(partner.pk),
+                    'random_id': random_id})})
+                # Until the message is saved; skip the partner's messages and other events.
+                while True:
+                    event = json.loads((await communicator.receive_output(10))['text'])
+                    if event['msg_type'] == MessageTypes.MessageIdCreated and event['random_id'] == random_id:
+                        break
+                timings['chat'].append((time.perf_counter() - started) * 1000)
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+
+        pairs = list(zip(users[::2], users[1::2]))
+        await asyncio.gather(
+            *(http_client() for _ in range(options['http_clients'])),
+            *(chat_client(a, b) for a, b in pairs),
+            *(chat_client(b, a) for a, b in pairs),
+        )
+        return timings
+
+    async def get(self, app, url, query):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': url, 'raw_path': url.encode(), 'query_string': query.encode(),
+            'root_path': '', 'headers': [(b'host', b'testserver')],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        communicator = ApplicationCommunicator(app, scope)
+        await communicator.send_input({'type': 'http.request', 'body': b'', 'more_body': False})
+        start = await communicator.receive_output(30)
+        while (await communicator.receive_output(30)).get('more_body'):
+            pass
+        return start['status']
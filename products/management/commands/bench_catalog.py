@@ -0,0 +1,121 @@
+import random
+import re
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from products.catalog import SORT_ORDERINGS, listing_page
+from products.models import CATEGORY_CHOICES, LABLE_CHOICES, Product
+
+FILTER_SHAPES = (
+    {},
+    {'category': 'E'},
+    {'label': 'N'},
+    {'category': 'E', 'label': 'N'},
+)
+
+_INDEX_RE = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+_FULL_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?%s(?: |$)(?!.*USING)' % Product._meta.db_table)
+
+
+def listing_queries(params):
+    """Run one listing request and return ``(page, [sql, ...])`` for the queries it issued."""
+    with CaptureQueriesContext(connection) as captured:
+        page, _ = listing_page(params)
+    return page, [query['sql'] for query in captured]
+
+
+def query_plan(sql):
+    """
+    Summarise SQLite's EXPLAIN QUERY PLAN for ``sql`` as
+    ``{'indexes': [...], 'full_scan': bool, 'temp_sort': bool}``.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        details = [row[-1] for row in cursor.fetchall()]
+    return {
+        'indexes': [m.group(1) for d in details for m in [_INDEX_RE.search(d)] if m],
+        'full_scan': any(_FULL_SCAN_RE.search(d) for d in details),
+        'temp_sort': any('TEMP B-TREE' in d for d in details),
+        'details': details,
+    }
+
+
+def combinations():
+    for filters in FILTER_SHAPES:
+        for sort in SORT_ORDERINGS:
+            yield dict(filters, sort=sort)
+
+
+class Command(BaseCommand):
+    help = ("Show the query plan and timing of every catalog filter/sort combination, "
+            "for the first page and a page reached through a cursor.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=0,
+                            help="Insert this many synthetic products first (rolled back afterwards).")
+        parser.add_argument('--repeat', type=int, default=50,
+                            help="Timed runs per combination.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write("Query plans are only reported for SQLite.")
+            return
+        with transaction.atomic():
+            if options['rows']:
+                self._seed(options['rows'])
+            failures = self._report(options['repeat'])
+            transaction.set_rollback(True)
+        if failures:
+            self.stderr.write(self.style.ERROR("%d combination(s) scanned the table or sorted in a temp b-tree."
+                                               % failures))
+        else:
+            self.stdout.write(self.style.SUCCESS("Every combination is served by an index in sort order."))
+
+    def _seed(self, rows):
+        rng = random.Random(393)
+        categories = [code for code, _ in CATEGORY_CHOICES]
+        labels = [code for code, _ in LABLE_CHOICES]
+        batch = []
+        for i in range(rows):
+            batch.append(Product(
+                title='synthetic %d' % i, summary='', description='',
+                price=Decimal(rng.randrange(100, 500000)) / 100,
+                category=rng.choice(categories), label=rng.choice(labels),
+                Product_Main_Img='images/synthetic.png', publisher='bench',
+            ))
+            if len(batch) == 1000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write("Inserted %d synthetic products." % rows)
+
+    def _report(self, repeat):
+        failures = 0
+        self.stdout.write("%-32s %-6s %-34s %10s" % ("filters", "page", "index", "ms/page"))
+        for params in combinations():
+            first, _ = listing_queries(params)
+            pages = [('first', params)]
+            if first.next_cursor:
+                pages.append(('after', dict(params, after=first.next_cursor)))
+            for name, page_params in pages:
+                _, queries = listing_queries(page_params)
+                plan = query_plan(queries[-1])
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    listing_page(page_params)
+                elapsed = (time.perf_counter() - started) * 1000 / repeat
+                ok = plan['indexes'] and not plan['full_scan'] and not plan['temp_sort']
+                failures += not ok
+                label = ' '.join('%s=%s' % item for item in sorted(params.items()))
+                index = ', '.join(plan['indexes']) or 'TABLE SCAN'
+                if plan['temp_sort']:
+                    index += ' +TEMP SORT'
+                line = "%-32s %-6s %-34s %10.3f" % (label, name, index, elapsed)
+                self.stdout.write(line if ok else self.style.ERROR(line))
+        return failures
@@ -0,0 +1,134 @@
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from urllib.request import pathname2url
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+CONFIGS = {
+    # Django's sqlite3 backend as it comes: rollback journal, full fsync,
+    # deferred transactions, reads and writes on one connection.
+    'stock': {
+        'write': {'ENGINE': 'django.db.backends.sqlite3'},
+        'read': None,
+    },
+    # settings.DATABASES: KindaEbay.db with its pragmas and BEGIN IMMEDIATE,
+    # reads on a read-only connection.
+    'tuned': {
+        'write': {'ENGINE': 'KindaEbay.db'},
+        'read': {'ENGINE': 'KindaEbay.db', 'OPTIONS': {'pragmas': {'journal_mode': None, 'query_only': 'ON'}}},
+    },
+}
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+class Command(BaseCommand):
+    help = ("Run concurrent writer and reader threads against a scratch SQLite database, "
+            "first with the stock sqlite3 backend and then with KindaEbay.db's WAL, pragmas, "
+            "BEGIN IMMEDIATE and read-only read connection, and compare lock errors and latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--rows', type=int, default=20000, help="Rows in the table before the run.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("%-6s %8s %8s %8s %8s %8s %8s %8s" % (
+            "config", "writes/s", "reads/s", "locked", "w p50ms", "w p99ms", "r p50ms", "r p99ms"))
+        for name, config in CONFIGS.items():
+            directory = tempfile.mkdtemp()
+            try:
+                result = self.run(config, os.path.join(directory, 'bench.sqlite3'), options)
+            finally:
+                shutil.rmtree(directory)
+            writes, reads = sorted(result['writes']), sorted(result['reads'])
+            seconds = options['seconds']
+            self.stdout.write("%-6s %8.0f %8.0f %8d %8.2f %8.2f %8.2f %8.2f" % (
+                name, len(writes) / seconds, len(reads) / seconds, result['locked'],
+                statistics.median(writes) if writes else 0.0, percentile(writes, 0.99),
+                statistics.median(reads) if reads else 0.0, percentile(reads, 0.99)))
+
+    def register(self, alias, settings_dict, name):
+        connections.databases[alias] = dict(settings_dict, NAME=name)
+        connections.ensure_defaults(alias)
+
+    def run(self, config, path, options):
+        write_alias, read_alias = 'bench_write', 'bench_read'
+        self.register(write_alias, config['write'], path)
+        if config['read'] is None:
+            read_alias = write_alias
+        else:
+            self.register(read_alias, config['read'], 'file:%s?mode=ro' % pathname2url(path))
+        try:
+            self.seed(write_alias, options['rows'])
+            return self.race(write_alias, read_alias, options)
+        finally:
+            for alias in {write_alias, read_alias}:
+                connections[alias].close()
+                del connections[alias]
+                del connections.databases[alias]
+
+    def seed(self, alias, rows):
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, seller INTEGER, price INTEGER)')
+            cursor.execute('CREATE INDEX item_seller ON item (seller)')
+            cursor.executemany('INSERT INTO item (seller, price) VALUES (%s, %s)',
+                               [(i % 100, i % 1000) for i in range(rows)])
+        connections[alias].close()
+
+    def race(self, write_alias, read_alias, options):
+        result = {'writes': [], 'reads': [], 'locked': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['seconds']
+
+        def write():
+            # Read, then write in the same transaction, like update_or_create
+            # or SellerStats.refresh().
+            seller = random.randrange(100)
+            with transaction.atomic(using=write_alias), connections[write_alias].cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM item WHERE seller = %s', [seller])
+                count = cursor.fetchone()[0]
+                cursor.execute('INSERT INTO item (seller, price) VALUES (%s, %s)', [seller, count])
+
+        def read():
+            with connections[read_alias].cursor() as cursor:
+                cursor.execute('SELECT seller, COUNT(*), SUM(price) FROM item GROUP BY seller')
+                cursor.fetchall()
+
+        def worker(operation, alias, timings):
+            local, locked = [], 0
+            try:
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        operation()
+                    except OperationalError as e:
+                        if 'locked' not in str(e):
+                            raise
+                        locked += 1
+                        continue
+                    local.append((time.perf_counter() - started) * 1000)
+            finally:
+                connections[alias].close()
+            with lock:
+                timings.extend(local)
+                result['locked'] += locked
+
+        threads = ([threading.Thread(target=worker, args=(write, write_alias, result['writes']))
+                    for _ in range(options['writers'])] +
+                   [threading.Thread(target=worker, args=(read, read_alias, result['reads']))
+                    for _ in range(options['readers'])])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return result
@@ -0,0 +1,61 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+
+from KindaEbay import perf
+from products.models import Product
+from .bench_catalog import Command as CatalogBench
+
+
+class Command(BaseCommand):
+    help = ("Measure what KindaEbay.perf costs: the same listing and detail requests with the "
+            "instrumentation off and on.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500,
+                            help="Synthetic products to insert first (deleted afterwards).")
+        parser.add_argument('--repeat', type=int, default=300)
+
+    def handle(self, *args, **options):
+        CatalogBench(stdout=self.stdout, stderr=self.stderr)._seed(options['rows'])
+        try:
+            product = Product.objects.filter(publisher='bench').first()
+            urls = [('listing', '/home/?sort=price'), ('detail', product.get_absolute_url())]
+            # Each client loads the middleware once, on its first request, so
+            # one has it and one doesn't; alternating them cancels out drift.
+            clients = {}
+            for enabled in (False, True):
+                with override_settings(PERF={'ENABLED': enabled, 'SERVER_TIMING': enabled},
+                                       METRICS=dict(settings.METRICS, DIR=settings.METRICS['DIR'] if enabled else None)):
+                    clients[enabled] = Client()
+                    clients[enabled].get(urls[0][1])
+            perf.get_registry().reset()
+            self.stdout.write("%-9s %-8s %8s %8s" % ("perf", "request", "p50 ms", "p99 ms"))
+            for name, url in urls:
+                timings = self.measure(clients, url, options['repeat'])
+                for enabled in (False, True):
+                    values = timings[enabled]
+                    self.stdout.write("%-9s %-8s %8.3f %8.3f" % (
+                        'on' if enabled else 'off', name, statistics.median(values),
+                        values[min(len(values) - 1, int(len(values) * 0.99))]))
+            for route, row in sorted(perf.get_registry().snapshot().items()):
+                self.stdout.write("%s: %d requests, %.1f queries, %.2f ms SQL, %.2f ms templates" % (
+                    route, row['count'], row['mean_queries'], row['mean_sql_ms'], row['mean_render_ms']))
+        finally:
+            Product.objects.filter(publisher='bench', title__startswith='synthetic').delete()
+
+    def measure(self, clients, url, repeat):
+        timings = {enabled: [] for enabled in clients}
+        for _ in range(repeat):
+            for enabled, client in clients.items():
+                # uncached, so the views do their full work every time
+                cache.clear()
+                started = time.perf_counter()
+                client.get(url)
+                timings[enabled].append((time.perf_counter() - started) * 1000)
+        return {enabled: sorted(values) for enabled, values in timings.items()}
@@ -0,0 +1,76 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+
+from products.models import Product
+
+
+class QueryCounter:
+    # CaptureQueriesContext can't be used around test Client requests:
+    # request_started resets connection.queries_log.
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = ("Measure DB queries and response time of repeated product detail page hits: "
+            "uncached, anonymous page-cache hits, conditional 304s and logged-in renders.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, help="Product id (default: the newest product).")
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        product = (Product.objects.filter(pk=options['product']).first() if options['product']
+                   else Product.objects.order_by('-publish_time').first())
+        if product is None:
+            raise CommandError("No product to request.")
+        url = product.get_absolute_url()
+        repeat = options['repeat']
+        anonymous = Client()
+
+        def uncached():
+            cache.clear()
+            return anonymous.get(url)
+
+        first = anonymous.get(url)
+        etag = first['ETag']
+        rows = [
+            ("anonymous, cold cache", uncached),
+            ("anonymous, page cache hit", lambda: anonymous.get(url)),
+            ("anonymous, If-None-Match", lambda: anonymous.get(url, HTTP_IF_NONE_MATCH=etag)),
+        ]
+
+        with transaction.atomic():
+            user = get_user_model().objects.create_user('bench-detail-user', password='x')
+            logged_in = Client()
+            logged_in.force_login(user)
+            user_etag = logged_in.get(url)['ETag']
+            rows += [
+                ("logged in, full render", lambda: logged_in.get(url)),
+                ("logged in, If-None-Match", lambda: logged_in.get(url, HTTP_IF_NONE_MATCH=user_etag)),
+            ]
+            self.stdout.write("%-28s %6s %8s %8s %8s" % ("request", "status", "queries", "p50 ms", "p99 ms"))
+            for name, request in rows:
+                counter = QueryCounter()
+                with connection.execute_wrapper(counter):
+                    response = request()
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    request()
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                self.stdout.write("%-28s %6d %8d %8.3f %8.3f" % (
+                    name, response.status_code, counter.count, statistics.median(timings),
+                    timings[min(len(timings) - 1, int(len(timings) * 0.99))]))
+            transaction.set_rollback(True)
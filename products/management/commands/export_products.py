@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products import export
+
+
+class Command(BaseCommand):
+    help = ("Stream the product catalog to a CSV or JSON Lines file (or stdout) "
+            "in constant memory. Use --since for incremental exports.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=export.FORMATS, default='csv')
+        parser.add_argument('--output', '-o', help="Output file (default: stdout).")
+        parser.add_argument('--since', help="Only products published after this ISO date/datetime.")
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = export.parse_since(options['since'])
+            except ValueError as e:
+                raise CommandError(e)
+
+        count = 0
+        newest = None
+
+        def counted(rows):
+            nonlocal count, newest
+            for row in rows:
+                count += 1
+                newest = row['publish_time']
+                yield row
+
+        rows = counted(export.export_rows(since, options['chunk_size']))
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                f.writelines(export.export_lines(options['format'], rows))
+        else:
+            for line in export.export_lines(options['format'], rows):
+                self.stdout.write(line, ending='')
+        # The newest timestamp is the --since for the next incremental run.
+        self.stderr.write("Exported %d products%s." % (
+            count, "; newest publish_time %s" % newest.isoformat() if newest else ""))
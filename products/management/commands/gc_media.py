@@ -0,0 +1,88 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import images
+from products.models import Product
+from products.storage import INCOMING_DIR, is_blob_name
+
+UPLOAD_DIR = 'images'
+
+
+class Command(BaseCommand):
+    help = ("Delete content-addressed product image blobs (and their derivatives) "
+            "that no product references any more.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report what would be deleted.")
+        parser.add_argument('--grace', type=int, default=3600,
+                            help="Keep files younger than this many seconds; an upload may "
+                                 "not have committed its row yet (default: 3600).")
+        parser.add_argument('--adopt-legacy', action='store_true',
+                            help="First move images stored under their upload name into "
+                                 "content-addressed blobs and repoint the products.")
+        parser.add_argument('--include-legacy', action='store_true',
+                            help="Also delete unreferenced files that are not blobs.")
+
+    def handle(self, *args, **options):
+        self.storage = Product._meta.get_field('Product_Main_Img').storage
+        self.dry_run = options['dry_run']
+        if options['adopt_legacy']:
+            self.adopt_legacy()
+
+        referenced = set(Product.objects.order_by()
+                         .values_list('Product_Main_Img', flat=True).distinct())
+        cutoff = time.time() - options['grace']
+        deleted = reclaimed = 0
+        root = self.storage.path(UPLOAD_DIR)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d != INCOMING_DIR]
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.storage.location).replace(os.sep, '/')
+                if name in referenced or os.path.getmtime(path) > cutoff:
+                    continue
+                if not is_blob_name(name) and not options['include_legacy']:
+                    continue
+                # The walk can take a while: a product saved since the
+                # snapshot above may use the file now.
+                if Product.objects.filter(Product_Main_Img=name).exists() or os.path.getmtime(path) > cutoff:
+                    continue
+                deleted += 1
+                reclaimed += os.path.getsize(path)
+                self.stdout.write(("Would delete " if self.dry_run else "Deleting ") + name)
+                if not self.dry_run:
+                    self.storage.delete(name)
+                    images.delete_derivatives(name)
+
+        incoming = self.storage.path(INCOMING_DIR)
+        if os.path.isdir(incoming) and not self.dry_run:
+            for filename in os.listdir(incoming):
+                path = os.path.join(incoming, filename)
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+
+        self.stdout.write(self.style.SUCCESS(
+            "%s %d files, %.1f MB." % ("Would reclaim" if self.dry_run else "Reclaimed",
+                                       deleted, reclaimed / 1e6)))
+
+    def adopt_legacy(self):
+        adopted = 0
+        for product in Product.objects.order_by('id'):
+            name = product.Product_Main_Img.name
+            if not name or is_blob_name(name) or not self.storage.exists(name):
+                continue
+            if self.dry_run:
+                self.stdout.write("Would adopt %s" % name)
+                continue
+            with self.storage.open(name, 'rb') as legacy:
+                blob = self.storage.save(name, legacy)
+            if not images.has_derivatives(blob):
+                images.generate_derivatives(blob)
+            product.Product_Main_Img.name = blob
+            product.save(update_fields=['Product_Main_Img'])
+            adopted += 1
+            self.stdout.write("%s -> %s" % (name, blob))
+        self.stdout.write("Adopted %d legacy images." % adopted)
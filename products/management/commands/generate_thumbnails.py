@@ -0,0 +1,63 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from products import fragments, images
+from products.models import Product
+
+
+def _init_worker():
+    # Needed when the pool uses "spawn" (macOS/Windows); harmless under fork.
+    django.setup()
+
+
+def _generate(name, force):
+    try:
+        return name, images.generate_derivatives(name, force=force), None
+    except Exception as e:
+        return name, [], '%s: %s' % (type(e).__name__, e)
+
+
+class Command(BaseCommand):
+    help = "Generate card/detail JPEG and WebP derivatives for existing product images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Size of the process pool (default: number of CPUs).")
+        parser.add_argument('--force', action='store_true',
+                            help="Regenerate derivatives that already exist.")
+
+    def handle(self, *args, **options):
+        names = [name for name in Product.objects.order_by()
+                 .values_list('Product_Main_Img', flat=True).distinct() if name]
+        if not options['force']:
+            names = [name for name in names if not images.has_derivatives(name)]
+        if not names:
+            self.stdout.write("All product images already have derivatives.")
+            return
+        # Forked workers must not share the parent's SQLite connection.
+        connections.close_all()
+
+        started = time.perf_counter()
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            futures = [pool.submit(_generate, name, options['force']) for name in names]
+            for future in as_completed(futures):
+                name, written, error = future.result()
+                if error:
+                    failed += 1
+                    self.stderr.write("%s: %s" % (name, error))
+                else:
+                    done += 1
+                    if options['verbosity'] > 1:
+                        self.stdout.write("%s -> %d files" % (name, len(written)))
+        if done:
+            fragments.invalidate_all_cards()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            "Processed %d images (%d failed) in %.1fs with %d workers."
+            % (done, failed, elapsed, options['workers'])))
@@ -0,0 +1,188 @@
+import collections
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Max
+
+from products import images, search
+from products.models import CategoryCount, ImportCheckpoint, Product, SellerStats
+
+FIELDS = ('title', 'description', 'price', 'summary', 'category', 'label', 'publisher')
+UPLOAD_TO = Product._meta.get_field('Product_Main_Img').upload_to
+
+
+def _init_worker():
+    django.setup()
+
+
+def store_image(path):
+    """
+    Copy a local image into product storage and render its derivatives.
+    Runs in a worker process and only touches the filesystem.  Returns
+    ``(stored_name, None)`` or ``(None, error)``.
+    """
+    try:
+        storage = images.source_storage()
+        with open(path, 'rb') as f:
+            name = storage.save(UPLOAD_TO + os.path.basename(path), File(f))
+        images.generate_derivatives(name)
+        return name, None
+    except Exception as e:
+        return None, '%s: %s' % (type(e).__name__, e)
+
+
+class BadRecord(str):
+    """A record that couldn't be parsed, standing in for it with the reason."""
+
+
+def read_records(path, fmt):
+    """
+    Yield one dict per input record without loading the file into memory,
+    or a BadRecord for a JSON line that isn't an object.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except ValueError as e:
+                        yield BadRecord("invalid JSON: %s" % e)
+                        continue
+                    yield record if isinstance(record, dict) else BadRecord("not a JSON object")
+
+
+def text(value):
+    """A JSON number, bool or string as stripped text; None as ''."""
+    return '' if value is None else str(value).strip()
+
+
+class Command(BaseCommand):
+    help = ("Stream products from a CSV or JSON Lines file into the database in batches. "
+            "Columns: title, description, price, summary, category, label, publisher and "
+            "image (a local path, relative to --image-root).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help="Input format (default: from the file extension).")
+        parser.add_argument('--image-root', help="Directory image paths are relative to "
+                                                 "(default: the input file's directory).")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Image processing processes; 0 processes images inline.")
+        parser.add_argument('--publisher', default='', help="Publisher for rows that have none.")
+        parser.add_argument('--resume', action='store_true',
+                            help="Skip the records committed by a previous, interrupted run.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError("%s does not exist." % path)
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        self.image_root = options['image_root'] or os.path.dirname(os.path.abspath(path))
+        self.default_publisher = options['publisher']
+        self.checkpoint = os.path.abspath(path)
+
+        skip = ImportCheckpoint.read(self.checkpoint) if options['resume'] else 0
+        if skip:
+            self.stdout.write("Resuming after record %d." % skip)
+        records = islice(read_records(path, fmt), skip, None)
+
+        pool = None
+        if options['workers'] > 0:
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker)
+        started = time.perf_counter()
+        done = skip
+        imported = rejected = 0
+        try:
+            while True:
+                batch = list(islice(records, options['batch_size']))
+                if not batch:
+                    break
+                batch_started = time.perf_counter()
+                created, errors = self.import_batch(batch, done, pool)
+                done += len(batch)
+                imported += created
+                rejected += len(errors)
+                for number, error in errors:
+                    self.stderr.write("record %d: %s" % (number, error))
+                elapsed = time.perf_counter() - batch_started
+                self.stdout.write("%d records done, batch of %d in %.2fs (%.0f records/s)"
+                                  % (done, len(batch), elapsed, len(batch) / elapsed))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        total = time.perf_counter() - started
+        ImportCheckpoint.objects.filter(path=self.checkpoint).delete()
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %d products, rejected %d, in %.1fs (%.0f products/s)."
+            % (imported, rejected, total, imported / total if total else 0)))
+
+    def import_batch(self, batch, offset, pool):
+        errors = []
+        products = []
+        image_paths = []
+        for number, record in enumerate(batch, offset + 1):
+            if isinstance(record, BadRecord):
+                errors.append((number, record))
+                continue
+            product = Product(**{field: text(record.get(field)) for field in FIELDS})
+            product.description = product.description or None
+            product.publisher = product.publisher or self.default_publisher or None
+            try:
+                # publisher is nullable but not blank=True, like the create form leaves it
+                product.full_clean(exclude=['Product_Main_Img', 'publisher'])
+            except ValidationError as e:
+                errors.append((number, '; '.join('%s: %s' % (k, ' '.join(v))
+                                                 for k, v in e.message_dict.items())))
+                continue
+            image = text(record.get('image'))
+            if not image:
+                errors.append((number, "image: this field is required."))
+                continue
+            products.append((number, product))
+            image_paths.append(os.path.join(self.image_root, image))
+
+        if pool is not None:
+            stored = list(pool.map(store_image, image_paths, chunksize=8))
+        else:
+            stored = [store_image(p) for p in image_paths]
+        ready = []
+        for (number, product), (name, error) in zip(products, stored):
+            if error:
+                errors.append((number, "image: %s" % error))
+            else:
+                product.Product_Main_Img.name = name
+                ready.append(product)
+
+        sellers = dict(get_user_model().objects.filter(username__in={p.publisher for p in ready})
+                       .values_list('username', 'pk'))
+        for product in ready:
+            product.seller_id = sellers.get(product.publisher)
+        with transaction.atomic():
+            # bulk_create skips post_save, so index the new rows and update
+            # the seller and category counts here.  ids only grow;
+            # re-indexing a concurrent writer's rows is harmless.
+            last_id = Product.objects.aggregate(last=Max('id'))['last'] or 0
+            Product.objects.bulk_create(ready)
+            search.index_products(Product.objects.filter(id__gt=last_id))
+            SellerStats.refresh(set(sellers.values()))
+            CategoryCount.adjust(collections.Counter((p.category, p.label) for p in ready))
+            # committed together with the batch
+            ImportCheckpoint.write(self.checkpoint, offset + len(batch))
+        errors.sort()
+        return len(ready), errors
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the FTS5 product search index from the products table."
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError("Full-text search needs the SQLite database backend.")
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS("Indexed %d products." % count))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from products.models import CATEGORY_CHOICES, LABLE_CHOICES, CategoryCount
+
+
+class Command(BaseCommand):
+    help = ("Recount products per category and label and correct the navbar facet counters "
+            "that drifted (e.g. after QuerySet.update() or raw SQL).  Meant to run periodically, "
+            "e.g. hourly from cron.")
+
+    def handle(self, *args, **options):
+        categories, labels = dict(CATEGORY_CHOICES), dict(LABLE_CHOICES)
+        drift = CategoryCount.recount()
+        for (category, label), (stored, actual) in sorted(drift.items()):
+            self.stdout.write("%s / %s: %d -> %d" % (
+                categories.get(category, category), labels.get(label, label), stored, actual))
+        self.stdout.write(self.style.SUCCESS("Corrected %d counter(s)." % len(drift)))
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=120)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10000)),
+                ('summary', models.TextField(blank=True)),
+                ('category', models.CharField(choices=[('HA', 'House/Apartment'), ('C', 'Car'), ('F', 'Furniture'), ('E', 'Electronics'), ('M', 'Miscellaneous')], max_length=2)),
+                ('label', models.CharField(choices=[('N', 'New'), ('S', 'Sold')], max_length=1)),
+                ('Product_Main_Img', models.ImageField(upload_to='images/')),
+                ('publisher', models.CharField(max_length=100, null=True)),
+                ('publish_time', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
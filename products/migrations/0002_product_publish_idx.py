@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['publish_time', 'id'], name='product_publish_idx'),
+        ),
+    ]
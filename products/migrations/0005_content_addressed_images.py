@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:51
+
+from django.db import migrations, models
+import products.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='Product_Main_Img',
+            field=models.ImageField(storage=products.storage.ContentAddressedStorage(), upload_to='images/'),
+        ),
+    ]
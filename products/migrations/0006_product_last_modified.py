@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:53
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_last_modified(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Product.objects.update(last_modified=F('publish_time'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='last_modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_last_modified, migrations.RunPython.noop),
+    ]
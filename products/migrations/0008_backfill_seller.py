@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count
+
+
+def backfill_seller(apps, schema_editor):
+    """
+    Link products to the user whose username is in ``publisher``; failing
+    an exact match, to the only user whose username matches ignoring case.
+    """
+    Product = apps.get_model('products', 'Product')
+    SellerStats = apps.get_model('products', 'SellerStats')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    publishers = set(Product.objects.exclude(publisher=None).exclude(publisher='')
+                     .values_list('publisher', flat=True).distinct())
+    by_lower = {}
+    for username, pk in User.objects.values_list('username', 'pk').iterator():
+        by_lower.setdefault(username.lower(), {})[username] = pk
+    for publisher in publishers:
+        candidates = by_lower.get(publisher.lower(), {})
+        pk = candidates.get(publisher)
+        if pk is None and len(candidates) == 1:
+            pk = next(iter(candidates.values()))
+        if pk is not None:
+            Product.objects.filter(publisher=publisher, seller=None).update(seller_id=pk)
+
+    counts = {}
+    rows = (Product.objects.exclude(seller=None).order_by()
+            .values_list('seller_id', 'label').annotate(n=Count('id')))
+    for seller_id, label, n in rows:
+        counts.setdefault(seller_id, {'N': 0, 'S': 0})[label] = n
+    SellerStats.objects.bulk_create([
+        SellerStats(seller_id=seller_id, active_count=by_label['N'], sold_count=by_label['S'])
+        for seller_id, by_label in counts.items()
+    ])
+
+
+def clear_stats(apps, schema_editor):
+    apps.get_model('products', 'SellerStats').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_seller'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_seller, clear_stats),
+    ]
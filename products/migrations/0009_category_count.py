@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_backfill_seller'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('HA', 'House/Apartment'), ('C', 'Car'), ('F', 'Furniture'), ('E', 'Electronics'), ('M', 'Miscellaneous')], max_length=2)),
+                ('label', models.CharField(choices=[('N', 'New'), ('S', 'Sold')], max_length=1)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='categorycount',
+            constraint=models.UniqueConstraint(fields=('category', 'label'), name='category_count_unique'),
+        ),
+    ]
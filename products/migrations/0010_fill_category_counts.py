@@ -0,0 +1,26 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def fill_counts(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    CategoryCount = apps.get_model('products', 'CategoryCount')
+    rows = (Product.objects.order_by().values_list('category', 'label').annotate(n=Count('id')))
+    CategoryCount.objects.bulk_create([
+        CategoryCount(category=category, label=label, count=n) for category, label, n in rows
+    ])
+
+
+def clear_counts(apps, schema_editor):
+    apps.get_model('products', 'CategoryCount').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_category_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_counts, clear_counts),
+    ]
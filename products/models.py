@@ -1,4 +1,9 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, F
+
+from . import images
+from .storage import content_addressed_storage
 
 CATEGORY_CHOICES = (
     ('HA', 'House/Apartment'),
@@ -21,10 +26,148 @@ class Product(models.Model):
     summary             = models.TextField(blank = True, null = False)
     category            = models.CharField(choices = CATEGORY_CHOICES, max_length = 2)
     label               = models.CharField(choices = LABLE_CHOICES, max_length = 1)
-    Product_Main_Img    = models.ImageField(upload_to='images/')
+    Product_Main_Img    = models.ImageField(upload_to='images/', storage=content_addressed_storage)
     publisher           = models.CharField(null = True, max_length = 100)
+    # indexed by the seller_* composite indexes below
+    seller              = models.ForeignKey(settings.AUTH_USER_MODEL, null = True, blank = True,
+                                            on_delete = models.SET_NULL, related_name = 'products',
+                                            db_index = False)
     publish_time        = models.DateTimeField(auto_now_add=True)
+    last_modified       = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # One index per listing access pattern (see products.catalog): an
+        # optional category/label equality prefix followed by the sort key,
+        # so filtered pages are an index range scan in sort order.
+        indexes = [
+            models.Index(fields=['publish_time', 'id'], name='product_publish_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['category', 'publish_time', 'id'], name='product_cat_publish_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_cat_price_idx'),
+            models.Index(fields=['label', 'publish_time', 'id'], name='product_label_publish_idx'),
+            models.Index(fields=['label', 'price', 'id'], name='product_label_price_idx'),
+            models.Index(fields=['category', 'label', 'publish_time', 'id'], name='product_cat_label_publish_idx'),
+            models.Index(fields=['category', 'label', 'price', 'id'], name='product_cat_label_price_idx'),
+            models.Index(fields=['seller', 'publish_time', 'id'], name='product_seller_publish_idx'),
+            models.Index(fields=['seller', 'label', 'publish_time', 'id'], name='product_seller_label_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def get_absolute_url(self):
+        return '/product/%d/' % self.pk
+
+    @property
+    def card_image(self):
+        return images.variant(self.Product_Main_Img, 'card')
+
+    @property
+    def detail_image(self):
+        return images.variant(self.Product_Main_Img, 'detail')
+
+
+
+class SellerStats(models.Model):
+    """
+    Per-seller listing counts, kept up to date by products.signals so the
+    seller pages don't count a seller's whole catalog on every view.
+    """
+    seller              = models.OneToOneField(settings.AUTH_USER_MODEL, primary_key = True,
+                                               on_delete = models.CASCADE, related_name = 'seller_stats')
+    active_count        = models.PositiveIntegerField(default = 0)
+    sold_count          = models.PositiveIntegerField(default = 0)
+
+    @classmethod
+    def refresh(cls, seller_ids):
+        """Recount the listings of ``seller_ids`` (one grouped query on the seller index)."""
+        seller_ids = {pk for pk in seller_ids if pk is not None}
+        if not seller_ids:
+            return
+        counts = {pk: {'N': 0, 'S': 0} for pk in seller_ids}
+        rows = (Product.objects.filter(seller_id__in=seller_ids).order_by()
+                .values_list('seller_id', 'label').annotate(n=Count('id')))
+        for seller_id, label, n in rows:
+            counts[seller_id][label] = n
+        for seller_id, by_label in counts.items():
+            cls.objects.update_or_create(seller_id=seller_id, defaults={
+                'active_count': by_label['N'], 'sold_count': by_label['S']})
+
+    @classmethod
+    def for_seller(cls, seller):
+        return cls.objects.filter(seller=seller).first() or cls(seller=seller)
+
+
+
+class CategoryCount(models.Model):
+    """
+    Number of products per category and label, adjusted by products.signals
+    (and import_products) as products come and go, so the navbar facet
+    counts are a read of a few rows instead of a GROUP BY over the catalog.
+    Writes that skip the signals (QuerySet.update(), raw SQL, loaddata) are
+    caught up by ``manage.py reconcile_counts``.
+    """
+    category            = models.CharField(choices = CATEGORY_CHOICES, max_length = 2)
+    label               = models.CharField(choices = LABLE_CHOICES, max_length = 1)
+    # not Positive: a decrement on a drifted counter mustn't fail the delete
+    count               = models.IntegerField(default = 0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'label'], name='category_count_unique'),
+        ]
+
+    @classmethod
+    def adjust(cls, deltas):
+        """Add ``deltas`` ({(category, label): n}) to the counters, in place."""
+        for (category, label), delta in deltas.items():
+            if not delta:
+                continue
+            counter = cls.objects.filter(category=category, label=label)
+            if not counter.update(count=F('count') + delta):
+                cls.objects.get_or_create(category=category, label=label)
+                counter.update(count=F('count') + delta)
+
+    @classmethod
+    def facets(cls):
+        """{(category, label): count} for every combination."""
+        counts = {(category, label): 0 for category, _ in CATEGORY_CHOICES for label, _ in LABLE_CHOICES}
+        counts.update(((category, label), count) for category, label, count in
+                      cls.objects.values_list('category', 'label', 'count'))
+        return counts
+
+    @classmethod
+    def recount(cls):
+        """
+        Recount from the products table and fix the counters that drifted.
+        Returns {(category, label): (stored, actual)} for those.
+        """
+        # In one transaction, so no signal adjusts a counter between the
+        # count and the write.
+        with transaction.atomic():
+            stored = cls.facets()
+            actual = dict.fromkeys(stored, 0)
+            actual.update(((category, label), n) for category, label, n in
+                          Product.objects.order_by().values_list('category', 'label').annotate(n=Count('id')))
+            drift = {key: (stored.get(key, 0), n) for key, n in actual.items() if stored.get(key, 0) != n}
+            for (category, label), (_, n) in drift.items():
+                cls.objects.update_or_create(category=category, label=label, defaults={'count': n})
+        return drift
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Records of an input file that import_products has committed.  Saved in
+    the same transaction as each batch, so a resumed import never re-imports
+    (or skips) a batch whatever point the previous run died at.
+    """
+    path                = models.CharField(max_length = 1024, unique = True)
+    records             = models.PositiveIntegerField(default = 0)
+
+    @classmethod
+    def read(cls, path):
+        return cls.objects.filter(path=path).values_list('records', flat=True).first() or 0
+
+    @classmethod
+    def write(cls, path, records):
+        cls.objects.update_or_create(path=path, defaults={'records': records})
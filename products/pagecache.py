@@ -0,0 +1,84 @@
+"""
+Whole-page cache for anonymous visitors of product pages.
+
+Logged-in users see their name in the navbar, so only anonymous GETs are
+cached.  The cached response keeps its ETag/Last-Modified headers and a hit
+is answered with a 304 when the client's validators still match, without
+touching the database.  Entries are short-lived and dropped once a save or
+delete of the product commits (products.signals): dropped any earlier, a
+request that read the row before the commit could cache the old page again.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import parse_http_date_safe
+
+CACHE_ALIAS = 'default'
+PAGE_TIMEOUT = 60
+
+
+def page_key(product_id):
+    return 'product-page:%s' % product_id
+
+
+def invalidate_page(product_id):
+    """Drop the cached page once the current transaction commits."""
+    transaction.on_commit(lambda: caches[CACHE_ALIAS].delete(page_key(product_id)))
+
+
+def _cacheable(response):
+    # A response that sets cookies (session, consumed messages, CSRF) is
+    # specific to the visitor that triggered it.
+    return response.status_code == 200 and not response.streaming and not response.cookies
+
+
+def has_no_session(request):
+    """
+    True if the request is certainly anonymous.  Unlike request.user, this
+    never loads a session, so async views can check it on the event loop.
+    """
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+def lookup_is_nonblocking():
+    """
+    True if the cache can be read on the event loop: LocMemCache is a dict
+    in this process, while the db cache can't be used from async code at
+    all and the file cache would block the loop on disk I/O.
+    """
+    return isinstance(caches[CACHE_ALIAS], LocMemCache)
+
+
+def cached_response(request, product_id):
+    """The cached page of ``product_id`` for this (anonymous) request, or None."""
+    response = caches[CACHE_ALIAS].get(page_key(product_id))
+    if response is None:
+        return None
+    return get_conditional_response(
+        request,
+        etag=response.get('ETag'),
+        last_modified=parse_http_date_safe(response.get('Last-Modified', '')),
+        response=response,
+    )
+
+
+def anonymous_page_cache(timeout=PAGE_TIMEOUT, url_kwarg='productid'):
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            response = cached_response(request, kwargs[url_kwarg])
+            if response is not None:
+                return response
+            response = view(request, *args, **kwargs)
+            patch_vary_headers(response, ('Cookie',))
+            if _cacheable(response):
+                caches[CACHE_ALIAS].set(page_key(kwargs[url_kwarg]), response, timeout)
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,151 @@
+"""
+Keyset ("cursor") pagination for product listings.
+
+Instead of OFFSET, every page remembers the sort key of its last (or first)
+row and the next query starts strictly after it, so page 50 costs the same as
+page 1 as long as an index covers the ordering.  The stock Paginator's
+COUNT(*) is avoided by fetching one extra row to find out whether another
+page exists.
+"""
+import base64
+import binascii
+import json
+from urllib.parse import urlencode
+
+from django.db.models import Q
+
+PAGE_SIZE = 24
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _value(row, name):
+    # Works for model instances as well as .values() dictionaries.
+    if isinstance(row, dict):
+        return row[name]
+    return getattr(row, name)
+
+
+def encode_cursor(row, ordering):
+    values = [str(_value(row, name.lstrip('-'))) for name in ordering]
+    data = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor(cursor)
+    try:
+        return [model._meta.get_field(name.lstrip('-')).to_python(value)
+                for name, value in zip(ordering, values)]
+    except Exception:
+        raise InvalidCursor(cursor)
+
+
+def _seek(ordering, values, reverse=False):
+    """
+    Build the "rows strictly after this key" filter for a (possibly mixed
+    direction) ordering, i.e. (a > x) OR (a = x AND b > y) OR ...
+
+    The redundant leading ``a >= x`` term gives the database a range bound
+    on the first index column; without it SQLite won't use the index for
+    the OR.
+    """
+    condition = Q()
+    equal = {}
+    bound = None
+    for name, value in zip(ordering, values):
+        field = name.lstrip('-')
+        descending = name.startswith('-') != reverse
+        if bound is None:
+            bound = Q(**{'%s__%s' % (field, 'lte' if descending else 'gte'): value})
+        lookup = '%s__%s' % (field, 'lt' if descending else 'gt')
+        condition |= Q(**equal, **{lookup: value})
+        equal[field] = value
+    return bound & condition
+
+
+def _reversed(ordering):
+    return [name[1:] if name.startswith('-') else '-' + name for name in ordering]
+
+
+class KeysetPage:
+    def __init__(self, object_list, ordering, has_next, has_previous, params=None):
+        self.object_list = object_list
+        self.ordering = ordering
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return encode_cursor(self.object_list[-1], self.ordering)
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return encode_cursor(self.object_list[0], self.ordering)
+        return None
+
+    def _query(self, key, cursor):
+        params = self.params.copy() if self.params is not None else {}
+        for name in ('after', 'before'):
+            params.pop(name, None)
+        params[key] = cursor
+        if hasattr(params, 'urlencode'):
+            return params.urlencode()
+        return urlencode(params)
+
+    @property
+    def next_query(self):
+        return self._query('after', self.next_cursor)
+
+    @property
+    def previous_query(self):
+        return self._query('before', self.previous_cursor)
+
+
+def paginate(queryset, ordering=('-publish_time', '-id'), after=None, before=None,
+             page_size=PAGE_SIZE, params=None):
+    """
+    Return one KeysetPage of ``queryset`` sorted by ``ordering``.
+
+    ``after``/``before`` are opaque cursors taken from a previous page's
+    ``next_cursor``/``previous_cursor``.  The last element of ``ordering``
+    must be unique (normally ``id``) so that ties are broken deterministically.
+    Raises InvalidCursor for tampered or stale cursors.
+    """
+    ordering = list(ordering)
+    model = queryset.model
+    if before:
+        values = decode_cursor(before, model, ordering)
+        rows = list(queryset.filter(_seek(ordering, values, reverse=True))
+                    .order_by(*_reversed(ordering))[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+        return KeysetPage(rows, ordering, True, has_previous, params)
+
+    if after:
+        queryset = queryset.filter(_seek(ordering, decode_cursor(after, model, ordering)))
+    rows = list(queryset.order_by(*ordering)[:page_size + 1])
+    has_next = len(rows) > page_size
+    return KeysetPage(rows[:page_size], ordering, has_next, bool(after), params)
@@ -0,0 +1,154 @@
+"""
+Full-text product search on top of an SQLite FTS5 shadow table.
+
+``products_product_fts`` holds one row per Product (rowid = product id) with
+the searchable text columns.  It is kept in sync from the post_save /
+post_delete signals in products.signals and can be rebuilt from scratch with
+``manage.py rebuild_search_index``.
+"""
+import re
+from urllib.parse import urlencode
+
+from django.db import connection
+
+from .models import Product
+
+FTS_TABLE = 'products_product_fts'
+FTS_COLUMNS = ('title', 'summary', 'description')
+# bm25() column weights, in FTS_COLUMNS order
+FTS_WEIGHTS = (10.0, 4.0, 1.0)
+MAX_TERMS = 8
+RESULTS_PER_PAGE = 24
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def build_match_query(text):
+    """
+    Turn free text into an FTS5 MATCH expression: every word becomes a
+    quoted prefix term and all terms must match, so "mac boo" finds
+    "MacBook Pro".  Returns '' when there is nothing to search for.
+    """
+    terms = _TOKEN_RE.findall(text or '')[:MAX_TERMS]
+    return ' '.join('"%s"*' % term for term in terms)
+
+
+def _row(product):
+    return [product.pk] + [getattr(product, column) or '' for column in FTS_COLUMNS]
+
+
+def index_product(product):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [product.pk])
+        cursor.execute(
+            'INSERT INTO %s (rowid, %s) VALUES (%%s, %%s, %%s, %%s)' % (FTS_TABLE, ', '.join(FTS_COLUMNS)),
+            _row(product),
+        )
+
+
+def index_products(products):
+    products = list(products)
+    if not is_available() or not products:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [[p.pk] for p in products])
+        cursor.executemany(
+            'INSERT INTO %s (rowid, %s) VALUES (%%s, %%s, %%s, %%s)' % (FTS_TABLE, ', '.join(FTS_COLUMNS)),
+            [_row(p) for p in products],
+        )
+
+
+def remove_product(product_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [product_id])
+
+
+def rebuild():
+    """Repopulate the whole index from the products table; returns the row count."""
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % FTS_TABLE)
+        cursor.execute(
+            'INSERT INTO %(fts)s (rowid, title, summary, description) '
+            "SELECT id, title, summary, COALESCE(description, '') FROM %(table)s"
+            % {'fts': FTS_TABLE, 'table': Product._meta.db_table}
+        )
+        cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (FTS_TABLE, FTS_TABLE))
+        cursor.execute('SELECT COUNT(*) FROM %s' % FTS_TABLE)
+        return cursor.fetchone()[0]
+
+
+def search_ids(text, limit=RESULTS_PER_PAGE, offset=0):
+    """Return product ids matching ``text``, best match first."""
+    match = build_match_query(text)
+    if not match:
+        return []
+    if not is_available():
+        return list(Product.objects.filter(title__icontains=text)
+                    .order_by('-publish_time', '-id')
+                    .values_list('id', flat=True)[offset:offset + limit])
+    weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT rowid FROM %(fts)s WHERE %(fts)s MATCH %%s '
+            'ORDER BY bm25(%(fts)s, %(weights)s) LIMIT %%s OFFSET %%s'
+            % {'fts': FTS_TABLE, 'weights': weights},
+            [match, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search(text, limit=RESULTS_PER_PAGE, offset=0):
+    """Return matching Product instances, best match first."""
+    ids = search_ids(text, limit, offset)
+    products = Product.objects.in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
+
+
+class SearchPage:
+    """Page of ranked results with the same interface as pagination.KeysetPage."""
+
+    def __init__(self, object_list, number, has_next, params):
+        self.object_list = object_list
+        self.number = number
+        self.has_next = has_next
+        self.has_previous = number > 1
+        self.params = params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _query(self, number):
+        params = self.params.copy()
+        params['page'] = str(number)
+        return params.urlencode() if hasattr(params, 'urlencode') else urlencode(params)
+
+    @property
+    def next_query(self):
+        return self._query(self.number + 1)
+
+    @property
+    def previous_query(self):
+        return self._query(self.number - 1)
+
+
+def search_page(text, number=1, per_page=RESULTS_PER_PAGE, params=None):
+    number = max(int(number), 1)
+    results = search(text, limit=per_page + 1, offset=(number - 1) * per_page)
+    return SearchPage(results[:per_page], number, len(results) > per_page,
+                      params if params is not None else {'q': text})
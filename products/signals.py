@@ -0,0 +1,44 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import fragments, pagecache, search
+from .models import CategoryCount, Product, SellerStats
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, raw=False, **kwargs):
+    # Remember what the seller and category counts were based on, and
+    # which card (by last_modified, which auto_now is about to replace) to drop.
+    instance._counted_as = instance._card_modified = None
+    if not raw and instance.pk is not None:
+        row = (Product.objects.filter(pk=instance.pk)
+               .values_list('seller_id', 'category', 'label', 'last_modified').first())
+        if row is not None:
+            instance._counted_as, instance._card_modified = row[:3], row[3]
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, created=False, **kwargs):
+    if raw:
+        return
+    search.index_product(instance)
+    if getattr(instance, '_card_modified', None) is not None:
+        fragments.invalidate_card(instance.pk, instance._card_modified)
+    pagecache.invalidate_page(instance.pk)
+    before = getattr(instance, '_counted_as', None)
+    if before is None or before[0] != instance.seller_id or before[2] != instance.label:
+        SellerStats.refresh({instance.seller_id, before[0] if before else None})
+    facet = (instance.category, instance.label)
+    if before is None:
+        CategoryCount.adjust({facet: 1})
+    elif before[1:] != facet:
+        CategoryCount.adjust({before[1:]: -1, facet: 1})
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+    fragments.invalidate_card(instance.pk, instance.last_modified)
+    pagecache.invalidate_page(instance.pk)
+    SellerStats.refresh({instance.seller_id})
+    CategoryCount.adjust({(instance.category, instance.label): -1})
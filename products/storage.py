@@ -0,0 +1,82 @@
+"""
+Content-addressed file storage for product images.
+
+Uploads are hashed (SHA-256) while they are streamed to a temporary file
+and then moved to ``<upload_to>/<first two hex digits>/<digest><ext>``.
+Identical uploads therefore end up as one file shared by every row that
+uses it, and a blob's URL never changes content, so it can be cached
+forever.  Blobs are never removed on save or delete; unreferenced ones are
+reclaimed by ``manage.py gc_media``.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+INCOMING_DIR = '.incoming'
+BLOB_RE = re.compile(r'(?:^|/)[0-9a-f]{2}/([0-9a-f]{64})(\.[A-Za-z0-9]+)?$')
+
+
+def is_blob_name(name):
+    return BLOB_RE.search(name) is not None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def blob_name(self, name, digest):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension).replace('\\', '/')
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is decided by the content in _save(); an existing
+        # file with the same name is by definition the same content.
+        return name
+
+    def _save(self, name, content):
+        incoming = os.path.join(self.location, INCOMING_DIR)
+        os.makedirs(incoming, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=incoming)
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+            name = self.blob_name(name, digest.hexdigest())
+            full_path = self.path(name)
+            try:
+                # A new reference to an existing blob: restart gc_media's
+                # grace period, since the row using it may not be committed yet.
+                os.utime(full_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp_path, self.file_permissions_mode)
+                os.replace(temp_path, full_path)
+            else:
+                os.remove(temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+    def iter_blobs(self, directory=''):
+        """Yield the names of all content-addressed blobs below ``directory``."""
+        root = self.path(directory)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d != INCOMING_DIR]
+            for filename in filenames:
+                name = os.path.relpath(os.path.join(dirpath, filename), self.location).replace(os.sep, '/')
+                if is_blob_name(name):
+                    yield name
+
+
+content_addressed_storage = ContentAddressedStorage()
@@ -1,7 +1,20 @@
+import csv
 import datetime
+import hashlib
+import io
+import json
+import os
 import re
+import shutil
+import tempfile
+import time
+from decimal import Decimal
 from unittest import mock
 
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+
 from django.contrib.auth.forms import (
     AdminPasswordChangeForm, AuthenticationForm, PasswordChangeForm,
     PasswordResetForm, ReadOnlyPasswordHashField, ReadOnlyPasswordHashWidget,
@@ -10,15 +23,30 @@ from django.contrib.auth.forms import (
 from django.contrib.auth.models import User
 from django.contrib.auth.signals import user_login_failed
 from django.core import mail
+from django.core.cache import cache, caches
 from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIHandler
+from django.core.signals import request_finished, request_started
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import SkipFile
 from django.core.mail import EmailMultiAlternatives
+from django.core.management import call_command
 from django.forms.fields import CharField, Field, IntegerField
-from django.test import SimpleTestCase, TestCase, override_settings
+from django.test import Client, SimpleTestCase, TestCase, override_settings
 from django.utils import translation
 from django.utils.text import capfirst
 from django.utils.translation import gettext as _
-from .models import Product
+from django.db import close_old_connections, connection
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from KindaEbay import throttle
+from .models import CategoryCount, ImportCheckpoint, Product, SellerStats
 from .forms import ProductForm
+from .storage import content_addressed_storage
+from .pagination import PAGE_SIZE
+from . import api, catalog, export, fragments, images, pagecache, search, uploads
+from .management.commands import bench_catalog, import_products
 
 class productTest(TestCase):
     def test_title_length(self):
@@ -112,3 +140,802 @@ class productTest(TestCase):
             form['category'].errors
         )
     
+
+class productListTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            Product.objects.create(
+                title='item %d' % i, price='10.00', summary='', category='E',
+                label='N', Product_Main_Img='images/item.png', publisher='tester')
+            for i in range(30)
+        ]
+
+    def test_first_page_is_newest(self):
+        response = self.client.get('/home/')
+        products = list(response.context['products'])
+        self.assertEqual(len(products), PAGE_SIZE)
+        self.assertEqual(products[0], self.products[-1])
+        self.assertTrue(response.context['is_paginated'])
+        self.assertFalse(response.context['page_obj'].has_previous)
+
+    def test_after_cursor_walks_every_product_once(self):
+        seen = []
+        url = '/home/'
+        while url:
+            response = self.client.get(url)
+            page = response.context['page_obj']
+            seen.extend(product.id for product in page)
+            url = '/home/?' + page.next_query if page.has_next else None
+        self.assertEqual(seen, [product.id for product in reversed(self.products)])
+
+    def test_before_cursor_returns_previous_page(self):
+        first = self.client.get('/home/').context['page_obj']
+        second = self.client.get('/home/?' + first.next_query).context['page_obj']
+        back = self.client.get('/home/?' + second.previous_query).context['page_obj']
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous)
+
+    def test_no_count_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/home/')
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/home/?after=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
+
+class productSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        def make(title, summary='', description=''):
+            return Product.objects.create(
+                title=title, summary=summary, description=description, price='10.00',
+                category='E', label='N', Product_Main_Img='images/item.png')
+        cls.macbook = make('MacBook Pro 2019', summary='laptop in good shape')
+        cls.desk = make('Standing desk', description='fits a macbook and two monitors')
+        cls.sofa = make('Leather sofa', summary='brown, three seats')
+
+    def test_title_match_ranks_first(self):
+        self.assertEqual(search.search('macbook'), [self.macbook, self.desk])
+
+    def test_prefix_match(self):
+        self.assertEqual(search.search('lapt'), [self.macbook])
+        self.assertEqual(search.search('leath so'), [self.sofa])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.sofa.title = 'Velvet couch'
+        self.sofa.save()
+        self.assertEqual(search.search('leather'), [])
+        self.assertEqual(search.search('velvet'), [self.sofa])
+        self.sofa.delete()
+        self.assertEqual(search.search('velvet'), [])
+
+    def test_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % search.FTS_TABLE)
+        self.assertEqual(search.search('macbook'), [])
+        self.assertEqual(search.rebuild(), 3)
+        self.assertEqual(search.search('macbook'), [self.macbook, self.desk])
+
+    def test_punctuation_is_not_fts_syntax(self):
+        self.assertEqual(search.search('"macbook" OR (sofa'), [])
+        self.assertEqual(search.search('*'), [])
+
+    def test_search_view(self):
+        response = self.client.get('/search/', {'q': 'sofa'})
+        self.assertEqual(list(response.context['products']), [self.sofa])
+        self.assertContains(response, 'value="sofa"')
+
+
+class productCatalogTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        def make(title, category, label, price):
+            return Product.objects.create(
+                title=title, summary='', price=price, category=category, label=label,
+                Product_Main_Img='images/item.png')
+        cls.monitor = make('monitor', 'E', 'N', '120.00')
+        cls.phone = make('phone', 'E', 'S', '80.00')
+        cls.laptop = make('laptop', 'E', 'N', '900.00')
+        cls.desk = make('desk', 'F', 'N', '40.00')
+
+    def listing(self, **params):
+        return list(self.client.get('/home/', params).context['products'])
+
+    def test_category_filter(self):
+        self.assertEqual(self.listing(category='F'), [self.desk])
+
+    def test_category_and_label_filter(self):
+        self.assertEqual(self.listing(category='E', label='N'), [self.laptop, self.monitor])
+
+    def test_price_sort(self):
+        self.assertEqual(self.listing(sort='price'), [self.desk, self.phone, self.monitor, self.laptop])
+        self.assertEqual(self.listing(category='E', sort='-price'), [self.laptop, self.monitor, self.phone])
+
+    def test_price_sort_cursor(self):
+        page, _ = catalog.listing_page({'sort': 'price'}, page_size=2)
+        self.assertEqual(list(page), [self.desk, self.phone])
+        page, _ = catalog.listing_page({'sort': 'price', 'after': page.next_cursor}, page_size=2)
+        self.assertEqual(list(page), [self.monitor, self.laptop])
+        self.assertFalse(page.has_next)
+
+    def test_unknown_filters_are_ignored(self):
+        self.assertEqual(len(self.listing(category='XX', label='?', sort='title')), 4)
+
+    def test_every_combination_uses_an_index(self):
+        for params in bench_catalog.combinations():
+            page, _ = catalog.listing_page(params, page_size=1)
+            for page_params in (params, dict(params, after=page.next_cursor)):
+                _, queries = bench_catalog.listing_queries(page_params)
+                plan = bench_catalog.query_plan(queries[-1])
+                with self.subTest(**page_params):
+                    self.assertTrue(plan['indexes'], plan['details'])
+                    self.assertFalse(plan['full_scan'], plan['details'])
+                    self.assertFalse(plan['temp_sort'], plan['details'])
+
+
+def make_png(width, height, color=(200, 30, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class productImageTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def create(self, png):
+        data = {
+            'title': 'Desk lamp', 'description': '', 'price': '15.00', 'summary': 'lamp',
+            'category': 'M', 'label': 'N',
+            'Product_Main_Img': SimpleUploadedFile('lamp.png', png, content_type='image/png'),
+        }
+        self.client.post('/create/', data)
+        return Product.objects.get(title='Desk lamp')
+
+    def test_create_generates_derivatives(self):
+        product = self.create(make_png(2000, 1000))
+        name = product.Product_Main_Img.name
+        for size, box in images.SIZES.items():
+            for fmt in images.FORMATS:
+                path = os.path.join(self.media_root, images.derivative_name(name, size, fmt))
+                with Image.open(path) as derivative:
+                    self.assertEqual(derivative.format, fmt.upper())
+                    self.assertLessEqual(derivative.width, box[0])
+                    self.assertEqual(derivative.width, 2 * derivative.height)
+        self.assertTrue(product.card_image.webp.endswith('.webp'))
+        self.assertIn('/derivatives/detail/', product.detail_image.jpeg)
+
+    def test_small_images_are_not_upscaled(self):
+        product = self.create(make_png(100, 80))
+        path = os.path.join(self.media_root, images.derivative_name(product.Product_Main_Img.name, 'card', 'jpeg'))
+        with Image.open(path) as derivative:
+            self.assertEqual(derivative.size, (100, 80))
+
+    def test_falls_back_to_original(self):
+        product = self.create(make_png(100, 80))
+        images.delete_derivatives(product.Product_Main_Img.name)
+        self.assertEqual(product.card_image.jpeg, product.Product_Main_Img.url)
+        # the original is a PNG: it mustn't be offered as WebP
+        self.assertEqual(product.card_image.webp, '')
+        self.assertNotIn('image/webp', fragments.render_card(product))
+
+    def test_derivative_names_keep_the_extension(self):
+        self.assertEqual(images.derivative_name('images/x.png', 'card', 'webp'), 'derivatives/card/images/x.png.webp')
+        self.assertNotEqual(images.derivative_name('images/x.png', 'card', 'jpeg'),
+                            images.derivative_name('images/x.jpg', 'card', 'jpeg'))
+
+    def test_listing_uses_card_derivative(self):
+        product = self.create(make_png(100, 80))
+        response = self.client.get('/home/')
+        self.assertContains(response, product.card_image.webp)
+
+    def post(self, content, client=None):
+        return (client or self.client).post('/create/', {
+            'title': 'Desk lamp', 'price': '15.00', 'summary': 'lamp', 'category': 'M', 'label': 'N',
+            'Product_Main_Img': SimpleUploadedFile('lamp.png', content, content_type='image/png'),
+        })
+
+    def test_non_image_is_rejected(self):
+        response = self.post(b'%PDF-1.4 ' + b'x' * 400000)
+        self.assertContains(response, 'Upload a JPEG, PNG, WebP or GIF image.', status_code=400)
+        self.assertNotContains(response, 'This field is required.', status_code=400)
+        self.assertEqual(response.context['form']['title'].value(), 'Desk lamp')
+        self.assertFalse(Product.objects.exists())
+
+    def test_invalid_form_is_shown_again(self):
+        response = self.client.post('/create/', {'title': 'Desk lamp'})
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.context['form'].errors)
+
+    @override_settings(PRODUCT_IMAGE_LIMITS={'PNG': {'max_bytes': 10 ** 6, 'max_pixels': 1000}})
+    def test_too_many_pixels(self):
+        response = self.post(make_png(100, 80))
+        self.assertContains(response, 'The image is 100 x 80 pixels', status_code=400)
+        self.assertFalse(Product.objects.exists())
+
+    @override_settings(PRODUCT_IMAGE_LIMITS={'PNG': {'max_bytes': 70000, 'max_pixels': 10 ** 6}})
+    def test_too_many_bytes(self):
+        noise = io.BytesIO()
+        Image.frombytes('RGB', (200, 200), os.urandom(120000)).save(noise, format='PNG')
+        response = self.post(noise.getvalue())
+        self.assertContains(response, 'PNG images can be at most', status_code=413)
+        self.assertFalse(Product.objects.exists())
+
+    def test_handler_skips_before_buffering_everything(self):
+        handler = uploads.ImageUploadHandler()
+        handler.handle_raw_input(None, {}, 10 ** 6, b'boundary')
+        handler.new_file('Product_Main_Img', 'lamp.png', 'image/png', None)
+        chunk = b'not an image' * 6000
+        with self.assertRaises(SkipFile):
+            for i in range(100):
+                handler.receive_data_chunk(chunk, i * len(chunk))
+        self.assertLess(handler.received, uploads.HEADER_BYTES + len(chunk))
+        handler.new_file('title', 'notes.txt', 'text/plain', None)
+        self.assertEqual(handler.receive_data_chunk(chunk, 0), chunk)
+
+    def test_csrf_is_still_checked(self):
+        response = self.post(make_png(10, 10), client=Client(enforce_csrf_checks=True))
+        self.assertEqual(response.status_code, 403)
+
+    def test_forged_posts_dont_spend_the_users_tokens(self):
+        throttle._stores.clear()
+        self.addCleanup(throttle._stores.clear)
+        user = User.objects.create_user('lampseller', password='x')
+        rates = {'create': {'ip': '100/h', 'user': '1/h'}}
+        with override_settings(THROTTLE={'ENABLED': True, 'STORE': 'locmem', 'RATES': rates}):
+            forged = Client(enforce_csrf_checks=True)
+            forged.force_login(user)
+            self.assertEqual(self.post(make_png(10, 10), client=forged).status_code, 403)
+            self.client.force_login(user)
+            self.assertEqual(self.post(make_png(10, 10)).status_code, 302)
+            self.assertEqual(self.post(make_png(10, 10)).status_code, 429)
+
+
+class productStorageTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    def make(self, png, filename='photo.png'):
+        product = Product(title='item', summary='', price='1.00', category='M', label='N')
+        product.Product_Main_Img.save(filename, ContentFile(png))
+        return product
+
+    def test_identical_uploads_share_one_blob(self):
+        png = make_png(10, 10)
+        first = self.make(png, 'photo.png')
+        second = self.make(png, 'copy of photo.PNG')
+        self.assertEqual(first.Product_Main_Img.name, second.Product_Main_Img.name)
+        digest = hashlib.sha256(png).hexdigest()
+        self.assertEqual(first.Product_Main_Img.name, 'images/%s/%s.png' % (digest[:2], digest))
+        blobs = list(content_addressed_storage.iter_blobs('images'))
+        self.assertEqual(blobs, [first.Product_Main_Img.name])
+
+    def test_different_content_gets_different_blobs(self):
+        first = self.make(make_png(10, 10, (0, 0, 0)))
+        second = self.make(make_png(10, 10, (255, 255, 255)))
+        self.assertNotEqual(first.Product_Main_Img.name, second.Product_Main_Img.name)
+
+    def test_gc_keeps_shared_and_deletes_orphaned_blobs(self):
+        shared = self.make(make_png(10, 10, (0, 0, 0)))
+        self.make(make_png(10, 10, (0, 0, 0)))
+        orphan = self.make(make_png(10, 10, (255, 255, 255)))
+        images.generate_derivatives(orphan.Product_Main_Img.name)
+        orphan.delete()
+        call_command('gc_media', grace=0, stdout=io.StringIO())
+        storage = content_addressed_storage
+        self.assertTrue(storage.exists(shared.Product_Main_Img.name))
+        self.assertFalse(storage.exists(orphan.Product_Main_Img.name))
+        self.assertFalse(images.has_derivatives(orphan.Product_Main_Img.name))
+
+    def test_reupload_restarts_the_grace_period(self):
+        png = make_png(10, 10)
+        first = self.make(png)
+        path = content_addressed_storage.path(first.Product_Main_Img.name)
+        os.utime(path, (0, 0))
+        self.make(png)
+        self.assertGreater(os.path.getmtime(path), time.time() - 60)
+
+    def test_gc_keeps_blobs_referenced_during_the_walk(self):
+        orphan = self.make(make_png(10, 10))
+        name = orphan.Product_Main_Img.name
+        orphan.delete()
+        walk = os.walk
+
+        def walk_after_upload(top):
+            # another upload of the same image commits after the snapshot
+            Product.objects.create(title='item', summary='', price='1.00', category='M', label='N',
+                                   Product_Main_Img=name)
+            return walk(top)
+        with mock.patch('os.walk', walk_after_upload):
+            call_command('gc_media', grace=0, stdout=io.StringIO())
+        self.assertTrue(content_addressed_storage.exists(name))
+
+
+class productCardCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            title='bike', summary='', price='50.00', category='M', label='N',
+            Product_Main_Img='images/bike.png')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cards_are_rendered_once(self):
+        with mock.patch.object(fragments, 'render_card', wraps=fragments.render_card) as render_card:
+            self.client.get('/home/')
+            self.client.get('/home/')
+        self.assertEqual(render_card.call_count, 1)
+
+    def test_save_invalidates_card(self):
+        self.client.get('/home/')
+        self.product.title = 'tandem bike'
+        self.product.save()
+        self.assertContains(self.client.get('/home/'), 'tandem bike')
+
+    def test_save_drops_the_old_card(self):
+        self.client.get('/home/')
+        key = fragments.card_key(self.product.pk, self.product.last_modified, fragments.card_generation())
+        self.assertIsNotNone(cache.get(key))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'tandem bike'
+            self.product.save()
+        self.assertIsNone(cache.get(key))
+
+    def test_delete_invalidates_card(self):
+        self.client.get('/home/')
+        other = Product.objects.create(
+            title='helmet', summary='', price='5.00', category='M', label='N',
+            Product_Main_Img='images/helmet.png')
+        self.client.get('/home/')
+        key = fragments.card_key(other.pk, other.last_modified, fragments.card_generation())
+        self.assertIsNotNone(cache.get(key))
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertIsNone(cache.get(key))
+
+    def test_render_of_the_row_before_a_save_is_not_served_after_it(self):
+        before = Product.objects.get(pk=self.product.pk)
+        self.product.title = 'tandem bike'
+        self.product.save()
+        # a listing that read the row before the save committed
+        fragments.render_cards([before])
+        self.assertContains(self.client.get('/home/'), 'tandem bike')
+
+    def test_invalidate_all_cards(self):
+        self.client.get('/home/')
+        Product.objects.filter(pk=self.product.pk).update(title='renamed')
+        self.assertNotContains(self.client.get('/home/'), 'renamed')
+        fragments.invalidate_all_cards()
+        self.assertContains(self.client.get('/home/'), 'renamed')
+
+
+class productDetailCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            title='kettle', summary='', price='12.00', category='M', label='N',
+            Product_Main_Img='images/kettle.png')
+        cls.user = User.objects.create_user(username='buyer', password='buyerpassword')
+
+    def setUp(self):
+        cache.clear()
+        self.url = self.product.get_absolute_url()
+
+    def test_validators_are_sent(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        cache.clear()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_anonymous_repeat_hits_skip_the_database(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_cached_page_is_served_on_the_event_loop(self):
+        self.client.get(self.url)
+        with mock.patch('products.views.read_to_async', side_effect=AssertionError):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(self.url), 'buyer')
+
+    def test_async_view_with_db_cache(self):
+        # The db cache can't be used on the event loop; the lookup happens
+        # in the view's thread instead.
+        db_cache = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                'LOCATION': 'test_page_cache'}}
+        with override_settings(CACHES=db_cache):
+            call_command('createcachetable', verbosity=0)
+            self.assertFalse(pagecache.lookup_is_nonblocking())
+            for _ in range(2):
+                response = async_to_sync(self.async_client.get)(self.url)
+                self.assertEqual(response.status_code, 200)
+            self.assertIsNotNone(caches['default'].get(pagecache.page_key(self.product.pk)))
+
+    def test_save_invalidates_cached_page_and_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.product.title = 'electric kettle'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'electric kettle')
+
+    def test_cached_page_is_dropped_when_the_save_commits(self):
+        self.client.get(self.url)
+        cache = caches[pagecache.CACHE_ALIAS]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'electric kettle'
+            self.product.save()
+            self.assertIsNotNone(cache.get(pagecache.page_key(self.product.pk)))
+        self.assertIsNone(cache.get(pagecache.page_key(self.product.pk)))
+
+    def test_logged_in_users_get_their_own_etag(self):
+        anonymous_etag = self.client.get(self.url)['ETag']
+        self.client.force_login(self.user)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=anonymous_etag)
+        self.assertContains(response, 'buyer')
+
+    def test_missing_product(self):
+        self.assertEqual(self.client.get('/product/999999/').status_code, 404)
+
+
+class productImportTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.source = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.addCleanup(shutil.rmtree, self.source)
+        with open(os.path.join(self.source, 'chair.png'), 'wb') as f:
+            f.write(make_png(30, 20))
+
+    def write_csv(self, rows):
+        path = os.path.join(self.source, 'products.csv')
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, ['title', 'price', 'summary', 'category', 'label', 'image'])
+            writer.writeheader()
+            writer.writerows(rows)
+        return path
+
+    def row(self, title, **overrides):
+        return dict({'title': title, 'price': '20.00', 'summary': 'wooden', 'category': 'F',
+                     'label': 'N', 'image': 'chair.png'}, **overrides)
+
+    def run_import(self, path, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_products', path, '--workers', '0', '--batch-size', '2',
+                     *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_csv(self):
+        path = self.write_csv([self.row('chair %d' % i) for i in range(5)])
+        out, err = self.run_import(path, '--publisher', 'importer')
+        self.assertEqual(Product.objects.count(), 5)
+        self.assertIn('Imported 5 products', out)
+        self.assertEqual(err, '')
+        names = set(Product.objects.values_list('Product_Main_Img', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertTrue(images.has_derivatives(names.pop()))
+        self.assertEqual(set(Product.objects.values_list('publisher', flat=True)), {'importer'})
+        self.assertEqual(len(search.search('chair')), 5)
+        self.assertEqual(CategoryCount.facets()[('F', 'N')], 5)
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_import_jsonl(self):
+        path = os.path.join(self.source, 'products.jsonl')
+        with open(path, 'w') as f:
+            for i in range(3):
+                f.write(json.dumps(self.row('stool %d' % i)) + '\n')
+        self.run_import(path)
+        self.assertEqual(Product.objects.filter(title__startswith='stool').count(), 3)
+
+    def test_jsonl_numbers_and_bad_lines(self):
+        path = os.path.join(self.source, 'products.jsonl')
+        with open(path, 'w') as f:
+            f.write(json.dumps(self.row('stool', price=20.5)) + '\n')
+            f.write('{"title": "broken\n')
+            f.write('[1, 2]\n')
+            f.write(json.dumps(self.row('bench', price=7)) + '\n')
+        out, err = self.run_import(path)
+        self.assertEqual(dict(Product.objects.values_list('title', 'price')),
+                         {'stool': Decimal('20.50'), 'bench': Decimal('7.00')})
+        self.assertIn('record 2: invalid JSON', err)
+        self.assertIn('record 3: not a JSON object', err)
+
+    def test_invalid_records_are_reported(self):
+        path = self.write_csv([self.row('ok'), self.row('bad', category='ZZ'),
+                               self.row('missing', image='nope.png')])
+        out, err = self.run_import(path)
+        self.assertEqual(list(Product.objects.values_list('title', flat=True)), ['ok'])
+        self.assertIn('record 2: category', err)
+        self.assertIn('record 3: image', err)
+
+    def test_resume(self):
+        path = self.write_csv([self.row('chair %d' % i) for i in range(5)])
+        ImportCheckpoint.write(os.path.abspath(path), 3)
+        self.run_import(path, '--resume')
+        self.assertEqual(sorted(Product.objects.values_list('title', flat=True)), ['chair 3', 'chair 4'])
+
+    def test_resume_after_dying_between_batches(self):
+        path = self.write_csv([self.row('chair %d' % i) for i in range(5)])
+        import_batch = import_products.Command.import_batch
+        calls = []
+
+        def dies_after_second_batch(command, *args):
+            result = import_batch(command, *args)
+            calls.append(1)
+            if len(calls) == 2:
+                # committed; the process goes away before anything else
+                raise KeyboardInterrupt
+            return result
+        with mock.patch.object(import_products.Command, 'import_batch', dies_after_second_batch):
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_import(path)
+        self.assertEqual(Product.objects.count(), 4)
+        self.run_import(path, '--resume')
+        self.assertEqual(sorted(Product.objects.values_list('title', flat=True)),
+                         ['chair %d' % i for i in range(5)])
+
+
+class productExportTest(TestCase):
+    def setUp(self):
+        self.old = Product.objects.create(title='old lamp', price='5.00', summary='s', category='F',
+                                          label='N', Product_Main_Img='images/a.png')
+        Product.objects.filter(pk=self.old.pk).update(
+            publish_time=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc))
+        self.new = Product.objects.create(title='new, "quoted" lamp', price='7.50', summary='s',
+                                          category='E', label='N', Product_Main_Img='images/b.png')
+
+    def test_command_csv(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('export_products', stdout=out, stderr=err)
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual([r['title'] for r in rows], ['old lamp', 'new, "quoted" lamp'])
+        self.assertEqual(rows[1]['price'], '7.50')
+        self.assertIn('Exported 2 products', err.getvalue())
+
+    def test_command_jsonl_since(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('export_products', '--format', 'jsonl', '--since', '2021-01-01',
+                     stdout=out, stderr=err)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['id'], self.new.pk)
+
+    def test_rows_are_chunked(self):
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(export.export_rows(chunk_size=1))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(tuple(rows[0]), export.FIELDS)
+
+    def test_view_requires_staff(self):
+        response = self.client.get('/export/products/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_view_streams(self):
+        staff = User.objects.create_user('staff', password='x', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get('/export/products/', {'format': 'jsonl'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="products.jsonl"', response['Content-Disposition'])
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(body.splitlines()), 2)
+        self.assertEqual(self.client.get('/export/products/', {'since': 'nope'}).status_code, 400)
+
+    def test_view_under_asgi(self):
+        # ASGIHandler sends the body from the event loop, unlike the test
+        # client; the whole export must arrive.
+        staff = User.objects.create_user('staff', password='x', is_staff=True)
+        self.client.force_login(staff)
+        cookie = '%s=%s' % (settings.SESSION_COOKIE_NAME, self.client.cookies[settings.SESSION_COOKIE_NAME].value)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': '/export/products/', 'raw_path': b'/export/products/',
+            'query_string': b'format=csv', 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+
+        async def fetch():
+            communicator = ApplicationCommunicator(ASGIHandler(), scope)
+            await communicator.send_input({'type': 'http.request', 'body': b'', 'more_body': False})
+            start = await communicator.receive_output(10)
+            body = b''
+            while True:
+                message = await communicator.receive_output(10)
+                body += message.get('body', b'')
+                if not message.get('more_body'):
+                    return start['status'], body
+        # as the test client does: keep the test transaction's connection
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            status, body = async_to_sync(fetch)()
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        self.assertEqual(status, 200)
+        rows = list(csv.DictReader(io.StringIO(body.decode())))
+        self.assertEqual([r['title'] for r in rows], ['old lamp', 'new, "quoted" lamp'])
+
+
+class productApiTest(TestCase):
+    def setUp(self):
+        self.products = [
+            Product.objects.create(title='item %d' % i, price='%d.25' % i, summary='s',
+                                   description='long text', category='E' if i % 2 else 'F',
+                                   label='N', Product_Main_Img='images/%d.png' % i)
+            for i in range(5)
+        ]
+
+    def test_list_default_fields(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = response.json()
+        self.assertEqual([item['title'] for item in data['results']],
+                         ['item 4', 'item 3', 'item 2', 'item 1', 'item 0'])
+        self.assertNotIn('description', data['results'][0])
+        self.assertEqual(data['results'][0]['price'], '4.25')
+        self.assertEqual(data['results'][0]['image'], '/media/images/4.png')
+        self.assertIsNone(data['next'])
+
+    def test_fields_projection(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get('/api/products/', {'fields': 'id,title'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'title'})
+        self.assertNotIn('description', queries[-1]['sql'])
+        self.assertEqual(self.client.get('/api/products/', {'fields': 'id,secret'}).status_code, 400)
+
+    def test_cursor_pagination_and_filters(self):
+        data = self.client.get('/api/products/', {'limit': 2, 'sort': 'price'}).json()
+        self.assertEqual([item['title'] for item in data['results']], ['item 0', 'item 1'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual([item['title'] for item in data['results']], ['item 2', 'item 3'])
+        self.assertIsNotNone(data['previous'])
+        data = self.client.get('/api/products/', {'category': 'E'}).json()
+        self.assertEqual(len(data['results']), 2)
+        self.assertEqual(self.client.get('/api/products/', {'after': 'bad'}).status_code, 400)
+
+    def test_detail(self):
+        product = self.products[0]
+        data = self.client.get('/api/products/%d/' % product.pk, {'fields': 'title,description'}).json()
+        self.assertEqual(data, {'title': 'item 0', 'description': 'long text'})
+        self.assertEqual(self.client.get('/api/products/999999/').status_code, 404)
+
+    def test_stdlib_json_fallback(self):
+        with mock.patch('products.api.orjson', None):
+            data = json.loads(api.dumps({'price': Decimal('1.50'), 'time': datetime.date(2021, 1, 2)}))
+        self.assertEqual(data, {'price': '1.50', 'time': '2021-01-02'})
+
+
+class productSellerTest(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', password='x')
+        self.other = User.objects.create_user('other', password='x')
+
+    def make(self, title, seller=None, label='N'):
+        return Product.objects.create(title=title, price='1.00', summary='s', category='F', label=label,
+                                      Product_Main_Img='images/x.png', seller=seller or self.seller,
+                                      publisher=(seller or self.seller).username)
+
+    def stats(self, user):
+        return SellerStats.for_seller(user)
+
+    def test_counts_follow_saves_and_deletes(self):
+        chair = self.make('chair')
+        self.make('desk', label='S')
+        self.assertEqual((self.stats(self.seller).active_count, self.stats(self.seller).sold_count), (1, 1))
+        chair.label = 'S'
+        chair.save()
+        self.assertEqual((self.stats(self.seller).active_count, self.stats(self.seller).sold_count), (0, 2))
+        chair.seller = self.other
+        chair.save()
+        self.assertEqual(self.stats(self.seller).sold_count, 1)
+        self.assertEqual(self.stats(self.other).sold_count, 1)
+        chair.delete()
+        self.assertEqual(self.stats(self.other).sold_count, 0)
+
+    def test_seller_page_is_bounded(self):
+        for i in range(30):
+            self.make('item %d' % i, label='S' if i % 3 == 0 else 'N')
+        self.make('not mine', seller=self.other)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/seller/%d/' % self.seller.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['products']), PAGE_SIZE)
+        self.assertContains(response, '20 active')
+        self.assertContains(response, '10 sold')
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql'].upper()])
+        sold = self.client.get('/seller/%d/' % self.seller.pk, {'label': 'S'})
+        self.assertEqual(len(sold.context['products']), 10)
+        self.assertEqual(self.client.get('/seller/999999/').status_code, 404)
+
+    def test_my_listings(self):
+        self.make('mine')
+        self.make('theirs', seller=self.other)
+        self.assertEqual(self.client.get('/my-listings/').status_code, 302)
+        self.client.force_login(self.seller)
+        response = self.client.get('/my-listings/')
+        self.assertEqual([p.title for p in response.context['products']], ['mine'])
+        self.assertContains(response, 'My listings')
+
+    def test_create_view_sets_seller(self):
+        self.client.force_login(self.seller)
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            self.client.post('/create/', {
+                'title': 'lamp', 'price': '3.00', 'summary': 's', 'category': 'F', 'label': 'N',
+                'Product_Main_Img': SimpleUploadedFile('lamp.png', make_png(10, 10), 'image/png'),
+            })
+        product = Product.objects.get(title='lamp')
+        self.assertEqual(product.seller, self.seller)
+        self.assertEqual(self.stats(self.seller).active_count, 1)
+        self.assertContains(self.client.get(product.get_absolute_url()), '/seller/%d/' % self.seller.pk)
+
+
+class productCategoryCountTest(TestCase):
+    def make(self, title, category='E', label='N'):
+        return Product.objects.create(title=title, price='1.00', summary='', category=category,
+                                      label=label, Product_Main_Img='images/x.png')
+
+    def counts(self):
+        return {key: n for key, n in CategoryCount.facets().items() if n}
+
+    def test_save_and_delete_adjust_counts(self):
+        phone = self.make('phone')
+        self.make('desk', category='F')
+        self.assertEqual(self.counts(), {('E', 'N'): 1, ('F', 'N'): 1})
+        phone.label = 'S'
+        phone.save()
+        phone.title = 'old phone'
+        phone.save()
+        self.assertEqual(self.counts(), {('E', 'S'): 1, ('F', 'N'): 1})
+        phone.delete()
+        self.assertEqual(self.counts(), {('F', 'N'): 1})
+
+    def test_navbar_counts(self):
+        self.make('phone')
+        self.make('radio', label='S')
+        self.make('desk', category='F')
+        with self.assertNumQueries(1):
+            nav = catalog.navigation(catalog.clean_filters({'label': 'N'}))
+        self.assertEqual(nav['all_count'], 2)
+        self.assertEqual({code: n for code, _, _, _, n in nav['category_links']}['E'], 1)
+        response = self.client.get('/home/', {'category': 'E'})
+        self.assertContains(response, 'Electronics (2)')
+        self.assertContains(response, 'Sold (1)')
+
+    def test_reconcile(self):
+        self.make('phone')
+        self.make('radio')
+        Product.objects.filter(title='radio').update(category='C')
+        self.assertEqual(self.counts(), {('E', 'N'): 2})
+        out = io.StringIO()
+        call_command('reconcile_counts', stdout=out)
+        self.assertIn('Electronics / New: 2 -> 1', out.getvalue())
+        self.assertIn('Corrected 2 counter(s).', out.getvalue())
+        self.assertEqual(self.counts(), {('E', 'N'): 1, ('C', 'N'): 1})
+        self.assertEqual(CategoryCount.recount(), {})
@@ -0,0 +1,143 @@
+"""
+Early rejection of product image uploads.
+
+With the default upload handlers an upload is written out in full before
+ProductForm gets to look at it, so a 2 GB video renamed to .jpg is only
+refused once all of it has been received and stored.  ImageUploadHandler
+goes first in the handler chain and watches the image field as it streams:
+
+* the first bytes are sniffed with Pillow (Image.open only parses the
+  header; no pixel data is decoded or allocated), and an upload that isn't
+  one of the ``LIMITS`` formats within ``HEADER_BYTES``, or whose
+  dimensions exceed the format's ``max_pixels``, is skipped: the rest of
+  the file is read and dropped instead of being stored;
+* once more than the format's ``max_bytes`` have arrived (or the request's
+  Content-Length alone is more than any format allows) parsing stops
+  altogether, and under WSGI the rest of the body is never read.
+
+``settings.PRODUCT_IMAGE_LIMITS`` replaces entries of ``LIMITS`` by format.
+Rejections are recorded on the request for the view to turn into form
+errors (see rejected_uploads()).  ProductForm's own ImageField validation
+still runs on whatever gets through.
+"""
+import io
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopUpload
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+FIELD_NAMES = ('Product_Main_Img',)
+MiB = 1024 * 1024
+# Pillow format -> limits
+LIMITS = {
+    'JPEG': {'max_bytes': 10 * MiB, 'max_pixels': 40000000},
+    'PNG': {'max_bytes': 10 * MiB, 'max_pixels': 25000000},
+    'WEBP': {'max_bytes': 5 * MiB, 'max_pixels': 25000000},
+    'GIF': {'max_bytes': 5 * MiB, 'max_pixels': 4000000},
+}
+# An image whose header isn't complete after this many bytes is refused.
+HEADER_BYTES = 256 * 1024
+# Room for the other form fields next to the image.
+FORM_OVERHEAD = MiB
+
+Rejection = namedtuple('Rejection', ['message', 'status'])
+
+
+def get_limits():
+    return dict(LIMITS, **getattr(settings, 'PRODUCT_IMAGE_LIMITS', {}))
+
+
+def rejected_uploads(request):
+    """{field name: Rejection} for the uploads ImageUploadHandler refused."""
+    return getattr(request, '_rejected_uploads', {})
+
+
+def sniff(data, formats):
+    """
+    Return ``(format, (width, height))`` if ``data`` starts with a complete
+    image header in one of ``formats``, None if it doesn't (yet).
+    """
+    try:
+        with Image.open(io.BytesIO(data), formats=formats) as image:
+            return image.format, image.size
+    except Image.DecompressionBombError:
+        return 'bomb', None
+    except (OSError, SyntaxError, ValueError, EOFError):
+        return None
+
+
+class ImageUploadHandler(FileUploadHandler):
+
+    def __init__(self, request=None, field_names=FIELD_NAMES):
+        super().__init__(request)
+        self.field_names = field_names
+        self.limits = get_limits()
+        self.request_too_large = False
+        self.active = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        max_bytes = max(limit['max_bytes'] for limit in self.limits.values())
+        self.request_too_large = content_length > max_bytes + FORM_OVERHEAD
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.active = field_name in self.field_names
+        self.header = b''
+        self.received = 0
+        self.format = None
+        self.max_bytes = None
+        if self.active and self.request_too_large:
+            self.reject("The upload is too large.", status=413, stop=True)
+
+    def reject(self, message, status=400, stop=False):
+        if self.request is not None:
+            if not hasattr(self.request, '_rejected_uploads'):
+                self.request._rejected_uploads = {}
+            self.request._rejected_uploads[self.field_name] = Rejection(message, status)
+        self.active = False
+        if stop:
+            raise StopUpload(connection_reset=True)
+        raise SkipFile()
+
+    def check_header(self, final=False):
+        sniffed = sniff(self.header, list(self.limits))
+        if sniffed is None:
+            if final or len(self.header) >= HEADER_BYTES:
+                self.reject("Upload a JPEG, PNG, WebP or GIF image.")
+            return
+        self.format, size = sniffed
+        self.header = b''
+        if size is None:
+            self.reject("The image has too many pixels.")
+        limit = self.limits[self.format]
+        if size[0] * size[1] > limit['max_pixels']:
+            self.reject("The image is %d x %d pixels; at most %s megapixels are allowed." % (
+                size[0], size[1], round(limit['max_pixels'] / 1e6, 1)))
+        self.max_bytes = limit['max_bytes']
+        self.check_size()
+
+    def check_size(self):
+        if self.max_bytes is not None and self.received > self.max_bytes:
+            self.reject("%s images can be at most %s." % (self.format, filesizeformat(self.max_bytes)),
+                        status=413, stop=True)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.active:
+            self.received += len(raw_data)
+            if self.format is None:
+                self.header += raw_data
+                self.check_header()
+            else:
+                self.check_size()
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.active and self.format is None:
+            try:
+                self.check_header(final=True)
+            except SkipFile:
+                # Too late to skip; the form refuses the file.
+                pass
+        return None
@@ -1,34 +1,186 @@
-from django.http import HttpResponse
-from django.shortcuts import render, redirect
-from .models import Product
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth import get_user_model
+from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest
+from django.shortcuts import get_object_or_404, render, redirect
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import condition
+from KindaEbay.db.readers import read_to_async
+from KindaEbay.throttle import throttle
+from .models import LABLE_CHOICES, Product, SellerStats
 from .forms import ProductForm
+from . import export, fragments, images, pagecache, uploads
+from .catalog import clean_filters, listing_page, navigation
+from .pagination import InvalidCursor, paginate
+from .search import search_page
+
+
+def _product_last_modified(request, productid, *args, **kwargs):
+    # condition() asks for the ETag and Last-Modified separately; look the
+    # timestamp up once per request.
+    if not hasattr(request, '_product_last_modified'):
+        request._product_last_modified = (
+            Product.objects.filter(id=productid).values_list('last_modified', flat=True).first())
+    return request._product_last_modified
+
+
+def _product_etag(request, productid, *args, **kwargs):
+    last_modified = _product_last_modified(request, productid)
+    if last_modified is None:
+        return None
+    # The navbar greets the user, so the page differs per user.
+    return '%s-%x-%s' % (productid, int(last_modified.timestamp() * 1000000), request.user.pk or 0)
 
 
 # Create your views here.
-def product_detail_view(request, *args, **kwargs):
+@pagecache.anonymous_page_cache()
+@condition(etag_func=_product_etag, last_modified_func=_product_last_modified)
+def _product_detail(request, *args, **kwargs):
     context = {
-        'product': Product.objects.get(id=kwargs['productid'])
+        'product': get_object_or_404(Product.objects.select_related('seller'), id=kwargs['productid'])
     }
     return render(request, "products/product-page.html", context)
 
 
-def product_list_view(request, *args, **kwargs):
+async def product_detail_view(request, *args, **kwargs):
+    # With an in-process cache, a page cache hit for a visitor without a
+    # session is answered on the event loop; anything else is one trip to a
+    # reader thread, where the page cache decorator looks it up.
+    if request.method == 'GET' and pagecache.has_no_session(request) and pagecache.lookup_is_nonblocking():
+        response = pagecache.cached_response(request, kwargs['productid'])
+        if response is not None:
+            return response
+    return await read_to_async(_product_detail)(request, *args, **kwargs)
+
+
+def _product_list(request, *args, **kwargs):
+    try:
+        page, filters = listing_page(request.GET)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid page cursor.")
+    context = {
+        'products': page.object_list,
+        'cards': fragments.render_cards(page.object_list),
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+        'filters': filters,
+        'nav': navigation(filters),
+    }
+    return render(request, "home-page.html", context)
+
+
+async def product_list_view(request, *args, **kwargs):
+    return await read_to_async(_product_list)(request, *args, **kwargs)
+
+
+def product_search_view(request, *args, **kwargs):
+    query = request.GET.get('q', '').strip()
+    try:
+        number = int(request.GET.get('page', 1))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid page number.")
+    page = search_page(query, number, params=request.GET)
     context = {
-        'products': Product.objects.all()
+        'products': page.object_list,
+        'cards': fragments.render_cards(page.object_list),
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+        'query': query,
+        'nav': navigation(clean_filters({})),
     }
     return render(request, "home-page.html", context)
 
 
+def _seller_listing(request, seller, own_listings):
+    label = request.GET.get('label')
+    if label not in dict(LABLE_CHOICES):
+        label = None
+    # Served by the seller_* indexes; the counts come from SellerStats.
+    queryset = Product.objects.filter(seller=seller).select_related('seller')
+    if label:
+        queryset = queryset.filter(label=label)
+    try:
+        page = paginate(queryset, after=request.GET.get('after'), before=request.GET.get('before'),
+                        params=request.GET)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid page cursor.")
+    context = {
+        'seller': seller,
+        'stats': SellerStats.for_seller(seller),
+        'own_listings': own_listings,
+        'label': label,
+        'labels': LABLE_CHOICES,
+        'products': page.object_list,
+        'cards': fragments.render_cards(page.object_list),
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+    }
+    return render(request, "products/seller-page.html", context)
+
+
+def seller_view(request, sellerid, *args, **kwargs):
+    return _seller_listing(request, get_object_or_404(get_user_model(), pk=sellerid), False)
+
+
+@login_required
+def my_listings_view(request, *args, **kwargs):
+    return _seller_listing(request, request.user, True)
+
+
+@staff_member_required
+def product_export_view(request, *args, **kwargs):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return HttpResponseBadRequest("Unknown export format.")
+    since = None
+    if request.GET.get('since'):
+        try:
+            since = export.parse_since(request.GET['since'])
+        except ValueError:
+            return HttpResponseBadRequest("Invalid since timestamp.")
+    # Read everything here, in the view's thread: the response is sent
+    # from the event loop under ASGI.
+    return FileResponse(export.export_file(fmt, export.export_rows(since)), as_attachment=True,
+                        filename='products.%s' % fmt, content_type=export.CONTENT_TYPES[fmt])
+
+
+@csrf_exempt
+@throttle('create', keys=('ip',))
 def product_create_view(request, *args, **kwargs):
+    # The upload handler has to be in place before anything reads
+    # request.POST, CsrfViewMiddleware included; the CSRF check is done by
+    # _product_create instead.  Until then the request may be forged, so
+    # only the client IP's bucket is charged here and the user's after it.
+    if request.method == 'POST':
+        request.upload_handlers.insert(0, uploads.ImageUploadHandler(request))
+    return _product_create(request, *args, **kwargs)
+
+
+@csrf_protect
+@throttle('create', keys=('user',))
+def _product_create(request, *args, **kwargs):
+    status = 200
     if request.method == 'POST':
         form = ProductForm(request.POST, request.FILES)
-        if form.is_valid():
+        rejected = uploads.rejected_uploads(request)
+        if form.is_valid() and not rejected:
             pending_review = form.save(commit=False)
             pending_review.publisher = request.user.username
+            if request.user.is_authenticated:
+                pending_review.seller = request.user
             pending_review.save()
-        return redirect('/home/')
+            images.generate_derivatives(pending_review.Product_Main_Img.name)
+            # the card may have been cached before the derivatives existed
+            fragments.invalidate_card(pending_review.pk, pending_review.last_modified)
+            pagecache.invalidate_page(pending_review.pk)
+            return redirect('/home/')
+        for field, rejection in rejected.items():
+            # instead of "This field is required." for a skipped file
+            form.errors[field] = form.error_class([rejection.message])
+        status = max([400] + [rejection.status for rejection in rejected.values()])
     else:
         form = ProductForm()
-    return render(request=request, template_name="products/product_create.html", context={"form": form})
+    return render(request=request, template_name="products/product_create.html", context={"form": form},
+                  status=status)
 
 
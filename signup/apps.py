@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SignupConfig(AppConfig):
     name = 'signup'
+
+    def ready(self):
+        from . import checks  # noqa: F401
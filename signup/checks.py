@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+CACHED_ENGINES = ('django.contrib.sessions.backends.cache', 'django.contrib.sessions.backends.cached_db')
+
+
+@register(Tags.security)
+def check_session_cache(app_configs, **kwargs):
+    """
+    Sessions kept in a per-process cache outlive a logout in every other
+    worker, which keeps serving the cached copy.
+    """
+    if settings.SESSION_ENGINE not in CACHED_ENGINES:
+        return []
+    backend = settings.CACHES.get(settings.SESSION_CACHE_ALIAS, {}).get('BACKEND', '')
+    if not backend.endswith('.LocMemCache'):
+        return []
+    return [Error(
+        "%s keeps sessions in the per-process %r cache." % (settings.SESSION_ENGINE, settings.SESSION_CACHE_ALIAS),
+        hint="Use a shared cache (KINDAEBAY_CACHE=file or db) or KINDAEBAY_SESSIONS=db.",
+        id='signup.E001',
+    )]
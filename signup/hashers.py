@@ -0,0 +1,20 @@
+"""
+PBKDF2 with a configurable work factor.
+
+PBKDF2PasswordHasher's iteration count is a class attribute tied to the
+Django release.  TunedPBKDF2PasswordHasher takes it from
+``settings.PASSWORD_HASH_ITERATIONS`` instead, keeping the algorithm name
+``pbkdf2_sha256``, so existing hashes keep working.  must_update() compares
+a stored hash's iteration count with the configured one, so when the
+setting changes each user's password is rehashed at the new cost on their
+next successful login, in either direction.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', PBKDF2PasswordHasher.iterations)
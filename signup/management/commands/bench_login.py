@@ -0,0 +1,68 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.forms import AuthenticationForm
+from django.core.management.base import BaseCommand
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+
+from signup.hashers import TunedPBKDF2PasswordHasher
+
+PASSWORD = 'bench-login-password'
+
+
+class Command(BaseCommand):
+    help = ("Measure logins per second on one core: the old flow (AuthenticationForm, then "
+            "authenticate() again) against /login/ as it is now, at one or more PBKDF2 "
+            "iteration counts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=20)
+        parser.add_argument('--iterations', type=int, nargs='+',
+                            help="PBKDF2 iteration counts to try (default: the configured one).")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        user = User.objects.create_user('bench-login-user', password=PASSWORD)
+        verify = TunedPBKDF2PasswordHasher.verify
+        self.verifications = 0
+
+        def counting_verify(hasher, password, encoded):
+            self.verifications += 1
+            return verify(hasher, password, encoded)
+        TunedPBKDF2PasswordHasher.verify = counting_verify
+        try:
+            counts = options['iterations'] or [settings.PASSWORD_HASH_ITERATIONS]
+            self.stdout.write("%-10s %-14s %8s %10s %10s" % (
+                "iterations", "flow", "hashes", "ms/login", "logins/s"))
+            for iterations in counts:
+                with override_settings(PASSWORD_HASH_ITERATIONS=iterations):
+                    user.set_password(PASSWORD)
+                    user.save(update_fields=['password'])
+                    for flow, login in (("form+auth", self.double), ("view", self.view)):
+                        self.run(iterations, flow, login, user, options['logins'])
+        finally:
+            TunedPBKDF2PasswordHasher.verify = verify
+            user.delete()
+
+    def run(self, iterations, flow, login, user, logins):
+        login(user)  # warm up
+        self.verifications = 0
+        started = time.perf_counter()
+        for _ in range(logins):
+            login(user)
+        elapsed = time.perf_counter() - started
+        self.stdout.write("%-10d %-14s %8.1f %10.1f %10.1f" % (
+            iterations, flow, self.verifications / logins, elapsed * 1000 / logins, logins / elapsed))
+
+    def double(self, user):
+        # What login_request used to do.
+        request = RequestFactory().post('/login/')
+        form = AuthenticationForm(request, data={'username': user.username, 'password': PASSWORD})
+        assert form.is_valid()
+        assert authenticate(username=user.username, password=PASSWORD) is not None
+
+    def view(self, user):
+        response = Client().post('/login/', {'username': user.username, 'password': PASSWORD})
+        assert response.status_code == 302, response.status_code
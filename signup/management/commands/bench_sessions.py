@@ -0,0 +1,85 @@
+import statistics
+import time
+from contextlib import ExitStack
+from importlib import import_module
+
+from asgiref.sync import async_to_sync
+from channels.auth import get_user
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+
+ENGINES = ['db', 'cached_db', 'signed_cookies']
+
+
+class QueryCounter:
+    # Counts on every connection: outside transactions session reads go to
+    # the replica (KindaEbay.db.routers).
+    def __init__(self):
+        self.count = 0
+        self.session = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        if 'django_session' in sql:
+            self.session += 1
+        return execute(sql, params, many, context)
+
+
+def counting(counter):
+    stack = ExitStack()
+    for alias in settings.DATABASES:
+        stack.enter_context(connections[alias].execute_wrapper(counter))
+    return stack
+
+
+class Command(BaseCommand):
+    help = ("Measure database queries (all, and on django_session) and latency of a logged-in "
+            "page view and of a websocket connect's user lookup, for each session engine.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='/my-listings/')
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.create_user('bench-session-user', password='x')
+        try:
+            self.stdout.write("%-15s %-10s %8s %9s %8s %8s" % (
+                "engine", "request", "queries", "session q", "p50 ms", "p99 ms"))
+            for name in ENGINES:
+                engine = 'django.contrib.sessions.backends.%s' % name
+                with override_settings(SESSION_ENGINE=engine):
+                    cache.clear()
+                    client = Client()
+                    client.force_login(user)
+                    session_key = client.cookies[settings.SESSION_COOKIE_NAME].value
+                    store = import_module(engine).SessionStore
+                    rows = [
+                        ("page view", lambda: client.get(options['url'])),
+                        # what AuthMiddlewareStack does on connect
+                        ("ws connect", lambda: async_to_sync(get_user)({'session': store(session_key)})),
+                    ]
+                    for request_name, request in rows:
+                        self.measure(name, request_name, request, options['repeat'])
+                    client.logout()
+        finally:
+            user.delete()
+
+    def measure(self, engine, name, request, repeat):
+        request()
+        counter = QueryCounter()
+        with counting(counter):
+            request()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            request()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write("%-15s %-10s %8d %9d %8.3f %8.3f" % (
+            engine, name, counter.count, counter.session, statistics.median(timings),
+            timings[min(len(timings) - 1, int(len(timings) * 0.99))]))
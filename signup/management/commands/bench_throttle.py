@@ -0,0 +1,73 @@
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from KindaEbay import throttle
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+class Command(BaseCommand):
+    help = ("Time token-bucket checks against each throttle store from several threads "
+            "hammering a few hot keys (one IP, one username) and many cold ones, and check "
+            "that no more requests got through than the buckets allow.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--checks', type=int, default=5000, help="Checks per thread.")
+        parser.add_argument('--burst', type=int, default=50)
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp()
+        try:
+            stores = {
+                'locmem': throttle.LocMemStore(),
+                'cache': throttle.CacheStore(),
+                'sqlite': throttle.SQLiteStore(os.path.join(directory, 'throttle.sqlite3')),
+            }
+            self.stdout.write("%-7s %10s %8s %8s %10s %8s" % (
+                "store", "checks/s", "p50 us", "p99 us", "hot passed", "allowed"))
+            for name, store in stores.items():
+                result = self.run(store, name, options)
+                timings = sorted(result['timings'])
+                self.stdout.write("%-7s %10.0f %8.1f %8.1f %10d %8d" % (
+                    name, len(timings) / result['seconds'], statistics.median(timings),
+                    percentile(timings, 0.99), result['passed'], options['burst']))
+        finally:
+            shutil.rmtree(directory)
+
+    def run(self, store, name, options):
+        # Refill so slow nothing comes back during the run: every hot check
+        # past the burst should be refused.
+        rate, burst = 1e-6, options['burst']
+        result = {'timings': [], 'passed': 0}
+        lock = threading.Lock()
+
+        def worker(number):
+            local, passed = [], 0
+            for i in range(options['checks']):
+                key = 'bench:%s:hot' % name if i % 2 else 'bench:%s:%d:%d' % (name, number, i)
+                started = time.perf_counter()
+                left = store.take(key, rate, burst, time.time())
+                local.append((time.perf_counter() - started) * 1e6)
+                if i % 2 and left >= 0:
+                    passed += 1
+            with lock:
+                result['timings'].extend(local)
+                result['passed'] += passed
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result['seconds'] = time.perf_counter() - started
+        return result
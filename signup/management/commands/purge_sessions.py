@@ -0,0 +1,48 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ("Delete expired sessions from django_session in small batches, so the SQLite write "
+            "lock is only held briefly at a time (clearsessions deletes them all in one "
+            "statement).  Run it from cron, or keep it running with --every.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help="Seconds to sleep between batches, letting requests write.")
+        parser.add_argument('--every', type=float,
+                            help="Purge again every this many seconds instead of exiting.")
+
+    def handle(self, *args, **options):
+        engine = import_module(settings.SESSION_ENGINE)
+        if not hasattr(engine.SessionStore, 'get_model_class'):
+            # signed_cookies: nothing stored; cache: the cache expires them.
+            self.stdout.write("%s keeps no session rows; nothing to purge." % settings.SESSION_ENGINE)
+            return
+        model = engine.SessionStore.get_model_class()
+        while True:
+            deleted = self.purge(model, options['batch_size'], options['pause'])
+            self.stdout.write(self.style.SUCCESS("Deleted %d expired session(s)." % deleted))
+            if options['every'] is None:
+                return
+            time.sleep(options['every'])
+
+    def purge(self, model, batch_size, pause):
+        now = timezone.now()
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                keys = list(model.objects.filter(expire_date__lt=now)
+                            .values_list('pk', flat=True)[:batch_size])
+                if keys:
+                    model.objects.filter(pk__in=keys).delete()
+            deleted += len(keys)
+            if len(keys) < batch_size:
+                return deleted
+            time.sleep(pause)
@@ -1,5 +1,6 @@
 import datetime
 import re
+from io import StringIO
 from unittest import mock
 
 from django.contrib.auth.forms import (
@@ -7,16 +8,21 @@ from django.contrib.auth.forms import (
     PasswordResetForm, ReadOnlyPasswordHashField, ReadOnlyPasswordHashWidget,
     SetPasswordForm, UserChangeForm, UserCreationForm,
 )
+from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth.models import User
 from django.contrib.auth.signals import user_login_failed
+from django.contrib.sessions.models import Session
 from django.core import mail
 from django.core.exceptions import ValidationError
 from django.core.mail import EmailMultiAlternatives
+from django.core.management import call_command
+from django.db import connection
 from django.forms.fields import CharField, Field, IntegerField
 from django.test import SimpleTestCase, TestCase, override_settings
-from django.utils import translation
+from django.utils import timezone, translation
 from django.utils.text import capfirst
 from django.utils.translation import gettext as _
+from . import checks
 from .forms import NewUserForm
 
  
@@ -298,3 +304,87 @@ class UserSigninTest(TestDataMixin, TestCase):
             ]
         )
 
+
+
+class LoginViewTest(TestDataMixin, TestCase):
+
+    def test_login_authenticates_once(self):
+        with mock.patch('django.contrib.auth.backends.ModelBackend.authenticate',
+                        autospec=True, side_effect=ModelBackend.authenticate) as backend:
+            response = self.client.post('/login/?next=/my-listings/',
+                                        {'username': 'testuser', 'password': 'mytestpassword'})
+        self.assertRedirects(response, '/my-listings/', fetch_redirect_response=False)
+        self.assertEqual(backend.call_count, 1)
+        self.assertEqual(int(self.client.session['_auth_user_id']), self.u1.pk)
+
+    def test_tests_use_a_fast_hasher(self):
+        self.assertTrue(User.objects.get(pk=self.u1.pk).password.startswith('md5$'))
+
+    def test_login_attempts_are_throttled_per_username(self):
+        rates = {'login': {'username': '2/m'}}
+        with override_settings(THROTTLE={'ENABLED': True, 'STORE': 'locmem', 'PATH': None, 'RATES': rates}), \
+                mock.patch.dict('KindaEbay.throttle._stores', clear=True):
+            for _ in range(2):
+                response = self.client.post('/login/', {'username': 'testuser', 'password': 'mytestpassword'})
+                self.assertEqual(response.status_code, 302)
+            response = self.client.post('/login/', {'username': 'TestUser', 'password': 'mytestpassword'})
+            self.assertEqual(response.status_code, 429)
+            self.assertTrue(response.has_header('Retry-After'))
+
+
+class SessionTest(TestDataMixin, TestCase):
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_cached_sessions_skip_the_session_table(self):
+        self.client.force_login(self.u1)
+        sql = []
+
+        def record(execute, query, params, many, context):
+            sql.append(query)
+            return execute(query, params, many, context)
+        with connection.execute_wrapper(record):
+            response = self.client.get('/my-listings/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([q for q in sql if 'django_session' in q], [])
+
+    def test_purge_sessions(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key='expired%d' % i, session_data='',
+                                   expire_date=now - datetime.timedelta(days=1))
+        Session.objects.create(session_key='current', session_data='', expire_date=now + datetime.timedelta(days=1))
+        out = StringIO()
+        call_command('purge_sessions', batch_size=2, pause=0, stdout=out)
+        self.assertIn('Deleted 5 expired session(s).', out.getvalue())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['current'])
+
+    def test_cached_sessions_need_a_shared_cache(self):
+        cached_db = 'django.contrib.sessions.backends.cached_db'
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'c'}}
+        with override_settings(SESSION_ENGINE=cached_db, CACHES=locmem):
+            self.assertEqual([e.id for e in checks.check_session_cache(None)], ['signup.E001'])
+        with override_settings(SESSION_ENGINE=cached_db, CACHES=shared):
+            self.assertEqual(checks.check_session_cache(None), [])
+        with override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db', CACHES=locmem):
+            self.assertEqual(checks.check_session_cache(None), [])
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_purge_without_session_table(self):
+        out = StringIO()
+        call_command('purge_sessions', stdout=out)
+        self.assertIn('nothing to purge', out.getvalue())
+
+
+@override_settings(PASSWORD_HASHERS=['signup.hashers.TunedPBKDF2PasswordHasher'])
+class TunedHasherTest(TestCase):
+
+    def test_rehashed_at_configured_cost_on_login(self):
+        with override_settings(PASSWORD_HASH_ITERATIONS=1000):
+            user = User.objects.create_user('hashuser', password='hashpassword')
+            self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+        with override_settings(PASSWORD_HASH_ITERATIONS=1500):
+            self.client.post('/login/', {'username': 'hashuser', 'password': 'hashpassword'})
+            user.refresh_from_db()
+            self.assertTrue(user.password.startswith('pbkdf2_sha256$1500$'))
+            self.assertTrue(user.check_password('hashpassword'))
@@ -2,10 +2,12 @@ from django.contrib.auth.forms import AuthenticationForm
 from django.http.response import HttpResponseRedirect
 from django.shortcuts import render, redirect
 from .forms import NewUserForm
-from django.contrib.auth import login, authenticate, logout
+from django.contrib.auth import login, logout
 from django.contrib import messages
+from KindaEbay.throttle import throttle
 
 
+@throttle('signup')
 def register_request(request):
     args = {}
     if request.method == "POST":
@@ -21,25 +23,21 @@ def register_request(request):
     return render(request=request, template_name="signup/signup.html", context={"register_form": form})
 
 
+@throttle('login')
 def login_request(request):
-    next = ""
-    if request.GET:
-        next = request.GET['next']
+    next = request.GET.get('next', "")
     if request.method == "POST":
         form = AuthenticationForm(request, data=request.POST)
+        # is_valid() authenticates (one password hash); reuse its user
+        # rather than hashing the password a second time.
         if form.is_valid():
-            username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password')
-            user = authenticate(username=username, password=password)
-            if user is not None:
-                login(request, user)
-                messages.info(request, f"You are now logged in as {username}.")
-                if next == "":
-                    return HttpResponseRedirect('/')
-                else:
-                    return HttpResponseRedirect(next)
+            user = form.get_user()
+            login(request, user)
+            messages.info(request, f"You are now logged in as {user.get_username()}.")
+            if next == "":
+                return HttpResponseRedirect('/')
             else:
-                messages.error(request, "Invalid username or password.")
+                return HttpResponseRedirect(next)
         else:
             messages.error(request, "Invalid username or password.")
     form = AuthenticationForm()